@@ -72,8 +72,13 @@ export function saveScheduleAPI(schedule) {
  * 自動計測の履歴を取得します。
  * @returns {Promise<Array>}
  */
-export function fetchHistoryAPI() {
-    return fetchJSON('/api/auto-history');
+export async function fetchHistoryAPI() {
+    // サーバーのETagで再検証させるため、キャッシュ回避用のクエリは付けない（未更新なら304で再利用される）
+    const response = await fetch('/api/auto-history', { cache: 'no-cache' });
+    if (!response.ok) {
+        throw new Error('Failed to fetch /api/auto-history');
+    }
+    return response.json();
 }
 
 /**
@@ -101,4 +106,56 @@ export async function downloadExcelAPI(data) {
         throw new Error(errorData.error || 'Excelファイルの生成に失敗しました。');
     }
     return response.blob();
-}
\ No newline at end of file
+}
+/**
+ * 計測ジョブを登録します。計測はサーバー側のキューで順番に実行されます。
+ * @param {string} url - 計測APIのURL
+ * @param {object} [data] - POSTで送信するデータ。省略時はGETで登録します
+ * @returns {Promise<number>} - ジョブID
+ */
+export async function enqueueJobAPI(url, data) {
+    if (data !== undefined) {
+        return (await postJSON(url, data)).job_id;
+    }
+    const response = await fetch(url);
+    const result = await response.json();
+    if (!response.ok) {
+        throw new Error(result.error || 'Request failed');
+    }
+    return result.job_id;
+}
+
+/**
+ * 計測ジョブの進捗を受け取ります。
+ * 接続が切れてもブラウザが自動で再接続し (Last-Event-ID)、受け取っていない進捗から続けて受け取ります。
+ * @param {number} jobId - ジョブID
+ * @param {function(object): void} onData - 進捗ごとに呼ばれる関数。例外を投げると受信を終了します
+ * @returns {Promise<string>} - ジョブの終了状態 (completed / failed / interrupted)
+ */
+export function streamJobEventsAPI(jobId, onData) {
+    return new Promise((resolve, reject) => {
+        const eventSource = new EventSource(`/api/jobs/${jobId}/events`);
+
+        eventSource.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.job_status) {
+                eventSource.close();
+                resolve(data.job_status);
+                return;
+            }
+            try {
+                onData(data);
+            } catch (error) {
+                eventSource.close();
+                reject(error);
+            }
+        };
+
+        eventSource.onerror = () => {
+            // 再接続中 (CONNECTING) はブラウザに任せ、再接続できない場合のみエラーにする
+            if (eventSource.readyState === EventSource.CLOSED) {
+                reject(new Error('サーバーとの接続に失敗しました。'));
+            }
+        };
+    });
+}
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, current_app, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import requests
 import random
@@ -11,6 +11,8 @@ import json
 import datetime
 import traceback # エラー詳細ログのためにインポート
 import tempfile # 一時ファイル作成用
+import gzip
+import hashlib
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
@@ -26,8 +28,16 @@ import threading # ロック機能のためにインポート
 from utils import sse_format, get_lat_lng_from_address # 共通関数をインポート
 from hpb_scraper import check_hotpepper_ranking
 from meo_scraper import check_meo_ranking
-from task_runner import run_scheduled_check, update_history
-from driver_manager import get_webdriver
+from task_runner import run_scheduled_check, record_history, load_history, save_history, get_history_version
+from history_index import HistoryIndex
+from json_cache import load_json_file, save_json_file, get_cache_stats # JSONファイルの読み書き (キャッシュ付き)
+import rank_journal
+import serp_cache # 検索結果キャッシュ
+import screenshot_store
+import run_manifest # 自動計測の実行記録 (途中で終わった計測の再開用)
+from job_queue import get_job_queue # 計測ジョブのキュー
+from events import Status, Completed, Error
+from driver_manager import get_webdriver, prewarm_webdrivers
 from excel_generator import create_excel_report # Excel生成関数をインポート
 from salon_board_automator import post_blog_to_store # Step2で作成するファイルをインポート
 import config # 設定ファイルをインポート
@@ -48,22 +58,51 @@ if not config.GOOGLE_API_KEY:
 SALON_BOARD_SETTINGS_FILE = 'salon_board_settings.json'
 # --- グローバル変数と設定 ---
 
-# --- 計測ジョブの同時実行を防ぐためのロック ---
-measurement_lock = threading.Lock()
+# --- 計測ジョブ ---
+# 計測はリクエストの処理とは別に job_queue のワーカーで実行し、同時実行数はスロットごとに制限する
+# (1件の計測は single、履歴をまとめて書き込む処理は batch で1件ずつ)
+def _check_ranking_job(keyword, salon_name, area_codes, save_screenshot=True, force_refresh=False):
+    # ブラウザはスクレイパーが必要になった時点でプールから借りる（スクリーンショット不要ならHTTPのみで計測）
+    yield from check_hotpepper_ranking(None, keyword, salon_name, area_codes, save_screenshot=save_screenshot, force_refresh=force_refresh)
 
-# --- ヘルパー関数 (ファイルの読み書き) ---
-def load_json_file(filename):
-    if not os.path.exists(filename):
-        return []
+def _check_meo_ranking_job(keyword, location, force_refresh=False):
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return []
+        with get_webdriver() as driver:
+            yield from check_meo_ranking(driver, keyword, location, force_refresh=force_refresh)
+    except Exception as e:
+        app.logger.error(f"MEO計測でのWebDriver生成中にエラー: {e}")
+        yield Error("ブラウザの起動に失敗しました。")
 
-def save_json_file(filename, data):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _check_feature_page_ranking_job(feature_page_url, salon_names, force_refresh=False):
+    try:
+        yield Status("ブラウザを起動しています...")
+        with get_webdriver() as driver:
+            yield from check_feature_page_ranking(driver, feature_page_url, salon_names, force_refresh=force_refresh)
+    except Exception as e:
+        app.logger.error(f"特集ページ計測でのWebDriver生成中にエラー: {e}")
+        yield Error("ブラウザの起動に失敗しました。")
+
+def _run_tasks_job(task_ids=None, save_screenshot=True, force_refresh=False, trigger='manual'):
+    yield from run_scheduled_check(task_ids_to_run=task_ids, stream_progress=True, save_screenshot=save_screenshot, force_refresh=force_refresh, trigger=trigger)
+
+def _resume_run_job(run_id):
+    yield from run_scheduled_check(stream_progress=True, resume_run_id=run_id)
+
+def _screenshot_gc_job():
+    """スクリーンショットの保持期間を適用し、履歴から参照されなくなったファイルを削除する"""
+    stats = screenshot_store.run_gc()
+    message = (f"スクリーンショットを整理しました。参照を外した履歴: {stats['rows_pruned']}件 / "
+               f"削除: {stats['deleted']}ファイル ({stats['bytes_freed'] / 1024 / 1024:.1f}MB)")
+    app.logger.info(message)
+    yield Completed(message)
+
+job_queue = get_job_queue()
+job_queue.register('check_ranking', _check_ranking_job)
+job_queue.register('check_meo_ranking', _check_meo_ranking_job)
+job_queue.register('check_feature_page_ranking', _check_feature_page_ranking_job)
+job_queue.register('run_tasks', _run_tasks_job, slot='batch')
+job_queue.register('resume_run', _resume_run_job, slot='batch')
+job_queue.register('screenshot_gc', _screenshot_gc_job, slot='batch')
 
 # --- エラーハンドリング ---
 @app.errorhandler(400)
@@ -95,12 +134,18 @@ def serve_onedrive_screenshots(filename):
     directory = '/Users/satoudaisuke/Library/CloudStorage/OneDrive-合同会社リビジョン/画像/salon/screenshots'
     return send_from_directory(directory, filename)
 
+def _enqueue_response(job_type, **params):
+    """計測ジョブをキューに登録し、ジョブIDと進捗のストリームのURLを返す (202 Accepted)"""
+    job_id = job_queue.enqueue(job_type, **params)
+    return jsonify({"job_id": job_id, "events_url": f"/api/jobs/{job_id}/events"}), 202
+
 @app.route('/check-ranking', methods=['GET', 'POST'])
 def check_ranking_api():
     save_screenshot = True
     if request.method == 'POST':
         data = request.get_json()
         save_screenshot = data.get('save_screenshot', True)
+        force_refresh = data.get('force_refresh', False)
     else: # GETリクエストの場合
         data = {
             'serviceKeyword': request.args.get('serviceKeyword'),
@@ -109,127 +154,101 @@ def check_ranking_api():
         }
         if request.args.get('save_screenshot'):
             save_screenshot = request.args.get('save_screenshot').lower() == 'true'
+        force_refresh = request.args.get('force_refresh', '').lower() == 'true'
 
-    serviceKeyword = data['serviceKeyword']
-    salonName = data['salonName']
-    areaCodes = data['areaCodes']
-    
-    app.logger.info(f"check_ranking_api called. save_screenshot={save_screenshot}")
-
-    if not measurement_lock.acquire(blocking=False):
-        return jsonify({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"}), 429 # Too Many Requests
-
-    def generate_stream():
-        try:
-            try:
-                yield sse_format({"status": "ブラウザを起動しています..."})
-                with get_webdriver() as driver:
-                    try:
-                        yield from check_hotpepper_ranking(driver, serviceKeyword, salonName, areaCodes, save_screenshot=save_screenshot)
-                    except TypeError as e:
-                        if "unexpected keyword argument 'save_screenshot'" in str(e):
-                            app.logger.warning("check_hotpepper_rankingはsave_screenshot引数をサポートしていません。引数なしで実行します。")
-                            yield from check_hotpepper_ranking(driver, serviceKeyword, salonName, areaCodes)
-                        else:
-                            raise e
-            except Exception as e:
-                app.logger.error(f"手動計測中にエラー: {e}\n{traceback.format_exc()}")
-                yield sse_format({"error": f"計測中にエラーが発生しました: {str(e)}"})
-        finally:
-            measurement_lock.release() # ストリームが終了したら必ずロックを解放
-
-    # ストリーミングレスポンスを返す
-    return app.response_class(generate_stream(), mimetype='text/event-stream')
+    app.logger.info(f"check_ranking_api called. save_screenshot={save_screenshot}, force_refresh={force_refresh}")
+    return _enqueue_response(
+        'check_ranking',
+        keyword=data['serviceKeyword'], salon_name=data['salonName'], area_codes=data['areaCodes'],
+        save_screenshot=save_screenshot, force_refresh=force_refresh
+    )
 
 @app.route('/check-meo-ranking', methods=['GET'])
 def check_meo_ranking_api():
     keyword = request.args.get('keyword')
     location = request.args.get('location')
-
-    if not measurement_lock.acquire(blocking=False):
-        return jsonify({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"}), 429
-
-    def generate_stream():
-        try:
-            try:
-                with get_webdriver() as driver:
-                    yield from check_meo_ranking(driver, keyword, location)
-            except Exception as e:
-                app.logger.error(f"MEO計測でのWebDriver生成中にエラー: {e}")
-                yield sse_format({"error": "ブラウザの起動に失敗しました。"})
-        finally:
-            measurement_lock.release()
-
-    return app.response_class(generate_stream(), mimetype='text/event-stream')
+    force_refresh = request.args.get('force_refresh', '').lower() == 'true'
+    return _enqueue_response('check_meo_ranking', keyword=keyword, location=location, force_refresh=force_refresh)
 
 # --- 特集ページ一括計測API ---
 @app.route('/api/run-feature-page-tasks', methods=['GET'])
 def run_feature_page_tasks_api():
     feature_page_url = request.args.get('featurePageUrl')
-    salon_names_json = request.args.get('salonNames')
-
-    salon_names = json.loads(salon_names_json)
-
-    if not measurement_lock.acquire(blocking=False):
-        return jsonify({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"}), 429
-
-    def generate_stream():
-        try:
-            try:
-                with get_webdriver() as driver:
-                    # 特集ページ用のスクレイパーを呼び出す
-                    yield from check_feature_page_ranking(driver, feature_page_url, salon_names)
-            except Exception as e:
-                app.logger.error(f"特集ページ一括計測でのWebDriver生成中にエラー: {e}")
-                yield sse_format({"error": "ブラウザの起動に失敗しました。"})
-        finally:
-            measurement_lock.release()
-
-    return app.response_class(generate_stream(), mimetype='text/event-stream')
+    salon_names = json.loads(request.args.get('salonNames'))
+    force_refresh = request.args.get('force_refresh', '').lower() == 'true'
+    return _enqueue_response('check_feature_page_ranking', feature_page_url=feature_page_url, salon_names=salon_names, force_refresh=force_refresh)
 
 # --- 特集ページ順位計測API ---
 @app.route('/check-feature-page-ranking', methods=['GET'])
 def check_feature_page_ranking_api():
     feature_page_url = request.args.get('featurePageUrl')
     salon_name = request.args.get('salonName')
-
-    if not measurement_lock.acquire(blocking=False):
-        return jsonify({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"}), 429
+    force_refresh = request.args.get('force_refresh', '').lower() == 'true'
+    return _enqueue_response('check_feature_page_ranking', feature_page_url=feature_page_url, salon_names=[salon_name], force_refresh=force_refresh)
+
+# --- 計測ジョブAPI ---
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs_api():
+    """計測ジョブの一覧を、新しい順に返す"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"jobs": job_queue.list_jobs(limit=limit)})
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job_api(job_id):
+    """計測ジョブの状態を返す"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "指定されたジョブが見つかりません。"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<int:job_id>/events', methods=['GET'])
+def job_events_api(job_id):
+    """
+    計測ジョブの進捗を Server-Sent Events で返す。ジョブが終了し、すべての進捗を送ると接続を閉じる。
+    再接続時はブラウザが送る Last-Event-ID (またはクエリの last_event_id) より後の進捗から送る。
+    """
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "指定されたジョブが見つかりません。"}), 404
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_seq = 0
 
     def generate_stream():
-        try:
-            try:
-                yield sse_format({"status": "ブラウザを起動しています..."})
-                with get_webdriver() as driver:
-                    # 特集ページ用のスクレイパーを呼び出す
-                    yield from check_feature_page_ranking(driver, feature_page_url, [salon_name])
-            except Exception as e:
-                app.logger.error(f"特集ページ計測でのWebDriver生成中にエラー: {e}")
-                yield sse_format({"error": "ブラウザの起動に失敗しました。"})
-        finally:
-            measurement_lock.release()
+        for item in job_queue.follow(job_id, last_seq, keepalive=config.JOB_QUEUE_SSE_KEEPALIVE_SECONDS):
+            if item is None:
+                yield ": keepalive\n\n" # 接続維持用のコメント (ブラウザ側では無視される)
+                continue
+            seq, data = item
+            yield sse_format(data, event_id=seq)
+
+    return app.response_class(generate_stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-    return app.response_class(generate_stream(), mimetype='text/event-stream')
+
+@app.route('/debug-artifacts/<path:filename>')
+def serve_debug_artifact(filename):
+    """エラー発生時などに保存した、取得ページのHTML (デバッグ用ファイル) を配信する"""
+    return send_from_directory(os.path.abspath(config.DEBUG_ARTIFACT_DIR), filename, mimetype='text/plain')
 
 
 @app.route('/api/auto-tasks', methods=['GET', 'POST'])
 def handle_auto_tasks():
     if request.method == 'GET':
         # ファイルが存在しない場合や空の場合のハンドリングを追加
-        tasks = load_json_file(config.TASKS_FILE)
+        tasks = load_json_file(config.TASKS_FILE, copy=False)
         return jsonify(tasks)
     if request.method == 'POST':
         tasks = request.get_json()
-        save_json_file(config.TASKS_FILE, tasks)
+        save_json_file(config.TASKS_FILE, tasks, indent=2)
         return jsonify({"message": "設定を保存しました"}), 200
 
 @app.route('/api/salon-board/settings', methods=['GET', 'POST'])
 def handle_salon_board_settings():
     if request.method == 'GET':
-        return jsonify(load_json_file(SALON_BOARD_SETTINGS_FILE))
+        return jsonify(load_json_file(SALON_BOARD_SETTINGS_FILE, copy=False))
     elif request.method == 'POST':
         data = request.get_json()
-        save_json_file(SALON_BOARD_SETTINGS_FILE, data)
+        save_json_file(SALON_BOARD_SETTINGS_FILE, data, indent=2)
         return jsonify({"message": "設定を保存しました"}), 200
 
 @app.route('/api/save-auto-history-entry', methods=['POST'])
@@ -244,27 +263,140 @@ def save_auto_history_entry():
     task_id = task['id']
     today = datetime.date.today().strftime('%Y/%m/%d')
     
-    # --- タスクタイプに応じた履歴ファイル名を取得 ---
-    history_filename = config.HISTORY_FILES.get(task.get('type', 'normal'))
-    if not history_filename:
+    # --- タスクタイプに応じた履歴の種類を確認 ---
+    history_type = task.get('type', 'normal')
+    if history_type not in config.HISTORY_FILES:
         app.logger.warning(f"不明なタスクタイプの履歴は保存できません: {task.get('type')}")
         return jsonify({"error": "不明なタスクタイプです"}), 400
 
-    history = load_json_file(history_filename)
+    history = HistoryIndex(load_history(history_type))
     
-    # update_history関数を呼び出す
-    update_history(history, task, today, result.get('rank', '圏外'), result.get('screenshot_path'))
-
-    save_json_file(history_filename, history)
+    # record_history関数で履歴の更新と保存を行う
+    record_history(history_type, history, task, today, result.get('rank', '圏外'), result.get('screenshot_path'))
     return jsonify({"message": f"タスク '{task_id}' の履歴を保存しました。"}), 200
 
+# --- 履歴APIのレスポンスキャッシュ (ETag -> 圧縮済みレスポンス) ---
+HISTORY_RESPONSE_CACHE_SIZE = 8
+_history_response_cache = {}
+_history_response_cache_lock = threading.Lock()
+
+def _filter_history(history_types, task_ids, salon_name, date_from, date_to):
+    """履歴を条件で絞り込む。日付範囲が指定された場合は各タスクのログも範囲内に絞る"""
+    items = []
+    for history_type in history_types:
+        for item in load_history(history_type, copy=False):
+            if task_ids and item.get('id') not in task_ids:
+                continue
+            if salon_name and salon_name not in item.get('task', {}).get('salonName', ''):
+                continue
+            if date_from or date_to:
+                # 'YYYY/MM/DD' は文字列比較で時系列順になる
+                log = [entry for entry in item.get('log', [])
+                       if (not date_from or entry['date'] >= date_from) and (not date_to or entry['date'] <= date_to)]
+                item = {**item, 'log': log}
+            items.append(item)
+    return items
+
+def _use_gzip():
+    return 'gzip' in request.accept_encodings
+
+def _representation_etag(etag):
+    """gzip圧縮したレスポンスと圧縮していないレスポンスで、異なるETagを返す"""
+    return f"{etag}-gzip" if _use_gzip() else etag
+
+def _compressed_json_response(payload, etag, last_modified):
+    """JSONをエンコードし、クライアントが対応していればgzip圧縮したレスポンスを返す"""
+    use_gzip = _use_gzip()
+    cache_key = (etag, use_gzip)
+    with _history_response_cache_lock:
+        body = _history_response_cache.get(cache_key)
+    if body is None:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=6)
+        with _history_response_cache_lock:
+            while len(_history_response_cache) >= HISTORY_RESPONSE_CACHE_SIZE:
+                _history_response_cache.pop(next(iter(_history_response_cache)))
+            _history_response_cache[cache_key] = body
+
+    response = app.response_class(body, mimetype='application/json')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    _set_validation_headers(response, etag, last_modified)
+    return response
+
+def _set_validation_headers(response, etag, last_modified=None):
+    """200と304のレスポンスに共通の、キャッシュの検証用ヘッダーを設定する"""
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache' # 毎回ETagで再検証させる
+    response.set_etag(_representation_etag(etag))
+    if last_modified:
+        response.last_modified = last_modified
+
 @app.route('/api/auto-history', methods=['GET'])
 def get_auto_history():
-    # --- 3つの履歴ファイルをマージして返す ---
-    all_history = []
-    for filename in config.HISTORY_FILES.values():
-        all_history.extend(load_json_file(filename))
-    return jsonify(all_history)
+    """
+    計測履歴を返す。クエリパラメータで絞り込み・ページングができる。
+    - type: 履歴の種類 (normal / special / google / seo)。カンマ区切りで複数指定可
+    - task_ids: タスクID。カンマ区切り、またはパラメータの複数指定
+    - salon: サロン名 (部分一致)
+    - date_from / date_to: ログの日付範囲 ('YYYY/MM/DD' または 'YYYY-MM-DD')
+    - limit / cursor: limit を指定すると {"items": [...], "next_cursor": ...} 形式で返す。
+      次のページは前回の next_cursor を cursor に指定して取得する
+    パラメータなしの場合は、従来どおり全履歴をマージしたリストを返す。
+    """
+    version, last_modified = get_history_version()
+    etag = hashlib.sha1(f"{version}?{request.query_string.decode('utf-8')}".encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(_representation_etag(etag)):
+        response = app.response_class(status=304)
+        _set_validation_headers(response, etag, last_modified)
+        return response
+
+    type_param = request.args.get('type')
+    history_types = type_param.split(',') if type_param else list(config.HISTORY_FILES.keys())
+    unknown_types = [t for t in history_types if t not in config.HISTORY_FILES]
+    if unknown_types:
+        return jsonify({"error": f"不明な履歴タイプです: {', '.join(unknown_types)}"}), 400
+
+    task_ids = set()
+    for value in request.args.getlist('task_ids'):
+        task_ids.update(task_id for task_id in value.split(',') if task_id)
+    salon_name = request.args.get('salon')
+    date_from = (request.args.get('date_from') or '').replace('-', '/')
+    date_to = (request.args.get('date_to') or '').replace('-', '/')
+
+    limit = None
+    if 'limit' in request.args:
+        limit = request.args.get('limit', type=int)
+        if limit is None or limit < 1:
+            return jsonify({"error": "limitには1以上の整数を指定してください。"}), 400
+
+    items = _filter_history(history_types, task_ids, salon_name, date_from, date_to)
+
+    if limit is None:
+        return _compressed_json_response(items, etag, last_modified)
+
+    # --- カーソルページング (カーソルは前ページ最後のタスクID) ---
+    start = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        position = next((i for i, item in enumerate(items) if item.get('id') == cursor), None)
+        if position is None:
+            return jsonify({"error": "cursorが無効です。最初のページから取得し直してください。"}), 400
+        start = position + 1
+    page = items[start:start + limit]
+    next_cursor = page[-1]['id'] if page and start + limit < len(items) else None
+    return _compressed_json_response({"items": page, "next_cursor": next_cursor, "total": len(items)}, etag, last_modified)
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_json_cache_stats():
+    """JSONファイルキャッシュのヒット/ミス回数を返す（監視用）"""
+    return jsonify(get_cache_stats())
+
+@app.route('/api/serp-cache-stats', methods=['GET'])
+def get_serp_cache_stats():
+    """検索結果キャッシュのヒット/ミス回数と保持件数を返す（監視用）"""
+    return jsonify(serp_cache.get_cache_stats())
 
 @app.route('/api/schedule', methods=['GET', 'POST'])
 def handle_schedule():
@@ -280,73 +412,70 @@ def handle_schedule():
         if not (isinstance(hour, int) and 0 <= hour <= 23 and isinstance(minute, int) and 0 <= minute <= 59):
             return "無効な時間です", 400
 
-        save_json_file(config.SCHEDULER_CONFIG_FILE, {"hour": hour, "minute": minute})
+        save_json_file(config.SCHEDULER_CONFIG_FILE, {"hour": hour, "minute": minute}, indent=2)
         return jsonify({"message": "実行時間を保存しました。変更を有効にするには、アプリケーションの再起動が必要です。"}), 200
 
 @app.route('/api/run-tasks-manually', methods=['GET', 'POST'])
 def run_tasks_manually():
     """
-    フロントエンドから手動でトリガーされた複数のタスクを、ストリーミングで実行・進捗報告するAPI。
-    ブラウザの起動を一度に抑えることで、リソース消費を削減する。
+    フロントエンドから手動でトリガーされた複数のタスクを、計測ジョブとして登録するAPI。
+    進捗は /api/jobs/<ジョブID>/events から受け取る。
     """
     save_screenshot = True
     if request.method == 'POST':
         data = request.get_json()
         task_ids = data.get('task_ids')
         save_screenshot = data.get('save_screenshot', True)
+        force_refresh = data.get('force_refresh', False)
     else:
         # GETリクエストの場合（旧バージョンとの互換性のため）
         task_ids_json = request.args.get('task_ids')
         task_ids = json.loads(task_ids_json) if task_ids_json else None
         if request.args.get('save_screenshot'):
             save_screenshot = request.args.get('save_screenshot').lower() == 'true'
+        force_refresh = request.args.get('force_refresh', '').lower() == 'true'
+
+    app.logger.info(f"run_tasks_manually called. save_screenshot={save_screenshot}, force_refresh={force_refresh}")
+    return _enqueue_response('run_tasks', task_ids=task_ids, save_screenshot=save_screenshot, force_refresh=force_refresh)
+
+@app.route('/api/runs', methods=['GET'])
+def list_runs_api():
+    """自動計測の実行記録の一覧を、新しい順に返す"""
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({"runs": [run_manifest.summarize(manifest) for manifest in run_manifest.list_runs(limit=limit)]})
+
+@app.route('/api/runs/<run_id>', methods=['GET'])
+def get_run_api(run_id):
+    """実行記録 (ジョブごとの状態を含む) を返す"""
+    manifest = run_manifest.load(run_id)
+    if manifest is None:
+        return jsonify({"error": "指定された実行が見つかりません。"}), 404
+    return jsonify(manifest)
+
+@app.route('/api/runs/<run_id>/resume', methods=['GET', 'POST'])
+def resume_run_api(run_id):
+    """途中で終わった実行のうち、終わっていないジョブだけを実行し直す計測ジョブを登録する"""
+    manifest = run_manifest.load(run_id)
+    if manifest is None:
+        return jsonify({"error": "指定された実行が見つかりません。"}), 404
+    if manifest['status'] not in run_manifest.RESUMABLE_STATUSES:
+        return jsonify({"error": f"この実行は再開できる状態ではありません。(状態: {manifest['status']})"}), 409
+
+    return _enqueue_response('resume_run', run_id=run_id)
 
-    app.logger.info(f"run_tasks_manually called. save_screenshot={save_screenshot}")
-
-    # --- 修正点: ストリーム開始前にロックを取得 ---
-    if not measurement_lock.acquire(blocking=False):
-        # すぐにエラーレスポンスを返すためのダミーのストリーム
-        def error_stream():
-            yield sse_format({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"})
-        return app.response_class(error_stream(), mimetype='text/event-stream')
-
-    def generate_stream():
-        try:
-            with app.app_context():
-                # run_scheduled_check と同様のロジックだが、進捗をyieldで返す
-                try:
-                    yield from run_scheduled_check(task_ids_to_run=task_ids, stream_progress=True, save_screenshot=save_screenshot)
-                except TypeError as e:
-                    if "unexpected keyword argument 'save_screenshot'" in str(e):
-                        app.logger.warning("run_scheduled_checkはsave_screenshot引数をサポートしていません。引数なしで実行します。")
-                        yield from run_scheduled_check(task_ids_to_run=task_ids, stream_progress=True)
-                    else:
-                        raise e
-        except Exception as e:
-            app.logger.error(f"run_tasks_manually error: {e}\n{traceback.format_exc()}")
-            yield sse_format({"error": f"システムエラーが発生しました: {str(e)}"})
-        finally:
-            measurement_lock.release() # ストリームが終了したら必ずロックを解放
-
-    return app.response_class(generate_stream(), mimetype='text/event-stream')
 @app.route('/api/run-auto-check-now', methods=['POST'])
 def run_auto_check_now_api():
     """【旧API・互換性のため残置】手動で自動計測ジョブをトリガーするAPI"""
-    data = request.get_json()
-    task_ids = data.get('task_ids') if data else None
+    data = request.get_json(silent=True)
+    task_ids = data.get('task_ids') if isinstance(data, dict) else None
+    # ジョブを登録する前に検証する (登録後にエラーを返すと、再試行で同じ計測が重複して登録されるため)
+    if task_ids is not None and not isinstance(task_ids, list):
+        return jsonify({"error": "task_idsはタスクIDのリストで指定してください。"}), 400
+    target = f"{len(task_ids)}件の" if task_ids else "すべての"
 
-    # --- ロックの取得を試みる ---
-    if not measurement_lock.acquire(blocking=False):
-        return jsonify({"error": "現在、他の計測タスクが実行中です。しばらく待ってから再度お試しください。"}), 429
-
-    try:
-        app.logger.info("手動での自動計測ジョブを開始します。")
-        # run_scheduled_checkはジェネレータなので、ループで回して実行させる
-        for _ in run_scheduled_check(task_ids_to_run=task_ids):
-            pass
-        return jsonify({"message": f"{len(task_ids)}件のタスクを実行しました。ページをリロードして結果を確認してください。"}), 200
-    finally:
-        measurement_lock.release()
+    job_id = job_queue.enqueue('run_tasks', task_ids=task_ids, trigger='manual')
+    app.logger.info(f"手動での自動計測ジョブ {job_id} を登録しました。")
+    return jsonify({"message": f"{target}タスクの計測を開始しました。完了後にページをリロードして結果を確認してください。", "job_id": job_id}), 202
 
 @app.route('/download_excel', methods=['POST'])
 def download_excel():
@@ -398,7 +527,7 @@ def post_blog_api():
         return jsonify({"status": "error", "message": "必須項目（店舗ID, タイトル, 本文, カテゴリ）が不足しています。"}), 400
 
     # 順位チェック実行中の警告ログ
-    if measurement_lock.locked():
+    if job_queue.is_busy():
         app.logger.warning("現在、順位チェック等の計測タスクが実行中です。PCの負荷が高まり、ブログ投稿処理が遅延またはタイムアウトする可能性があります。")
 
     # 画像ファイルがある場合、一時ファイルとして保存
@@ -449,24 +578,20 @@ def post_blog_api():
 scheduler = BackgroundScheduler(daemon=True)
 
 def scheduled_job_wrapper():
-    """スケジューラから呼び出されるラッパー関数"""
-    if not measurement_lock.acquire(blocking=False):
-        current_app.logger.warning("自動計測ジョブを開始しようとしましたが、既に別の計測が実行中のためスキップします。")
+    """スケジューラから呼び出されるラッパー関数。自動計測をジョブとして登録する"""
+    # 手動でのタスクの実行とは batch スロットで順番に実行されるため、実行待ちの自動計測が既にある場合のみ登録しない
+    if job_queue.has_pending('run_tasks', queued_only=True, trigger='scheduled'):
+        app.logger.warning("自動計測ジョブを登録しようとしましたが、既に自動計測が実行待ちのためスキップします。")
         return
-    with app.app_context():
-        try:
-            # run_scheduled_checkはジェネレータなので、ループで回して実行させる
-            for _ in run_scheduled_check():
-                pass
-        finally:
-            measurement_lock.release()
+    job_id = job_queue.enqueue('run_tasks', trigger='scheduled')
+    app.logger.info(f"自動計測ジョブ {job_id} を登録しました。")
 
 def load_scheduler_config():
     """スケジューラ設定を読み込む。なければデフォルト値を返す"""
     if not os.path.exists(config.SCHEDULER_CONFIG_FILE):
         return {"hour": 9, "minute": 0}
     try:
-        return load_json_file(config.SCHEDULER_CONFIG_FILE)
+        return load_json_file(config.SCHEDULER_CONFIG_FILE, copy=False)
     except Exception:
         return {"hour": 9, "minute": 0}
 
@@ -484,6 +609,20 @@ scheduler.add_job(
     misfire_grace_time=3600  # 実行予定時刻から1時間以内なら、遅れても実行する
 )
 
+def scheduled_screenshot_gc():
+    """スクリーンショットの整理をジョブとして登録する (履歴を書き換えるため、計測と同時には実行しない)"""
+    if not job_queue.has_pending('screenshot_gc'):
+        job_queue.enqueue('screenshot_gc')
+
+if config.SCREENSHOT_GC_HOUR is not None:
+    scheduler.add_job(
+        scheduled_screenshot_gc,
+        'cron',
+        hour=config.SCREENSHOT_GC_HOUR,
+        minute=0,
+        misfire_grace_time=3600
+    )
+
 # --- 起動時に一度だけ実行するデータ移行処理 ---
 def migrate_meo_history_ids():
     """
@@ -491,7 +630,7 @@ def migrate_meo_history_ids():
     この関数はアプリケーション起動時に一度だけ実行される。
     """
     with app.app_context():
-        history_meo = load_json_file(config.HISTORY_FILES['google'])
+        history_meo = load_history('google')
         updated = False
         for item in history_meo:
             task = item.get('task', {})
@@ -513,12 +652,49 @@ def migrate_meo_history_ids():
                     app.logger.warning(f"古いMEO履歴IDの形式が不正です。スキップします: {task_id}")
         
         if updated:
-            save_json_file(config.HISTORY_FILES['google'], history_meo)
+            save_history('google', history_meo)
             app.logger.info("MEO履歴IDの移行が完了しました。")
 
+def compact_history_journals():
+    """前回の計測中に追記されたまま残っている履歴ジャーナルを、起動時にスナップショットへ反映する"""
+    if config.HISTORY_BACKEND == 'sqlite' or not config.HISTORY_JOURNAL_ENABLED:
+        return
+    with app.app_context():
+        for history_type, count in rank_journal.compact_all().items():
+            if count:
+                app.logger.info(f"履歴ジャーナル ({history_type}) の {count}件 を履歴ファイルに反映しました。")
+
+def resume_interrupted_run():
+    """
+    前回のプロセスが計測の途中で終了していた (restart.sh による強制終了など) 場合に、
+    当日のスケジュール実行の終わっていないジョブだけを再開するジョブを登録する
+    """
+    with app.app_context():
+        for manifest in run_manifest.mark_interrupted():
+            app.logger.warning(f"実行 {manifest['run_id']} ({manifest['date']}) は途中で終了していました。")
+        if not config.RUN_AUTO_RESUME:
+            return
+        manifest = run_manifest.find_resumable(datetime.date.today().strftime('%Y/%m/%d'), trigger='scheduled')
+    if manifest and manifest['status'] == 'interrupted':
+        app.logger.info(f"途中で終了していた本日の自動計測 (実行 {manifest['run_id']}) を再開します。")
+        job_queue.enqueue('resume_run', run_id=manifest['run_id'])
+
+compact_history_journals()
 migrate_meo_history_ids()
+resume_interrupted_run()
+job_queue.start(app)
 
 scheduler.start()
+
+def _prewarm_webdrivers_in_background():
+    """初回の手動計測でChromeの起動を待たなくて済むよう、バックグラウンドでWebDriverを起動しておく"""
+    with app.app_context():
+        try:
+            prewarm_webdrivers()
+        except Exception as e:
+            app.logger.warning(f"WebDriverの事前起動に失敗しました: {e}")
+
+threading.Thread(target=_prewarm_webdrivers_in_background, daemon=True).start()
 app.logger.info(f"スケジューラを起動しました。毎日{run_hour:02d}:{run_minute:02d}に自動計測を実行します。(猶予時間: 1時間)")
 
 if __name__ == '__main__':
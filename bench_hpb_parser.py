@@ -0,0 +1,102 @@
+import argparse
+import glob
+import time
+
+from bs4 import BeautifulSoup
+
+from hpb_page_parser import parse_result_page
+
+"""
+hpb_page_parser (lxml + XPath) と、従来の BeautifulSoup による解析の結果の一致と速度を比較するベンチマーク。
+
+使い方:
+    python bench_hpb_parser.py 保存したページ.html [...]   # 保存済みの検索結果ページで比較
+    python bench_hpb_parser.py                              # HTMLを指定しない場合は、検索結果ページを模したHTMLで比較
+"""
+
+def parse_with_beautifulsoup(html):
+    """変更前のスクレイパーと同じ方法で値を取り出す（比較用）"""
+    soup = BeautifulSoup(html, 'lxml')
+    current_page_span = soup.select_one('ul.paging span.current')
+    count_span = soup.select_one('span.numberOfResult')
+    return {
+        "current_page": current_page_span.get_text(strip=True) if current_page_span else None,
+        "total_count": count_span.get_text(strip=True) if count_span else None,
+        "salon_names": [tag.get_text(strip=True) for tag in soup.select('h3.slcHead a')],
+        "title": soup.title.string.strip() if soup.title and soup.title.string else None,
+    }
+
+def parse_with_fast_parser(html):
+    page = parse_result_page(html)
+    return {
+        "current_page": page.current_page,
+        "total_count": page.total_count,
+        "salon_names": page.salon_names,
+        "title": page.title,
+    }
+
+def build_sample_page(page=2, salons_per_page=20, filler_blocks=400):
+    """検索結果ページを模したHTML（サロン一覧の周囲に大量のマークアップを含む）を作る"""
+    filler = ''.join(
+        f'<div class="filler"><ul>{"".join(f"<li><a href=/x/{i}/{j}>項目{j}</a></li>" for j in range(10))}</ul>'
+        f'<script>var x{i} = {i};</script></div>'
+        for i in range(filler_blocks)
+    )
+    salons = ''.join(
+        f'<li class="searchListCassette"><div class="slnCassetteHeader"><h3 class="slcHead cFS14">'
+        f'<a href="/slnH{i:09d}/"> サロン <span>{i}</span> 店 </a></h3>'
+        f'<p class="slcCatch">キャッチコピー{i}</p><img src="/img/{i}.jpg" alt=""></div></li>'
+        for i in range(salons_per_page)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title> ネイル・まつげサロン検索 </title></head><body>'
+        f'{filler}<p class="pa bottom0 right0">全<span class="numberOfResult">87</span>件</p>'
+        f'<ul class="slnCassetteList">{salons}</ul>'
+        f'<ul class="paging jscPagingParents"><li><a href="?pn=1">1</a></li><li><span class="current">{page}</span></li></ul>'
+        f'{filler}</body></html>'
+    )
+
+def measure(func, html, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    return (time.perf_counter() - started) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="HPB検索結果ページの解析方法の一致・速度を比較します。")
+    parser.add_argument('paths', nargs='*', help="比較に使う保存済みHTMLファイル (globパターン可)")
+    parser.add_argument('--repeat', type=int, default=20, help="1ページあたりの計測回数")
+    args = parser.parse_args()
+
+    pages = []
+    for pattern in args.paths:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append((path, f.read()))
+    if not pages:
+        pages = [("(サンプルHTML)", build_sample_page())]
+
+    total_slow = total_fast = 0
+    mismatches = 0
+    for name, html in pages:
+        expected = parse_with_beautifulsoup(html)
+        actual = parse_with_fast_parser(html)
+        if expected != actual:
+            mismatches += 1
+            print(f"[不一致] {name}")
+            for key in expected:
+                if expected[key] != actual[key]:
+                    print(f"    {key}: BeautifulSoup={expected[key]!r} / hpb_page_parser={actual[key]!r}")
+        slow = measure(parse_with_beautifulsoup, html, args.repeat)
+        fast = measure(parse_with_fast_parser, html, args.repeat)
+        total_slow += slow
+        total_fast += fast
+        print(f"{name}: {len(html) / 1024:.0f}KB  BeautifulSoup {slow * 1000:.1f}ms / hpb_page_parser {fast * 1000:.1f}ms  ({slow / fast:.1f}倍)")
+
+    print(f"合計: BeautifulSoup {total_slow * 1000:.1f}ms / hpb_page_parser {total_fast * 1000:.1f}ms  "
+          f"({total_slow / total_fast:.1f}倍)  不一致: {mismatches}/{len(pages)}ページ")
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -23,32 +23,121 @@ HISTORY_FILES = {
     'seo': 'history_seo.json'
 }
 
+# 計測履歴の保存方式 ('json': history_*.json を直接読み書き / 'sqlite': HISTORY_DB_FILE に保存)
+# 'sqlite' に切り替えると、初回起動時に既存の history_*.json を自動で取り込みます。
+HISTORY_BACKEND = 'json'
+# SQLiteで履歴を保存する場合のデータベースファイル
+HISTORY_DB_FILE = 'history.sqlite3'
+# 自動計測中の履歴ファイル (JSON) の書き込み間隔（秒）。この間の結果はまとめて1回で保存する
+HISTORY_FLUSH_INTERVAL = 30
+# 計測結果をジャーナル (history_*.json + HISTORY_JOURNAL_SUFFIX) に1行ずつ追記して保存するか
+# 有効な場合、history_*.json への反映は自動計測の終了時とアプリ起動時にまとめて行う
+HISTORY_JOURNAL_ENABLED = True
+HISTORY_JOURNAL_SUFFIX = '.journal.jsonl'
+# 自動計測の実行記録 (マニフェスト) の保存先と、保存しておく件数。途中で終わった計測を、終わっていないジョブから再開するために使う
+RUN_MANIFEST_DIR = 'run_manifests'
+RUN_MANIFEST_MAX_FILES = 60
+# Trueの場合、起動時に当日のスケジュール実行が途中で終わっていれば、終わっていないジョブを自動で再開する
+RUN_AUTO_RESUME = True
+# 1つのジョブを実行する最大回数。途中で終わった計測を再開しても終わらないジョブ (プロセスを終了させてしまうものなど) は、この回数で打ち切る
+RUN_MAX_JOB_ATTEMPTS = 2
+# 計測ジョブのキュー (ジョブと進捗の保存先)。APIはジョブを登録してジョブIDを返し、計測はワーカーで実行する
+JOB_QUEUE_DB_FILE = 'job_queue.sqlite3'
+# ジョブの種類 (スロット) ごとの同時実行数
+# single: 手動での1件の計測 (ブラウザを1つ使う) / batch: 自動計測・タスクの一括実行など履歴をまとめて書き込む処理
+JOB_QUEUE_SLOTS = {'single': 2, 'batch': 1}
+# 終了したジョブと進捗を保存しておく日数
+JOB_QUEUE_RETENTION_DAYS = 7
+# 進捗のストリーム (SSE) で、新しい進捗がない間に接続維持用のコメントを送る間隔（秒）
+JOB_QUEUE_SSE_KEEPALIVE_SECONDS = 15
+
 # --- スクレイピング共通設定 ---
 # Seleniumのページ読み込みタイムアウト時間（秒）
 WEBDRIVER_TIMEOUT = 30
+# 起動済みのWebDriver (Chrome) を再利用するプールの設定
+# プールに待機させておく最大台数（計測ワーカー数以上にしておくと、並列計測でも毎回の起動が不要になる）
+WEBDRIVER_POOL_MAX_IDLE = 3
+# 1台のWebDriverを使い続ける最大時間（秒）と最大貸し出し回数。超えたものは破棄して起動し直す
+WEBDRIVER_MAX_AGE = 1800
+WEBDRIVER_MAX_USES = 50
+# アプリ起動時にあらかじめ起動しておくWebDriverの台数
+WEBDRIVER_PREWARM_COUNT = 1
 # スクリーンショットの保存先ディレクトリ
 SCREENSHOT_DIR = "/Users/satoudaisuke/Library/CloudStorage/OneDrive-合同会社リビジョン/画像/salon/screenshots"
 # スクリーンショットのJPEG品質 (0-95の範囲で設定)
 SCREENSHOT_JPEG_QUALITY = 15
+# スクリーンショットのJPEG変換・保存をバックグラウンドで行うスレッド数
+SCREENSHOT_ENCODE_WORKERS = 2
+# ページ全体を撮影する場合の高さの上限 (px)。Chromeが1枚の画像として扱える大きさ (16384px) を超えないようにする
+SCREENSHOT_MAX_HEIGHT = 15000
+# 履歴画面用サムネイルの幅 (px) とJPEG品質
+SCREENSHOT_THUMBNAIL_WIDTH = 320
+SCREENSHOT_THUMBNAIL_QUALITY = 60
+# スクリーンショットの保持期間 (日)。DAILY_DAYS 日以内はすべて、WEEKLY_DAYS 日以内は週1件を残し、それより古いものは削除する
+SCREENSHOT_RETENTION_DAILY_DAYS = 30
+SCREENSHOT_RETENTION_WEEKLY_DAYS = 365
+# 撮影から履歴に記録されるまでの間に削除しないよう、更新からこの時間 (時間) 以内のファイルは削除しない
+SCREENSHOT_GC_GRACE_HOURS = 24
+# 保持期間の適用と未参照ファイルの削除を毎日実行する時刻 (時)。None の場合は自動では実行しない
+# 履歴のスクリーンショットの参照を書き換えるため、`python screenshot_store.py gc --dry-run` で対象を確認してから設定する
+SCREENSHOT_GC_HOUR = None
 # デフォルトのUser-Agent
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+# 取得したページのHTMLを常にデバッグ用ファイルとして保存するか（Falseでもエラー発生時は保存する）
+SCRAPER_DEBUG_SAVE_HTML = False
+# デバッグ用ファイル (HTML) の保存先ディレクトリと、保存しておく最大件数（超えた分は古いものから削除）
+DEBUG_ARTIFACT_DIR = 'debug_artifacts'
+DEBUG_ARTIFACT_MAX_FILES = 200
 
 # --- ホットペッパービューティー (HPB) 関連設定 ---
 # HPB通常検索・特集検索での最大検索ページ数
 HPB_MAX_PAGES = 5
+# HPB通常検索の検索結果ページの取得方法
+#   'http': ブラウザを使わずHTTPで直接取得する（スクリーンショット撮影時・取得失敗時のみブラウザを使用）
+#   'selenium': すべてのページをブラウザで取得する
+HPB_FETCH_ENGINE = 'http'
+# HTTPで取得する場合のタイムアウト（秒）
+HPB_HTTP_TIMEOUT = 15
+# HTTPで取得する場合に、2ページ目以降を同時に取得する最大ページ数 (1にすると1ページずつ順番に取得する)
+# 実際のリクエスト間隔は RATE_LIMITS の設定に従う
+HPB_CONCURRENT_PAGES = 4
+# 自動計測で、対象サロンが見つかった時点で以降のページの検索を省略するか（履歴には最上位の順位のみ保存するため）
+SCHEDULED_STOP_ON_FIRST_MATCH = True
+
+# --- 検索結果キャッシュ (serp_cache.py) ---
+# 同じ検索条件の結果を再利用する期間（秒）。0にするとキャッシュを使わない
+SERP_CACHE_TTL = 1800
+# キャッシュに保持する検索条件の最大数（超えた場合は最も長く使われていないものから削除）
+SERP_CACHE_MAX_ENTRIES = 256
 # HPB特集ページのスクリーンショットファイル名に含めるタイトルの最大文字数
 HPB_SPECIAL_TITLE_MAX_LENGTH = 30
 
 # --- Google MEO/SEO 関連設定 ---
 # MEO計測時のスクロール回数（1回あたり約20件読み込む）
 MEO_SCROLL_COUNT = 3
+# MEO計測でスクロール後に新しい店舗の読み込みを待つ最大秒数（読み込まれ次第すぐに次へ進む）
+MEO_SCROLL_WAIT_TIMEOUT = 5
+# スクリーンショット撮影前に、結果一覧の高さが落ち着くのを待つ最大秒数
+MEO_SETTLE_TIMEOUT = 3
+# 地名から取得した座標のキャッシュファイル（同じ地名ではGeocoding APIを呼ばない）
+GEOCODE_CACHE_FILE = 'geocode_cache.json'
+# キャッシュした座標を使う最大日数（0にすると期限なし）
+GEOCODE_CACHE_MAX_AGE_DAYS = 180
 # SEO計測で1ページに表示する検索結果の数
 SEO_RESULTS_PER_PAGE = 100
 
 # --- 自動実行タスク関連設定 ---
-# 各タスク実行後のランダムな待機時間（秒）の範囲
-TASK_WAIT_TIME_MIN = 5
-TASK_WAIT_TIME_MAX = 15
+# 計測に使うブラウザ（ワーカー）の数。各ワーカーが共通のジョブ待ち行列から順にジョブを取り出して並列に処理する
+MEASUREMENT_WORKER_COUNT = 3
+
+# --- アクセス頻度の制限 (rate_limiter.py) ---
+# ホストごとのリクエスト頻度。ワーカー数に関係なくホストごとに全体で適用される
+#   rate: 1秒あたりのリクエスト数 / burst: 待たずに連続して送れる回数 / jitter: 待機時に加えるゆらぎの最大秒数
+RATE_LIMITS = {
+    'beauty.hotpepper.jp': {'rate': 0.5, 'burst': 3, 'jitter': 0.5},
+    'www.google.com': {'rate': 0.1, 'burst': 1, 'jitter': 3},
+    'default': {'rate': 1, 'burst': 1, 'jitter': 0},
+}
 
 # --- Excelレポート生成設定 ---
 # グラフ上で「圏外」や「エラー」を示すための数値
@@ -0,0 +1,52 @@
+import datetime
+import os
+import re
+import uuid
+
+from flask import current_app
+
+import config
+
+"""
+スクレイピングで取得したページのHTMLを、調査用のファイル (デバッグ用ファイル) として保存するモジュール。
+数MBになるHTMLを計測結果に含めて受け渡すのをやめ、エラーが発生した場合と
+config.SCRAPER_DEBUG_SAVE_HTML が有効な場合のみファイルに保存して、そのパスを結果に含めます。
+"""
+
+def _cleanup(directory):
+    """保存件数が config.DEBUG_ARTIFACT_MAX_FILES を超えた分を、古いものから削除する"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.html')]
+    except OSError:
+        return
+    excess = len(entries) - config.DEBUG_ARTIFACT_MAX_FILES
+    if excess <= 0:
+        return
+    for entry in sorted(entries, key=lambda e: e.stat().st_mtime)[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def save_html(html, label, force=False):
+    """
+    HTMLをデバッグ用ファイルに保存し、そのパスを返す。
+    :param label: ファイル名に含める識別用の文字列 (キーワードなど)
+    :param force: Trueの場合は設定に関係なく保存する (エラー発生時など)
+    :return: 保存したファイルのパス。保存しなかった・できなかった場合は None
+    """
+    if not html or not (force or config.SCRAPER_DEBUG_SAVE_HTML):
+        return None
+    directory = config.DEBUG_ARTIFACT_DIR
+    timestamp = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
+    safe_label = re.sub(r'[\\/:*?"<>|\s]', '_', label)[:50]
+    path = os.path.join(directory, f"{timestamp}_{safe_label}_{uuid.uuid4().hex[:8]}.html")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+    except OSError as e:
+        current_app.logger.warning(f"デバッグ用のHTMLを保存できませんでした: {e}")
+        return None
+    _cleanup(directory)
+    return path
@@ -1,3 +1,6 @@
+import atexit
+import threading
+import time
 from contextlib import contextmanager
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -5,9 +8,15 @@ from flask import current_app
 
 import config
 
-@contextmanager
-def get_webdriver(is_seo=False):
-    """WebDriverインスタンスを生成し、終了時にクリーンアップするコンテキストマネージャ"""
+"""
+Selenium WebDriver のライフサイクル管理。
+Chromeの起動には数秒かかるため、起動済みのWebDriverをプールしておき、計測のたびに貸し出します。
+貸し出しの前後でCookieや位置情報の上書き、ウィンドウサイズを初期状態に戻し、
+一定時間・一定回数使ったものや応答しなくなったものは破棄して作り直します。
+"""
+
+def _create_driver(is_seo=False):
+    """新しいWebDriver (ヘッドレスChrome) を起動する"""
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument(f"--window-size=1200,800")
@@ -19,15 +28,134 @@ def get_webdriver(is_seo=False):
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
 
-    driver = None
+    driver = webdriver.Chrome(options=chrome_options)
     try:
-        driver = webdriver.Chrome(options=chrome_options)
         driver.set_page_load_timeout(config.WEBDRIVER_TIMEOUT)
-        
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
         })
-        yield driver
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+
+class _PooledDriver:
+    __slots__ = ('driver', 'created_at', 'uses')
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+
+class WebDriverPool:
+    """起動済みのWebDriverを再利用するためのプール (オプションの組み合わせごとに1つ作る)"""
+
+    def __init__(self, is_seo, max_idle, max_age, max_uses):
+        self.is_seo = is_seo
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _is_expired(self, pooled):
+        return pooled.uses >= self.max_uses or time.monotonic() - pooled.created_at >= self.max_age
+
+    @staticmethod
+    def _is_healthy(pooled):
+        try:
+            return pooled.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """プールからWebDriverを取り出す。使えるものがなければ新しく起動する"""
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                return _PooledDriver(_create_driver(self.is_seo))
+            if not self._is_expired(pooled) and self._is_healthy(pooled):
+                return pooled
+            self._quit(pooled)
+
+    def _reset(self, pooled):
+        """次の利用者に状態を持ち越さないよう、Cookie・位置情報・ウィンドウサイズを初期化する"""
+        driver = pooled.driver
+        driver.get("about:blank")
+        driver.delete_all_cookies()
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        # MEO計測で設定した Emulation.setGeolocationOverride を解除する
+        driver.execute_cdp_cmd("Emulation.clearGeolocationOverride", {})
+        # スクリーンショット撮影のために広げたウィンドウを元のサイズに戻す
+        driver.set_window_size(1200, 800)
+
+    def release(self, pooled, discard=False):
+        """WebDriverをプールに戻す。異常があった場合や上限に達した場合は終了させる"""
+        pooled.uses += 1
+        if not discard and not self._is_expired(pooled):
+            try:
+                self._reset(pooled)
+            except Exception:
+                discard = True
+            else:
+                with self._lock:
+                    if len(self._idle) < self.max_idle:
+                        self._idle.append(pooled)
+                        return
+        self._quit(pooled)
+
+    def prewarm(self, count):
+        """あらかじめ count 台まで起動しておく"""
+        with self._lock:
+            missing = max(0, min(count, self.max_idle) - len(self._idle))
+        for _ in range(missing):
+            pooled = _PooledDriver(_create_driver(self.is_seo))
+            with self._lock:
+                self._idle.append(pooled)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._quit(pooled)
+
+
+_pools = {
+    is_seo: WebDriverPool(is_seo, config.WEBDRIVER_POOL_MAX_IDLE, config.WEBDRIVER_MAX_AGE, config.WEBDRIVER_MAX_USES)
+    for is_seo in (False, True)
+}
+
+@atexit.register
+def close_all_webdrivers():
+    """プールに残っているWebDriverをすべて終了する"""
+    for pool in _pools.values():
+        pool.close_all()
+
+def prewarm_webdrivers(count=None):
+    """通常計測用のWebDriverをあらかじめ起動しておく"""
+    _pools[False].prewarm(config.WEBDRIVER_PREWARM_COUNT if count is None else count)
+
+@contextmanager
+def get_webdriver(is_seo=False):
+    """プールからWebDriverを借り、終了時にプールへ返すコンテキストマネージャ"""
+    pool = _pools[is_seo]
+    pooled = pool.acquire()
+    discard = False
+    try:
+        yield pooled.driver
+    except BaseException:
+        # 利用中に例外が発生したブラウザは状態が不明なため再利用しない
+        discard = True
+        raise
     finally:
-        if driver:
-            driver.quit()
\ No newline at end of file
+        pool.release(pooled, discard=discard)
@@ -0,0 +1,87 @@
+"""
+スクレイパー・task_runner から呼び出し元に返す、計測の進捗・結果を表すイベント。
+プロセス内ではこのオブジェクトのまま受け渡し、ブラウザにストリーミングする時だけ
+app.py で to_dict() を Server-Sent Events の形式に変換します。
+"""
+
+class Status:
+    """処理の進捗メッセージ"""
+    __slots__ = ('message', 'task_name')
+
+    def __init__(self, message, task_name=None):
+        self.message = message
+        self.task_name = task_name
+
+    def to_dict(self):
+        data = {"status": self.message}
+        if self.task_name is not None:
+            data["task_name"] = self.task_name
+        return data
+
+
+class Progress:
+    """複数タスクの実行中に、何件目のタスクを開始したか"""
+    __slots__ = ('current', 'total', 'task')
+
+    def __init__(self, current, total, task):
+        self.current = current
+        self.total = total
+        self.task = task
+
+    def to_dict(self):
+        return {"progress": {"current": self.current, "total": self.total, "task": self.task}}
+
+
+class TaskResult:
+    """複数タスクの実行中に、1件のタスクの順位が確定した"""
+    __slots__ = ('rank', 'total_count', 'task_name', 'task_id')
+
+    def __init__(self, rank, total_count, task_name, task_id):
+        self.rank = rank
+        self.total_count = total_count
+        self.task_name = task_name
+        self.task_id = task_id
+
+    def to_dict(self):
+        return {"result": {"rank": self.rank, "total_count": self.total_count, "task_name": self.task_name, "task_id": self.task_id}}
+
+
+class FinalResult:
+    """スクレイパーの最終結果 (result は順位・総件数などの dict)"""
+    __slots__ = ('result',)
+
+    def __init__(self, result):
+        self.result = result
+
+    def to_dict(self):
+        return {"final_result": self.result, "status": "完了"}
+
+
+class Completed:
+    """複数タスクの実行がすべて終わった"""
+    __slots__ = ('message',)
+
+    def __init__(self, message):
+        self.message = message
+
+    def to_dict(self):
+        return {"final_status": self.message}
+
+
+class Error:
+    """エラー。url / html_path / screenshot_path は調査用の情報で、ある場合のみ含める"""
+    __slots__ = ('message', 'url', 'html_path', 'screenshot_path')
+
+    def __init__(self, message, url=None, html_path=None, screenshot_path=None):
+        self.message = message
+        self.url = url
+        self.html_path = html_path
+        self.screenshot_path = screenshot_path
+
+    def to_dict(self):
+        data = {"error": self.message}
+        for key in ('url', 'html_path', 'screenshot_path'):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        return data
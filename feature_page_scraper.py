@@ -1,68 +1,112 @@
-import time
-import datetime
-import os
-import json
-from bs4 import BeautifulSoup
+import math
+import re
+import contextlib
 from selenium.common.exceptions import TimeoutException
 from flask import current_app
-from PIL import Image
 import config
-
-def sse_format(data: dict) -> str:
-    """Server-Sent Eventsのフォーマットで文字列を返す"""
-    return f"data: {json.dumps(data)}\n\n"
-
-def check_feature_page_ranking(driver, feature_page_url, salon_names, save_screenshot=True):
+from rate_limiter import throttle
+import hpb_http_fetcher
+import screenshot_writer
+import serp_cache
+import debug_artifacts
+from events import Status, FinalResult, Error
+from hpb_page_parser import parse_result_page
+
+def check_feature_page_ranking(driver, feature_page_url, salon_names, save_screenshot=True, stop_on_first_match=False, force_refresh=False):
     """
     ホットペッパービューティーの特集ページ内での掲載順位をスクレイピングで取得するジェネレータ関数。
     :param driver: SeleniumのWebDriverインスタンス
     :param feature_page_url: 計測対象の特集ページのURL
     :param salon_names: 探したいサロン名のリスト
+    :param stop_on_first_match: Trueの場合、すべてのサロンが見つかった時点で以降のページを取得しない。
+                                省略したページ数は最終結果の pages_skipped に入る
+    :param force_refresh: Trueの場合、検索結果キャッシュ (serp_cache) を使わずに必ず取得し直す
     """
     found_salons_map = {name: [] for name in salon_names} # サロン名ごとに結果を格納
     total_count = 0
     screenshot_path = None
+    screenshot_future = None # スクリーンショットの保存の完了待ち
+    timings = {} # スクリーンショットの撮影・保存にかかった秒数
     page_title = "（タイトル取得失敗）"
+    pages_skipped = 0
+    ranking = [] # 取得したページに掲載されていたすべてのサロン (検索結果キャッシュ用)
+    complete = True
 
     last_url_checked = ""
     last_html_content = "リクエストが実行されませんでした。"
 
-    # スクリーンショット保存用ディレクトリを作成
-    if not os.path.exists(config.SCREENSHOT_DIR):
-        os.makedirs(config.SCREENSHOT_DIR)
+    # --- URL生成ロジックをパス形式に修正 ---
+    # 既に入力URLにページ番号が含まれている場合、それを除去してベースURLを正規化
+    base_url = re.sub(r'PN\d+/?$', '', feature_page_url)
+    # 末尾が'/'で終わるように調整
+    if not base_url.endswith('/'):
+        base_url += '/'
+
+    def build_url(page):
+        return base_url if page == 1 else f"{base_url}PN{page}/"
+
+    last_page = config.HPB_MAX_PAGES # 1ページ目の総件数から、実際に存在するページ数に絞り込む
+    prefetched_pages = None
+    resources = contextlib.ExitStack()
+
+    # 同じ特集ページの結果が直前に取得されていれば、アクセスせずにそれを使う
+    cache_key = serp_cache.make_key('feature', url=base_url)
+    cached = None if force_refresh else serp_cache.get(cache_key, require_screenshot=save_screenshot)
+    # 途中で打ち切ったスナップショット (自動計測の stop_on_first_match) は、同じく打ち切ってよい計測でのみ使う
+    cached_map = serp_cache.match(cached, salon_names, allow_incomplete=stop_on_first_match) if cached else None
+    if cached_map is not None:
+        yield Status(f"{serp_cache.age_minutes(cached)}分前に取得した検索結果を使用します。")
+        final_result = {
+            "total_count": cached['total_count'],
+            "screenshot_path": cached['screenshot_path'],
+            "url": cached['url'],
+            "page_title": cached['page_title'],
+            "pages_skipped": 0,
+            "results_map": cached_map,
+            "cached": True
+        }
+        yield FinalResult(final_result)
+        return
 
     try:
         # ページを1から順番にチェック（最大5ページ=100位まで）
         for page in range(1, config.HPB_MAX_PAGES + 1):
-            # --- URL生成ロジックをパス形式に修正 ---
-            base_url = feature_page_url
-            # 既に入力URLにページ番号が含まれている場合、それを除去してベースURLを正規化
-            import re
-            base_url = re.sub(r'PN\d+/?$', '', base_url)
-            # 末尾が'/'で終わるように調整
-            if not base_url.endswith('/'):
-                base_url += '/'
-
-            url = base_url if page == 1 else f"{base_url}PN{page}/"
-
-            yield sse_format({"status": f"{page}ページ目を検索しています..."})
-            try:
-                driver.get(url)
-                time.sleep(1)
-                current_app.logger.info(f"特集ページにアクセスしました: {url}")
-            except TimeoutException:
+            if page > last_page:
+                break
+            if stop_on_first_match and all(found_salons_map.values()):
+                pages_skipped = last_page - page + 1
+                current_app.logger.info(f"すべての対象サロンが見つかったため、残り{pages_skipped}ページの検索を省略します。")
                 break
+            url = build_url(page)
+
+            yield Status(f"{page}ページ目を検索しています...")
+            fetched = None
+            # 2ページ目以降は、並列にHTTPで取得したものを受け取る (取得できなかった場合はブラウザで開く)
+            if prefetched_pages is not None:
+                _, fetched = next(prefetched_pages)
+                if fetched is None:
+                    current_app.logger.info(f"特集ページ {page} をHTTPで取得できなかったため、ブラウザで取得します。")
+
+            if fetched:
+                last_html_content, last_url_checked = fetched
+            else:
+                try:
+                    throttle(url) # HPBへのアクセス頻度を制御
+                    driver.get(url)
+                    current_app.logger.info(f"特集ページにアクセスしました: {url}")
+                except TimeoutException:
+                    complete = False
+                    break
 
-            last_url_checked = driver.current_url
-            last_html_content = driver.page_source
-            soup = BeautifulSoup(last_html_content, 'lxml')
+                last_url_checked = driver.current_url
+                last_html_content = driver.page_source
+            parsed_page = parse_result_page(last_html_content)
 
             # ページネーションがスタックしていないか確認
             if page > 1:
-                current_page_span = soup.select_one('ul.paging span.current')
-                if current_page_span:
+                if parsed_page.current_page is not None:
                     try:
-                        current_page_num = int(current_page_span.get_text(strip=True)) # この行は変更なし
+                        current_page_num = int(parsed_page.current_page) # この行は変更なし
                         if current_page_num < page:
                             # 要求したページより前のページが表示されている場合、検索の終端とみなす
                             current_app.logger.info(f"ページネーションがスタックしました。要求ページ: {page}, 現在のページ: {current_page_num}。検索を終了します。")
@@ -76,70 +120,66 @@ def check_feature_page_ranking(driver, feature_page_url, salon_names, save_scree
 
             # 1ページ目でのみ各種情報を取得
             if page == 1:
-                page_title = soup.title.string.strip() if soup.title else "（タイトル不明）"
+                page_title = parsed_page.title or "（タイトル不明）"
                 if save_screenshot:
-                    yield sse_format({"status": "スクリーンショットを撮影しています..."})
-                    
-                    total_height = driver.execute_script("return document.body.parentNode.scrollHeight")
-                    driver.set_window_size(1200, total_height)
-                    time.sleep(0.5)
-
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    temp_png_path = os.path.join(config.SCREENSHOT_DIR, f"temp_special_{timestamp}.png")
-                    driver.save_screenshot(temp_png_path)
-
-                    jpeg_filename = f"screenshot_special_{timestamp}.jpg"
-                    jpeg_filepath = os.path.join(config.SCREENSHOT_DIR, jpeg_filename)
-                    
-                    try:
-                        with Image.open(temp_png_path) as img:
-                            if img.mode == 'RGBA':
-                                img = img.convert('RGB')
-                            img.save(jpeg_filepath, 'jpeg', quality=config.SCREENSHOT_JPEG_QUALITY)
-                        screenshot_path = jpeg_filepath
-                    finally:
-                        if os.path.exists(temp_png_path):
-                            os.remove(temp_png_path)
-
-                count_span = soup.select_one('span.numberOfResult')
-                if count_span:
+                    yield Status("スクリーンショットを撮影しています...")
+                    # ウィンドウサイズを変えずにページ全体を撮影し、JPEGへの変換・保存はバックグラウンドで行う
+                    screenshot_future = screenshot_writer.capture(driver, full_page=True, timings=timings)
+
+                if parsed_page.total_count is not None:
                     try:
-                        total_count = int(count_span.get_text(strip=True))
+                        total_count = int(parsed_page.total_count)
                         current_app.logger.info(f"総件数を取得: {total_count}件")
                     except (ValueError, TypeError):
                         total_count = 0
+                if total_count:
+                    last_page = min(config.HPB_MAX_PAGES, math.ceil(total_count / 20))
 
-            all_salons_on_page = soup.select('h3.slcHead a')
+            all_salons_on_page = parsed_page.salon_names
             if not all_salons_on_page:
                 current_app.logger.info(f"ページ {page} でサロンが見つかりませんでした。検索を終了します。")
                 break
 
-            for i, salon_tag in enumerate(all_salons_on_page):
-                current_salon_name = salon_tag.get_text(strip=True)
+            for i, current_salon_name in enumerate(all_salons_on_page):
+                ranking.append({"rank": (page - 1) * 20 + (i + 1), "name": current_salon_name})
                 # リストにあるすべてのサロン名と照合
                 for salon_name in salon_names:
                     if salon_name in current_salon_name:
                         rank = (page - 1) * 20 + (i + 1)
                         found_salons_map[salon_name].append({"rank": rank, "foundSalonName": current_salon_name})
 
+            # 2ページ目以降のURLは確定しているので、HTTPでまとめて並列に取得し始める
+            # (1ページ目で見つかり検索を終了する場合は取得しない)
+            if page == 1 and config.HPB_FETCH_ENGINE == 'http' and config.HPB_CONCURRENT_PAGES > 1 and last_page > 1 and not (stop_on_first_match and all(found_salons_map.values())):
+                prefetched_pages = resources.enter_context(contextlib.closing(
+                    hpb_http_fetcher.fetch_pages([build_url(p) for p in range(2, last_page + 1)], base_url)
+                ))
+
     except Exception as e:
         current_app.logger.error(f"特集ページ解析中にエラー: {e}")
         # エラー発生時にも、それまでに取得した情報を返す
-        yield sse_format({
-            "error": f"特集ページ解析中にエラー: {e}",
-            "url": last_url_checked,
-            "html": last_html_content,
-            "screenshot_path": screenshot_path
-        })
+        yield Error(
+            f"特集ページ解析中にエラー: {e}",
+            url=last_url_checked,
+            html_path=debug_artifacts.save_html(last_html_content, "special", force=bool(last_url_checked)),
+            screenshot_path=screenshot_writer.wait(screenshot_future)
+        )
         return
+    finally:
+        # 未取得ページのリクエストを取り消す
+        resources.close()
 
+    screenshot_path = screenshot_writer.wait(screenshot_future)
+    serp_cache.put(cache_key, ranking, total_count, complete=complete and not pages_skipped,
+                   url=last_url_checked, screenshot_path=screenshot_path, page_title=page_title)
     final_result = {
         "total_count": total_count,
         "screenshot_path": screenshot_path,
         "url": last_url_checked,
-        "html": last_html_content,
         "page_title": page_title,
+        "pages_skipped": pages_skipped,
+        "timings": timings,
         "results_map": found_salons_map # サロンごとの結果を返す
     }
     
-    yield sse_format({"final_result": final_result, "status": "完了"})
\ No newline at end of file
+    yield FinalResult(final_result)
\ No newline at end of file
@@ -364,6 +364,11 @@ function createHistoryTable(groupData, labels, activeSearchType, isHidden) {
                 td.style.cursor = 'pointer';
                 td.style.textDecoration = 'underline';
                 td.onclick = () => window.open(currentEntry.screenshot, '_blank');
+                const thumbnailUrl = getThumbnailUrl(currentEntry.screenshot);
+                if (thumbnailUrl) {
+                    td.onmouseenter = (event) => showThumbnailPreview(event, thumbnailUrl);
+                    td.onmouseleave = hideThumbnailPreview;
+                }
             }
             row.appendChild(td);
         });
@@ -374,6 +379,34 @@ function createHistoryTable(groupData, labels, activeSearchType, isHidden) {
     return tableContainer;
 }
 
+/**
+ * スクリーンショットのパスから、履歴表示用のサムネイルのパスを求めます。
+ * サムネイルはストア (…/store/ab/<ハッシュ値>.jpg) に保存されたものにだけあり、それ以外は null を返します。
+ */
+function getThumbnailUrl(screenshot) {
+    const match = screenshot && screenshot.match(/^(.*)\/store\/([0-9a-f]{2})\/([0-9a-f]{64})\.jpg$/);
+    return match ? `${match[1]}/thumbs/${match[2]}/${match[3]}.jpg` : null;
+}
+
+let thumbnailPreview = null;
+
+function showThumbnailPreview(event, url) {
+    if (!thumbnailPreview) {
+        thumbnailPreview = document.createElement('img');
+        thumbnailPreview.alt = 'スクリーンショット';
+        thumbnailPreview.style.cssText = 'position: fixed; z-index: 1000; max-width: 320px; border: 1px solid #ddd; box-shadow: 0 2px 8px rgba(0,0,0,0.2); background: #fff; pointer-events: none;';
+        document.body.appendChild(thumbnailPreview);
+    }
+    thumbnailPreview.src = url;
+    thumbnailPreview.style.left = `${Math.min(event.clientX + 12, window.innerWidth - 332)}px`;
+    thumbnailPreview.style.top = `${event.clientY + 12}px`;
+    thumbnailPreview.style.display = 'block';
+}
+
+function hideThumbnailPreview() {
+    if (thumbnailPreview) thumbnailPreview.style.display = 'none';
+}
+
 function getNumericRank(rank) {
     if (rank === null || rank === '-') return Infinity; // Handle non-rank values
     const numRank = Number(rank); // Convert to number
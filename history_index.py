@@ -0,0 +1,76 @@
+import bisect
+
+"""
+計測履歴リスト (history_*.json の中身) に索引を付けて扱うためのコンテナ。
+タスクIDからエントリ、日付からログ行を直接引けるため、1件の結果を反映するたびに
+履歴全体を走査したり、ログを並べ替えたりする必要がありません。
+"""
+
+class HistoryIndex:
+    """タスクID→履歴エントリ、日付→ログ行 の索引を持つ履歴コンテナ"""
+
+    def __init__(self, items=None):
+        # itemsは保存時にそのままJSONとして書き出せるよう、元のリストを保持する
+        self.items = items if items is not None else []
+        self._entries = {}
+        self._log_rows = {}  # task_id -> {date: ログ行}
+        self._log_dates = {}  # task_id -> 昇順に並んだ日付のリスト (ログと同じ順序)
+        for entry in self.items:
+            self._index_entry(entry)
+
+    def _index_entry(self, entry):
+        task_id = entry['id']
+        if task_id in self._entries:
+            return  # 重複IDは先に現れたものを優先する (従来の next() による検索と同じ挙動)
+        log = entry.setdefault('log', [])
+        dates = [row['date'] for row in log]
+        # 日付は 'YYYY/MM/DD' 形式のため、文字列比較でそのまま時系列順になる
+        if any(dates[i] > dates[i + 1] for i in range(len(dates) - 1)):
+            log.sort(key=lambda row: row['date'])
+            dates.sort()
+        self._entries[task_id] = entry
+        self._log_rows[task_id] = {row['date']: row for row in log}
+        self._log_dates[task_id] = dates
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, task_id):
+        return self._entries.get(task_id)
+
+    def update(self, task, date_str, rank, screenshot_path):
+        """1件の計測結果を反映する。同じ日付の結果があれば上書きし、なければ日付順の位置に挿入する"""
+        task_id = task['id']
+        log_entry = {'date': date_str, 'rank': rank, 'screenshot': screenshot_path}
+
+        entry = self._entries.get(task_id)
+        if entry is None:
+            entry = {"id": task_id, "task": task, "log": [log_entry]}
+            self.items.append(entry)
+            self._entries[task_id] = entry
+            self._log_rows[task_id] = {date_str: log_entry}
+            self._log_dates[task_id] = [date_str]
+            return
+
+        rows = self._log_rows[task_id]
+        date_row = rows.get(date_str)
+        if date_row is not None:
+            date_row.update(log_entry)
+            return
+
+        dates = self._log_dates[task_id]
+        position = bisect.bisect_right(dates, date_str)
+        dates.insert(position, date_str)
+        entry['log'].insert(position, log_entry)
+        rows[date_str] = log_entry
+
+    def has_result(self, task_id, date_str):
+        """指定したタスクの、指定した日付の結果が記録されているか"""
+        return date_str in self._log_rows.get(task_id, {})
+
+    def sort(self, key):
+        """エントリの並び順を変更する（索引は並び順に依存しない）"""
+        self.items.sort(key=key)
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import config
+
+"""
+計測履歴をSQLiteで管理するモジュール。
+history_*.json と同じ構造 ({"id", "task", "log": [...]}) のリストを読み書きできるため、
+config.HISTORY_BACKEND を 'sqlite' にするだけで既存の呼び出し側をそのまま利用できます。
+
+既存のJSONファイルの取り込み / JSONファイルへの書き出しはコマンドラインから実行できます。
+    python history_store.py import
+    python history_store.py export --type normal
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    history_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    task_json TEXT NOT NULL,
+    PRIMARY KEY (history_type, id)
+);
+CREATE TABLE IF NOT EXISTS rank_log (
+    history_type TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rank,
+    screenshot TEXT,
+    PRIMARY KEY (history_type, task_id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_rank_log_date ON rank_log (history_type, date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class HistoryStore:
+    """SQLite (WALモード) に計測履歴を保存するストア"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Flaskのリクエストスレッドとスケジューラのスレッドから共有するため、ロックで直列化する
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is None
+
+    def version(self):
+        """書き込みのたびに増える番号を返す（キャッシュの検証用）"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_version(self):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def load(self, history_type):
+        """指定タイプの履歴を history_*.json と同じ形式のリストで返す"""
+        with self._lock:
+            task_rows = self._conn.execute(
+                "SELECT id, task_json FROM tasks WHERE history_type = ? ORDER BY position",
+                (history_type,)
+            ).fetchall()
+            log_rows = self._conn.execute(
+                "SELECT task_id, date, rank, screenshot FROM rank_log WHERE history_type = ? ORDER BY task_id, date",
+                (history_type,)
+            ).fetchall()
+
+        history = []
+        entries = {}
+        for task_id, task_json in task_rows:
+            entry = {"id": task_id, "task": json.loads(task_json), "log": []}
+            entries[task_id] = entry
+            history.append(entry)
+        for task_id, date_str, rank, screenshot_path in log_rows:
+            entry = entries.get(task_id)
+            if entry is not None:
+                entry['log'].append({'date': date_str, 'rank': rank, 'screenshot': screenshot_path})
+        return history
+
+    def upsert_result(self, history_type, task, date_str, rank, screenshot_path):
+        """
+        1件の計測結果を保存する（同じ日付の結果があれば上書き）。
+        タスク情報は初めての結果の場合のみ保存し、既存のものは変更しない (JSONの HistoryIndex.update と同じ)
+        """
+        task_id = task['id']
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO tasks (history_type, id, position, task_json) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM tasks WHERE history_type = ?), ?) "
+                "ON CONFLICT(history_type, id) DO NOTHING",
+                (history_type, task_id, history_type, json.dumps(task, ensure_ascii=False))
+            )
+            self._conn.execute(
+                "INSERT INTO rank_log (history_type, task_id, date, rank, screenshot) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(history_type, task_id, date) DO UPDATE SET rank = excluded.rank, screenshot = excluded.screenshot",
+                (history_type, task_id, date_str, rank, screenshot_path)
+            )
+            self._bump_version()
+
+    def update_positions(self, history_type, task_ids):
+        """
+        指定タイプの履歴の並び順を task_ids の順にする。ログは書き換えないため、
+        計測中に他のスレッドが保存した結果 (手動計測など) も失われない
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE tasks SET position = ? WHERE history_type = ? AND id = ?",
+                [(position, history_type, task_id) for position, task_id in enumerate(task_ids)]
+            )
+            self._bump_version()
+
+    def replace(self, history_type, history):
+        """指定タイプの履歴を丸ごと置き換える（インポート・履歴全体の書き換え用）"""
+        task_rows = []
+        log_rows = []
+        for position, item in enumerate(history):
+            task_id = item['id']
+            task_rows.append((history_type, task_id, position, json.dumps(item.get('task', {}), ensure_ascii=False)))
+            for log_entry in item.get('log', []):
+                log_rows.append((history_type, task_id, log_entry['date'], log_entry.get('rank'), log_entry.get('screenshot')))
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM rank_log WHERE history_type = ?", (history_type,))
+            self._conn.execute("DELETE FROM tasks WHERE history_type = ?", (history_type,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tasks (history_type, id, position, task_json) VALUES (?, ?, ?, ?)",
+                task_rows
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rank_log (history_type, task_id, date, rank, screenshot) VALUES (?, ?, ?, ?, ?)",
+                log_rows
+            )
+            self._bump_version()
+        return len(task_rows), len(log_rows)
+
+    def import_json_files(self, history_files):
+        """history_*.json の内容をストアに取り込む。{タイプ: (タスク数, ログ件数)} を返す"""
+        counts = {}
+        for history_type, filename in history_files.items():
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            counts[history_type] = self.replace(history_type, history)
+        return counts
+
+    def export_json(self, history_type, filename):
+        """指定タイプの履歴を history_*.json と同じ形式で書き出す"""
+        history = self.load(history_type)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(history, f, indent=2, ensure_ascii=False)
+        return len(history)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_history_store():
+    """共有のHistoryStoreを返す。DBが空の場合は既存のJSONファイルを一度だけ取り込む"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = HistoryStore(config.HISTORY_DB_FILE)
+            if store.is_empty():
+                store.import_json_files(config.HISTORY_FILES)
+            _store = store
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="計測履歴のSQLiteストアを操作します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('import', help="history_*.json をSQLiteに取り込む（既存の内容は置き換え）")
+    export_parser = subparsers.add_parser('export', help="SQLiteの内容を history_*.json に書き出す")
+    export_parser.add_argument('--type', choices=list(config.HISTORY_FILES.keys()), help="書き出す履歴タイプ（省略時はすべて）")
+    export_parser.add_argument('--out-dir', default='.', help="書き出し先ディレクトリ")
+    args = parser.parse_args()
+
+    store = HistoryStore(config.HISTORY_DB_FILE)
+    try:
+        if args.command == 'import':
+            for history_type, (task_count, log_count) in store.import_json_files(config.HISTORY_FILES).items():
+                print(f"{history_type}: タスク {task_count}件 / ログ {log_count}件 を取り込みました。")
+        elif args.command == 'export':
+            if store.is_empty():
+                # 空のDBから書き出すと既存のJSONファイルを空で上書きしてしまうため中断する
+                parser.error(f"{config.HISTORY_DB_FILE} に履歴がありません。先に import を実行してください。")
+            history_types = [args.type] if args.type else list(config.HISTORY_FILES.keys())
+            for history_type in history_types:
+                filename = os.path.join(args.out_dir, config.HISTORY_FILES[history_type])
+                task_count = store.export_json(history_type, filename)
+                print(f"{history_type}: タスク {task_count}件 を {filename} に書き出しました。")
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app
+
+import config
+from rate_limiter import throttle
+
+"""
+ホットペッパービューティーの検索結果ページを、ブラウザを使わずHTTPで直接取得するモジュール。
+スクリーンショットが不要な計測では、Chromeを操作するよりも大幅に速く、メモリも使いません。
+ブロックされた・結果一覧を含まないページが返った場合は None を返すので、呼び出し側でSeleniumに切り替えます。
+"""
+
+# 検索結果ページとして解析できるかどうかの目印 (サロン名 / 総件数 の要素)
+_RESULT_MARKERS = ('slcHead', 'numberOfResult')
+
+_local = threading.local()
+# 2ページ目以降を並列に取得するためのスレッドプール (スレッドごとのSessionを使い回すため、アプリ全体で共有する)
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_session():
+    """スレッドごとに使い回す requests.Session を返す (Keep-Alive・再試行付き)"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        retry = Retry(total=2, backoff_factor=1, status_forcelist=(500, 502, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'User-Agent': config.DEFAULT_USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'ja,en-US;q=0.7,en;q=0.3',
+        })
+        _local.session = session
+        _local.warmed_referers = set()
+    return session
+
+def warm_up(referer_url):
+    """Refererページに一度アクセスして、正規のセッションCookieを取得しておく（同じRefererは1回のみ）"""
+    session = get_session()
+    if referer_url in _local.warmed_referers:
+        return
+    try:
+        throttle(referer_url)
+        session.get(referer_url, timeout=config.HPB_HTTP_TIMEOUT)
+        _local.warmed_referers.add(referer_url)
+    except requests.RequestException as e:
+        current_app.logger.warning(f"Refererページへのアクセスに失敗しました: {e}")
+
+def fetch_html(url, referer_url=None, cancel_event=None):
+    """
+    ページのHTMLを取得し、(HTML, 最終的なURL) を返す。
+    取得に失敗した場合や、ブロック・空ページなど検索結果として扱えない場合は None を返す。
+    :param cancel_event: アクセス頻度の制御で待機している間にセットされた場合、リクエストを送らずに None を返す
+    """
+    session = get_session()
+    if referer_url:
+        warm_up(referer_url)
+    headers = {'Referer': referer_url} if referer_url else {}
+    try:
+        throttle(url)
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        response = session.get(url, headers=headers, timeout=config.HPB_HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        current_app.logger.warning(f"HTTPでのページ取得に失敗しました ({url}): {e}")
+        return None
+
+    if response.status_code != 200:
+        current_app.logger.warning(f"HTTPでのページ取得がステータス {response.status_code} で失敗しました ({url})。")
+        return None
+    response.encoding = response.encoding if response.encoding and response.encoding.lower() != 'iso-8859-1' else response.apparent_encoding
+    html = response.text
+    if not any(marker in html for marker in _RESULT_MARKERS):
+        current_app.logger.info(f"HTTPで取得したページに検索結果が含まれていません ({url})。")
+        return None
+    return html, response.url
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.HPB_CONCURRENT_PAGES, thread_name_prefix='hpb-fetch')
+        return _executor
+
+def fetch_pages(urls, referer_url=None):
+    """
+    複数のページを並列に取得し、(URL, fetch_html の戻り値) を urls の順番で返すジェネレータ。
+    同時に取得するのは最大 config.HPB_CONCURRENT_PAGES ページで、1ページ受け取るごとに次のページの取得を始める。
+    途中でジェネレータを閉じる (目的のサロンが見つかった場合など) と、まだ送っていないリクエストは取り消す。
+    """
+    app = current_app._get_current_object()
+    executor = _get_executor()
+    cancel_event = threading.Event()
+
+    def fetch(url):
+        if cancel_event.is_set():
+            return None
+        with app.app_context():
+            return fetch_html(url, referer_url, cancel_event=cancel_event)
+
+    remaining = iter(urls)
+    pending = deque()
+
+    def submit_next():
+        url = next(remaining, None)
+        if url is not None:
+            pending.append((url, executor.submit(fetch, url)))
+
+    for _ in range(max(1, config.HPB_CONCURRENT_PAGES)):
+        submit_next()
+    try:
+        while pending:
+            url, future = pending.popleft()
+            fetched = future.result()
+            submit_next()
+            yield url, fetched
+    finally:
+        cancel_event.set()
+        for _, future in pending:
+            future.cancel()
@@ -0,0 +1,68 @@
+import lxml.etree
+import lxml.html
+
+"""
+ホットペッパービューティーの検索結果ページ (通常検索・特集ページ) から、順位計測に必要な要素だけを取り出すモジュール。
+BeautifulSoup でページ全体のツリーを作る代わりに、lxml で解析して事前にコンパイルしたXPathで直接取り出します。
+
+取り出すのは次の要素のみです。
+- 現在のページ番号 (ul.paging span.current)
+- 検索結果の総件数 (span.numberOfResult)
+- 掲載サロン名 (h3.slcHead a)
+- ページタイトル (title)
+"""
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_CURRENT_PAGE_XPATH = lxml.etree.XPath(f"(//ul[{_has_class('paging')}]//span[{_has_class('current')}])[1]")
+_TOTAL_COUNT_XPATH = lxml.etree.XPath(f"(//span[{_has_class('numberOfResult')}])[1]")
+_SALON_LINKS_XPATH = lxml.etree.XPath(f"//h3[{_has_class('slcHead')}]//a")
+_TITLE_XPATH = lxml.etree.XPath("(//title)[1]")
+
+
+class ResultPage:
+    """
+    検索結果ページから取り出した値。
+    current_page / total_count は要素のテキストそのまま (要素がない場合は None) で、数値への変換は呼び出し側で行う。
+    """
+    __slots__ = ('current_page', 'total_count', 'salon_names', 'title')
+
+    def __init__(self, current_page=None, total_count=None, salon_names=(), title=None):
+        self.current_page = current_page
+        self.total_count = total_count
+        self.salon_names = list(salon_names)
+        self.title = title
+
+
+def _text(element):
+    """BeautifulSoup の get_text(strip=True) と同じく、各テキストの前後の空白を除いて連結する"""
+    return ''.join(text.strip() for text in element.itertext())
+
+
+def _parse_document(html):
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # XML宣言付きの文字列は lxml が受け付けないため、バイト列にして解析する
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+
+
+def parse_result_page(html):
+    """検索結果ページのHTMLから ResultPage を作る。HTMLが空・解析できない場合は空の ResultPage を返す"""
+    if not html or not html.strip():
+        return ResultPage()
+    try:
+        document = _parse_document(html)
+    except lxml.etree.ParserError:
+        return ResultPage()
+
+    current_page = _CURRENT_PAGE_XPATH(document)
+    total_count = _TOTAL_COUNT_XPATH(document)
+    title = _TITLE_XPATH(document)
+    return ResultPage(
+        current_page=_text(current_page[0]) if current_page else None,
+        total_count=_text(total_count[0]) if total_count else None,
+        salon_names=[_text(link) for link in _SALON_LINKS_XPATH(document)],
+        title=(title[0].text or '').strip() if title else None,
+    )
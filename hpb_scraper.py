@@ -1,24 +1,34 @@
-import time
-import datetime
-import os
-import re
+import math
 import urllib.parse
-from bs4 import BeautifulSoup
+import contextlib
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
-from PIL import Image
 from flask import current_app
 
 import config
-from utils import sse_format
+import debug_artifacts
+from events import Status, FinalResult, Error
+from rate_limiter import throttle
+from driver_manager import get_webdriver
+import hpb_http_fetcher
+import screenshot_writer
+import serp_cache
+from hpb_page_parser import parse_result_page
 
-def check_hotpepper_ranking(driver, keyword, salon_name, area_codes, save_screenshot=True):
+def check_hotpepper_ranking(driver, keyword, salon_name, area_codes, save_screenshot=True, fetch_engine=None, stop_on_first_match=False, force_refresh=False):
     """
     ホットペッパービューティーの掲載順位をスクレイピングで取得するジェネレータ関数。
-    処理の進捗を yield で返す。
-    :param driver: SeleniumのWebDriverインスタンス
+    処理の進捗・結果を events のイベント (Status, FinalResult, Error) として yield で返す。
+    :param salon_name: 探したいサロン名。リストを渡すと1回の検索で複数のサロンを探し、
+                       サロン名ごとの結果を最終結果の results_map に入れる
+    :param driver: SeleniumのWebDriverインスタンス。Noneの場合、ブラウザが必要になった時点でプールから借りる
+    :param fetch_engine: 'http' の場合は検索結果ページをHTTPで直接取得し、スクリーンショット撮影時と
+                         HTTPで取得できなかった場合のみブラウザを使う。省略時は config.HPB_FETCH_ENGINE
+    :param stop_on_first_match: Trueの場合、(すべての) サロンが見つかったページで検索を終了し、以降のページを取得しない。
+                                省略したページ数は最終結果の pages_skipped に入る
+    :param force_refresh: Trueの場合、検索結果キャッシュ (serp_cache) を使わずに必ず取得し直す
     """
     # ユーザー提供のURL形式をベースに変更
     base_url = 'https://beauty.hotpepper.jp/CSP/kr/salonSearch/search/'
@@ -50,55 +60,125 @@ def check_hotpepper_ranking(driver, keyword, salon_name, area_codes, save_screen
         **valid_area_codes # 値が存在するエリアコードのみを展開して追加
     }
 
+    salon_names = list(salon_name) if isinstance(salon_name, (list, tuple)) else [salon_name]
     found_salons = [] # 発見したすべてのサロンを格納するリスト
+    found_salons_map = {name: [] for name in salon_names} # サロン名ごとに結果を格納
     total_count = 0 # 検索結果の総件数
     screenshot_path = None # スクリーンショットのパス
+    screenshot_future = None # スクリーンショットの保存の完了待ち
+    timings = {} # スクリーンショットの撮影・保存にかかった秒数
+    pages_skipped = 0 # stop_on_first_match で取得を省略したページ数
+    ranking = [] # 取得したページに掲載されていたすべてのサロン (検索結果キャッシュ用)
+    complete = True # 途中で読み込みに失敗せずに検索を終えたか
 
     last_url_checked = ""
     last_html_content = "リクエストが実行されませんでした。"
     
-    # スクリーンショット保存用ディレクトリを作成
-    if not os.path.exists(config.SCREENSHOT_DIR):
-        os.makedirs(config.SCREENSHOT_DIR)
+    def build_url(page):
+        query_string = urllib.parse.urlencode({**params, 'pn': page})
+        return f"{base_url}?{query_string}"
 
-    try:
+    use_http = (fetch_engine or config.HPB_FETCH_ENGINE) == 'http'
+    resources = contextlib.ExitStack() # 借りたブラウザや並列取得を、終了時にまとめて片付ける
+    browser_ready = False
+    last_page = config.HPB_MAX_PAGES # 1ページ目の総件数から、実際に存在するページ数に絞り込む
+    prefetched_pages = None
+
+    def build_final_result():
+        final_result = {
+            "total_count": total_count,
+            "screenshot_path": screenshot_path,
+            "url": last_url_checked,
+            "pages_skipped": pages_skipped,
+            "timings": timings
+        }
+        if isinstance(salon_name, (list, tuple)):
+            final_result["results_map"] = found_salons_map
+        if found_salons:
+            final_result["results"] = found_salons
+        else:
+            final_result["rank"] = "圏外"
+        return final_result
+
+    # 同じ検索条件の結果が直前に取得されていれば、アクセスせずにそれを使う
+    cache_key = serp_cache.make_key('hpb', keyword=keyword, area_codes=valid_area_codes)
+    cached = None if force_refresh else serp_cache.get(cache_key, require_screenshot=save_screenshot)
+    # 途中で打ち切ったスナップショット (自動計測の stop_on_first_match) は、同じく打ち切ってよい計測でのみ使う
+    cached_map = serp_cache.match(cached, salon_names, allow_incomplete=stop_on_first_match) if cached else None
+    if cached_map is not None:
+        yield Status(f"{serp_cache.age_minutes(cached)}分前に取得した検索結果を使用します。")
+        found_salons_map = cached_map
+        found_salons = sorted({r['rank']: r for results in cached_map.values() for r in results}.values(), key=lambda r: r['rank'])
+        total_count = cached['total_count']
+        screenshot_path = cached['screenshot_path']
+        last_url_checked = cached['url']
+        yield FinalResult({**build_final_result(), "cached": True})
+        return
+
+    def prepare_browser():
+        """ブラウザを準備する。driverが渡されていなければプールから借り、Refererページでセッションを初期化する"""
+        nonlocal driver, browser_ready
+        if driver is None:
+            driver = resources.enter_context(get_webdriver())
         # 最初にRefererとなるページにアクセスして、正規のセッションCookieを取得する
-        yield sse_format({"status": "セッションを初期化しています..."})
         try:
             current_app.logger.info(f"セッション初期化のためRefererページ ({referer_url}) にアクセスします。")
+            throttle(referer_url)
             driver.get(referer_url)
-            time.sleep(1) # 以前の待機処理に戻します
         except Exception as e:
             current_app.logger.warning(f"Refererページへのアクセスに失敗しました: {e}")
+        browser_ready = True
+
+    try:
+        if not use_http:
+            yield Status("セッションを初期化しています...")
+            prepare_browser()
 
         # ページを1から順番にチェック（最大5ページ=100位まで）
         for page in range(1, config.HPB_MAX_PAGES + 1):
-            # ページ番号をパラメータに追加
-            params['pn'] = page # この行は変更なし
+            if page > last_page:
+                break
+            if stop_on_first_match and all(found_salons_map.values()):
+                pages_skipped = last_page - page + 1
+                current_app.logger.info(f"サロン {salon_names} が見つかったため、残り{pages_skipped}ページの検索を省略します。")
+                break
+            url = build_url(page)
 
-            # --- 修正: 削除されていたURL生成ロジックを元に戻す ---
-            query_string = urllib.parse.urlencode(params)
-            url = f"{base_url}?{query_string}"
+            yield Status(f"{page}ページ目を検索しています...")
+            fetched = None
+            # スクリーンショットを撮る1ページ目以外は、まずHTTPで直接取得を試みる (2ページ目以降は並列取得済みのものを受け取る)
+            if use_http and not (page == 1 and save_screenshot):
+                if prefetched_pages is not None:
+                    _, fetched = next(prefetched_pages)
+                else:
+                    fetched = hpb_http_fetcher.fetch_html(url, referer_url)
+                if fetched is None:
+                    current_app.logger.info(f"ページ {page} をHTTPで取得できなかったため、ブラウザで取得します。")
 
-            yield sse_format({"status": f"{page}ページ目を検索しています..."})
-            try:
-                driver.get(url)
-                time.sleep(1.5) # 以前の待機処理に戻し、少し時間を延長して安定性を確保します
-            except TimeoutException:
-                current_app.logger.warning(f"ページ {page} ({url}) の読み込みがタイムアウトしました。処理を中断します。")
-                break # ループを抜けて、それまでに見つかった結果を返す
+            if fetched:
+                last_html_content, last_url_checked = fetched
+            else:
+                if not browser_ready:
+                    yield Status("ブラウザでセッションを初期化しています...")
+                    prepare_browser()
+                try:
+                    throttle(url) # HPBへのアクセス頻度を制御 (前回のアクセスから十分に時間が経っていれば待たない)
+                    driver.get(url)
+                except TimeoutException:
+                    current_app.logger.warning(f"ページ {page} ({url}) の読み込みがタイムアウトしました。処理を中断します。")
+                    complete = False
+                    break # ループを抜けて、それまでに見つかった結果を返す
 
-            last_url_checked = driver.current_url
-            last_html_content = driver.page_source
+                last_url_checked = driver.current_url
+                last_html_content = driver.page_source
 
-            soup = BeautifulSoup(last_html_content, 'lxml')
+            parsed_page = parse_result_page(last_html_content)
 
             # ページネーションがスタックしていないか確認
             if page > 1:
-                current_page_span = soup.select_one('ul.paging span.current')
-                if current_page_span:
+                if parsed_page.current_page is not None:
                     try:
-                        current_page_num = int(current_page_span.get_text(strip=True))
+                        current_page_num = int(parsed_page.current_page)
                         if current_page_num < page:
                             current_app.logger.info(f"ページネーションがスタックしました。要求ページ: {page}, 現在のページ: {current_page_num}。検索を終了します。")
                             break
@@ -111,46 +191,20 @@ def check_hotpepper_ranking(driver, keyword, salon_name, area_codes, save_screen
             # 1ページ目でのみスクリーンショットと総件数を取得
             if page == 1:
                 if save_screenshot:
-                    yield sse_format({"status": "スクリーンショットを撮影しています..."})
-                    # ページ全体の高さを取得してウィンドウサイズを変更し、フルページのスクリーンショットを撮影
-                    total_height = driver.execute_script("return document.body.parentNode.scrollHeight")
-                    driver.set_window_size(1200, total_height)
-                    time.sleep(0.5) # リサイズを待機
-
-                    # --- ファイル名生成ロジックの改善 (yyMMdd形式, 接頭辞なし) ---
-                    timestamp = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
-                    # ファイル名に使えない文字を置換
-                    safe_keyword = re.sub(r'[\\/:*?"<>|]', '_', keyword)
-                    safe_area = re.sub(r'[\\/:*?"<>|]', '_', area_codes.get('areaName', ''))
-                    base_filename = f"{timestamp}_{safe_area}_{safe_keyword}"
-                    
-                    temp_png_path = os.path.join(config.SCREENSHOT_DIR, f"temp_{timestamp}.png") # 一時ファイル名はタイムスタンプのみでOK
-                    driver.save_screenshot(temp_png_path)
-
-                    # 最終的なファイル名を指定
-                    jpeg_filename = f"{base_filename}.jpg"
-                    jpeg_filepath = os.path.join(config.SCREENSHOT_DIR, jpeg_filename)
-                    
-                    try:
-                        with Image.open(temp_png_path) as img:
-                            if img.mode == 'RGBA': # JPEGは透明度をサポートしないためRGBに変換
-                                img = img.convert('RGB')
-                            img.save(jpeg_filepath, 'jpeg', quality=config.SCREENSHOT_JPEG_QUALITY) # qualityは0-95の範囲で調整可能
-                        screenshot_path = jpeg_filepath
-                        current_app.logger.info(f"画質を調整したスクリーンショットを {jpeg_filepath} に保存しました。")
-                    finally:
-                        if os.path.exists(temp_png_path): # 一時ファイルを削除
-                            os.remove(temp_png_path)
-
-                count_span = soup.select_one('span.numberOfResult')
-                if count_span:
+                    yield Status("スクリーンショットを撮影しています...")
+                    # ウィンドウサイズを変えずにページ全体を撮影し、JPEGへの変換・保存はバックグラウンドで行う
+                    screenshot_future = screenshot_writer.capture(driver, full_page=True, timings=timings)
+
+                if parsed_page.total_count is not None:
                     try:
-                        total_count = int(count_span.get_text(strip=True))
+                        total_count = int(parsed_page.total_count)
                     except (ValueError, TypeError):
                         current_app.logger.warning("総件数の取得または解析に失敗しました。")
                         total_count = 0
+                if total_count:
+                    last_page = min(config.HPB_MAX_PAGES, math.ceil(total_count / 20))
 
-            all_salons_on_page = soup.select('h3.slcHead a')
+            all_salons_on_page = parsed_page.salon_names
             
             if not all_salons_on_page:
                 if page == 1:
@@ -158,31 +212,45 @@ def check_hotpepper_ranking(driver, keyword, salon_name, area_codes, save_screen
                 break # ページにサロンリストがなければループを終了
 
             for i in range(len(all_salons_on_page)):
-                salon_tag = all_salons_on_page[i]
-                current_salon_name = salon_tag.get_text(strip=True)
+                current_salon_name = all_salons_on_page[i]
                 
-                if salon_name in current_salon_name:
-                    rank = (page - 1) * 20 + (i + 1)
+                rank = (page - 1) * 20 + (i + 1)
+                ranking.append({"rank": rank, "name": current_salon_name})
+                matched = False
+                for name in salon_names:
+                    if name in current_salon_name:
+                        found_salons_map[name].append({"rank": rank, "foundSalonName": current_salon_name})
+                        matched = True
+                if matched:
                     found_salons.append({"rank": rank, "foundSalonName": current_salon_name})
 
+            # 2ページ目以降のURLは確定しているので、HTTPでまとめて並列に取得し始める
+            # (1ページ目で見つかり検索を終了する場合は取得しない)
+            if page == 1 and use_http and config.HPB_CONCURRENT_PAGES > 1 and last_page > 1 and not (stop_on_first_match and all(found_salons_map.values())):
+                prefetched_pages = resources.enter_context(contextlib.closing(
+                    hpb_http_fetcher.fetch_pages([build_url(p) for p in range(2, last_page + 1)], referer_url)
+                ))
+
     except Exception as e:
         current_app.logger.error(f"Selenium処理中にエラーが発生しました: {e}")
-        yield sse_format({"error": f"ブラウザの操作中にエラーが発生しました。", "url": last_url_checked, "html": last_html_content})
+        # 例外を伝えて片付け、借りたブラウザをプールに戻さず破棄させる (状態が不明なため)
+        resources.__exit__(type(e), e, e.__traceback__)
+        # 調査用に、最後に取得したページのHTMLをファイルに保存してパスを返す
+        html_path = debug_artifacts.save_html(last_html_content, f"hpb_{keyword}", force=bool(last_url_checked))
+        yield Error("ブラウザの操作中にエラーが発生しました。", url=last_url_checked, html_path=html_path)
         return
+    finally:
+        # 未取得ページのリクエストを取り消し、プールから借りたブラウザを返却する
+        resources.close()
 
     # --- 最終結果をyield ---
-    yield sse_format({"status": "結果を解析しています..."})
-    time.sleep(0.5)
-
-    final_result = {
-        "total_count": total_count,
-        "screenshot_path": screenshot_path,
-        "url": last_url_checked,
-        "html": last_html_content
-    }
-    if found_salons:
-        final_result["results"] = found_salons
-    else:
-        final_result["rank"] = "圏外"
-    
-    yield sse_format({"final_result": final_result, "status": "完了"})
\ No newline at end of file
+    yield Status("結果を解析しています...")
+
+    screenshot_path = screenshot_writer.wait(screenshot_future)
+    serp_cache.put(cache_key, ranking, total_count, complete=complete and not pages_skipped,
+                   url=last_url_checked, screenshot_path=screenshot_path)
+    final_result = build_final_result()
+    html_path = debug_artifacts.save_html(last_html_content, f"hpb_{keyword}") # SCRAPER_DEBUG_SAVE_HTML が有効な場合のみ保存
+    if html_path:
+        final_result["html_path"] = html_path
+    yield FinalResult(final_result)
\ No newline at end of file
@@ -0,0 +1,299 @@
+import datetime
+import json
+import sqlite3
+import threading
+
+from flask import current_app
+
+import config
+from events import Error
+
+"""
+計測ジョブのキュー。
+APIはジョブをキューに登録してジョブIDを返すだけにし、計測はワーカースレッドで実行します。
+ブラウザのタブを閉じても計測は止まらず、進捗 (events.py のイベント) はSQLiteに保存されるため、
+/api/jobs/<ジョブID>/events に Last-Event-ID を付けて接続し直せば、続きから受け取れます。
+
+同時に実行するジョブ数は、ジョブの種類 (スロット) ごとに config.JOB_QUEUE_SLOTS で制限します。
+    single  1件の検索の計測 (手動計測)。履歴を書き込まないため並列に実行できる
+    batch   自動計測・タスクの一括実行など、履歴をまとめて書き込む処理。同時には1件のみ実行する
+
+ジョブの状態 (status):
+    queued       実行待ち (プロセスが再起動しても、起動後に実行される)
+    running      実行中
+    completed    完了
+    failed       エラーで終了した
+    interrupted  実行中にプロセスが終了した (起動時に判定)
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_type TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    params_json TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    data_json TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+FINISHED_STATUSES = ('completed', 'failed', 'interrupted')
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+class JobQueue:
+    """SQLiteに保存する計測ジョブのキューと、ジョブを実行するワーカースレッド"""
+
+    def __init__(self, db_path, slots):
+        self.db_path = db_path
+        self.slots = dict(slots)
+        self._handlers = {}  # ジョブの種類 -> (ハンドラ, スロット)
+        self._lock = threading.Lock()
+        # Flaskのリクエストスレッドとワーカースレッドから共有するため、ロックで直列化する
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # ジョブの登録・進捗の追加・ジョブの終了を、待機中のワーカーとSSEの接続に知らせる
+        self._changed = threading.Condition()
+        self._version = 0  # 変更のたびに増やす (SSEの接続が、読み込んだ後の変更を見逃さないため)
+        self._running = {slot: 0 for slot in self.slots}
+        self._next_seq = {}  # ジョブID -> 次に追加するイベントの番号
+        self._threads = []
+
+    def register(self, job_type, handler, slot='single'):
+        """
+        ジョブの種類と、それを実行するハンドラを登録する。
+        :param handler: ジョブ登録時のパラメータをキーワード引数で受け取り、events.py のイベントを返すジェネレータ関数
+        """
+        if slot not in self.slots:
+            raise ValueError(f"未定義のスロットです: {slot}")
+        self._handlers[job_type] = (handler, slot)
+
+    # --- ジョブの登録・参照 ---
+
+    def enqueue(self, job_type, **params):
+        """ジョブをキューに登録し、ジョブIDを返す"""
+        _, slot = self._handlers[job_type]
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (job_type, slot, params_json, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_type, slot, json.dumps(params, ensure_ascii=False), _now())
+            )
+            job_id = cursor.lastrowid
+        self._notify()
+        return job_id
+
+    def _notify(self):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def _row_to_job(self, row):
+        job_id, job_type, slot, params_json, status, created_at, started_at, finished_at = row
+        return {
+            "id": job_id, "job_type": job_type, "slot": slot, "params": json.loads(params_json), "status": status,
+            "created_at": created_at, "started_at": started_at, "finished_at": finished_at,
+        }
+
+    def get(self, job_id):
+        """ジョブの情報を返す。存在しない場合は None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, job_type, slot, params_json, status, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit=50):
+        """新しい順にジョブの情報を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, job_type, slot, params_json, status, created_at, started_at, finished_at FROM jobs ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def is_busy(self):
+        """実行中のジョブがあるか"""
+        with self._changed:
+            return any(self._running.values())
+
+    def events_after(self, job_id, last_seq=0):
+        """ジョブの進捗のうち、番号が last_seq より後のものを (番号, 内容のdict) のリストで返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, data_json FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, last_seq)
+            ).fetchall()
+        return [(seq, json.loads(data_json)) for seq, data_json in rows]
+
+    def has_pending(self, job_type, queued_only=False, **params):
+        """
+        指定した種類のジョブが実行待ち・実行中か
+        :param queued_only: Trueの場合、実行待ちのジョブのみを対象にする
+        :param params: 指定した場合、登録時のパラメータがこれらの値と一致するジョブのみを対象にする
+        """
+        statuses = ('queued',) if queued_only else ('queued', 'running')
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT params_json FROM jobs WHERE job_type = ? AND status IN ({', '.join('?' * len(statuses))})",
+                (job_type, *statuses)
+            ).fetchall()
+        for (params_json,) in rows:
+            job_params = json.loads(params_json)
+            if all(job_params.get(key) == value for key, value in params.items()):
+                return True
+        return False
+
+    def follow(self, job_id, last_seq=0, keepalive=15):
+        """
+        ジョブの進捗を、番号が last_seq より後のものから順に返すジェネレータ。
+        ジョブが終了してすべての進捗を返し終えると終了する。
+        keepalive 秒間新しい進捗がない場合は None を返す (接続の維持・切断の検出用)。
+        """
+        while True:
+            with self._changed:
+                version = self._version
+            # 先にジョブの状態を確認してから進捗を読むことで、終了直前に追加された進捗を取りこぼさない
+            job = self.get(job_id)
+            if job is None:
+                return
+            events = self.events_after(job_id, last_seq)
+            for seq, data in events:
+                last_seq = seq
+                yield seq, data
+            if job['status'] in FINISHED_STATUSES:
+                return
+            if not events:
+                with self._changed:
+                    changed = self._changed.wait_for(lambda: self._version != version, timeout=keepalive)
+                if not changed:
+                    yield None
+
+    # --- ワーカー ---
+
+    def start(self, app):
+        """前回のプロセスで実行中だったジョブを interrupted にし、ワーカースレッドを起動する"""
+        self._recover()
+        self._cleanup()
+        for slot, count in self.slots.items():
+            for i in range(count):
+                thread = threading.Thread(target=self._worker, args=(app,), name=f"job-{slot}-{i + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _recover(self):
+        with self._lock:
+            job_ids = [row[0] for row in self._conn.execute("SELECT id FROM jobs WHERE status = 'running'")]
+        for job_id in job_ids:
+            self._append_event(job_id, Error("サーバーの再起動により、計測が中断されました。").to_dict())
+            self._finish(job_id, 'interrupted')
+
+    def _cleanup(self):
+        """終了から config.JOB_QUEUE_RETENTION_DAYS 日を過ぎたジョブと進捗を削除する"""
+        threshold = (datetime.datetime.now() - datetime.timedelta(days=config.JOB_QUEUE_RETENTION_DAYS)).isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+                (threshold,)
+            )
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (threshold,))
+
+    def _claim_next(self, slot):
+        """slot の実行待ちのジョブのうち最も古いものを running にして返す。なければ None (self._changed を保持して呼ぶ)"""
+        if self._running[slot] >= self.slots[slot]:
+            return None
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, job_type, slot, params_json, status, created_at, started_at, finished_at FROM jobs "
+                "WHERE status = 'queued' AND slot = ? ORDER BY id LIMIT 1",
+                (slot,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (_now(), row[0]))
+        self._running[slot] += 1
+        return self._row_to_job(row)
+
+    def _worker(self, app):
+        slot = threading.current_thread().name.split('-')[1]
+        with app.app_context():
+            while True:
+                with self._changed:
+                    job = self._claim_next(slot)
+                    while job is None:
+                        self._changed.wait()
+                        job = self._claim_next(slot)
+                try:
+                    self._run(job)
+                finally:
+                    with self._changed:
+                        self._running[slot] -= 1
+                    self._notify()
+
+    def _run(self, job):
+        handler, _ = self._handlers.get(job['job_type'], (None, None))
+        current_app.logger.info(f"ジョブ {job['id']} ({job['job_type']}) を開始します。")
+        status = 'completed'
+        try:
+            if handler is None:
+                raise ValueError(f"未登録のジョブの種類です: {job['job_type']}")
+            last_event = None
+            for event in handler(**job['params']):
+                self._append_event(job['id'], event.to_dict())
+                last_event = event
+            if isinstance(last_event, Error):
+                status = 'failed'
+        except Exception as e:
+            current_app.logger.exception(f"ジョブ {job['id']} ({job['job_type']}) の実行中にエラーが発生しました。")
+            self._append_event(job['id'], Error(f"システムエラーが発生しました: {e}").to_dict())
+            status = 'failed'
+        finally:
+            self._finish(job['id'], status)
+        current_app.logger.info(f"ジョブ {job['id']} ({job['job_type']}) が終了しました。({status})")
+
+    def _append_event(self, job_id, data):
+        with self._lock, self._conn:
+            seq = self._next_seq.get(job_id)
+            if seq is None:
+                row = self._conn.execute("SELECT MAX(seq) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()
+                seq = (row[0] or 0) + 1
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, data_json) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(data, ensure_ascii=False))
+            )
+            self._next_seq[job_id] = seq + 1
+        self._notify()
+
+    def _finish(self, job_id, status):
+        """ジョブを終了状態にし、最後の進捗としてジョブの状態 (job_status) を追加する"""
+        self._append_event(job_id, {"job_status": status})
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?", (status, _now(), job_id))
+            self._next_seq.pop(job_id, None)
+        self._notify()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """共有のJobQueueを返す"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(config.JOB_QUEUE_DB_FILE, config.JOB_QUEUE_SLOTS)
+        return _queue
@@ -0,0 +1,173 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+JSONファイルの読み書きを一元管理し、解析済みの内容をプロセス内にキャッシュするモジュール。
+履歴ファイルのような数MBのJSONを、APIやスケジューラが呼ばれるたびに読み直さないようにします。
+
+キャッシュはファイルのパスごとに保持し、ファイルの更新時刻・サイズが変わった場合や、
+このモジュールの save_json_file で書き込んだ場合に無効化・更新されます。
+書き込みは一時ファイルに出力してから置き換えるため、途中でプロセスが落ちても元のファイルは壊れません。
+"""
+
+_cache = {}  # path -> {"mtime_ns", "size", "text", "data"}
+_cache_lock = threading.Lock()
+# reparses: キャッシュは有効だったが、copy=True のためテキストから解析し直した回数 (hits には含めない)
+_stats = {"hits": 0, "misses": 0, "reparses": 0, "writes": 0}
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_json_file(filename, copy=True):
+    """
+    JSONファイルを読み込む。ファイルが存在しない・壊れている場合は空リストを返す。
+    :param copy: Trueの場合は呼び出し側で変更してよい新しいオブジェクトを返す。
+                 Falseの場合はキャッシュ上の共有オブジェクトを返すため、読み取り専用として扱うこと。
+    """
+    path = os.path.abspath(filename)
+    file_stat = _stat(path)
+    if file_stat is None:
+        return []
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry and (entry["mtime_ns"], entry["size"]) == file_stat:
+            _stats["reparses" if copy else "hits"] += 1
+        else:
+            _stats["misses"] += 1
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+                data = json.loads(text)
+            except (json.JSONDecodeError, IOError):
+                _cache.pop(path, None)
+                return []
+            entry = {"mtime_ns": file_stat[0], "size": file_stat[1], "text": text, "data": data}
+            _cache[path] = entry
+            if copy:
+                # 今読み込んだオブジェクトをそのまま渡し、キャッシュ用には次回の参照時に解析し直す
+                entry["data"] = None
+                return data
+
+        if copy:
+            return json.loads(entry["text"])
+        if entry["data"] is None:
+            entry["data"] = json.loads(entry["text"])
+        return entry["data"]
+
+
+def _dump_json(data, indent=None):
+    if indent is None:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(data, indent=indent, ensure_ascii=False)
+
+
+def _write_text(path, text):
+    """同じディレクトリの一時ファイルに書き込んでから os.replace で置き換え、キャッシュを更新する"""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstempは0600で作成するため、既存ファイルのパーミッションを引き継ぐ
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        except OSError:
+            os.chmod(temp_path, 0o644)
+        with _cache_lock:
+            os.replace(temp_path, path)
+            _stats["writes"] += 1
+            file_stat = _stat(path)
+            if file_stat is None:
+                _cache.pop(path, None)
+                return
+            # 呼び出し側は保存後もdataを変更し続けることがあるため、共有オブジェクトは次回参照時に作り直す
+            _cache[path] = {"mtime_ns": file_stat[0], "size": file_stat[1], "text": text, "data": None}
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_json_file(filename, data, indent=None):
+    """
+    JSONファイルをアトミックに書き込み、キャッシュを書き込んだ内容で更新する。
+    :param indent: 整形して保存する場合のインデント幅。省略時は区切り文字を詰めたコンパクトな形式で保存する
+    """
+    _write_text(os.path.abspath(filename), _dump_json(data, indent))
+
+
+class CoalescingWriter:
+    """
+    同じファイルへの短時間の連続した保存をまとめる書き込み器。
+    schedule() で渡された内容は、前回の書き込みから interval 秒経過していればその時点で、
+    そうでなければ次の schedule() または flush() の時点で書き込まれる。
+    JSONへの変換は呼び出し側のスレッドで行い（その時点の内容を確定させる）、ファイルへの書き込みはバックグラウンドで行う。
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}  # path -> data
+        self._last_flush = {}  # path -> 最後に書き込みを開始した時刻
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='json-writer')
+
+    def schedule(self, filename, data):
+        path = os.path.abspath(filename)
+        now = time.monotonic()
+        with self._lock:
+            self._pending[path] = data
+            last_flush = self._last_flush.setdefault(path, now)
+            if now - last_flush >= self.interval:
+                self._flush_path(path, now)
+
+    def _flush_path(self, path, now):
+        data = self._pending.pop(path)
+        text = _dump_json(data)
+        self._last_flush[path] = now
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.append(self._executor.submit(_write_text, path, text))
+
+    def flush(self):
+        """保留中の内容をすべて書き込み、バックグラウンドの書き込みが完了するまで待つ"""
+        with self._lock:
+            now = time.monotonic()
+            for path in list(self._pending):
+                self._flush_path(path, now)
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+def invalidate(filename=None):
+    """キャッシュを破棄する。filenameを省略した場合はすべて破棄する"""
+    with _cache_lock:
+        if filename is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(filename), None)
+
+
+def get_cache_stats():
+    """キャッシュのヒット/ミス/書き込み回数と、保持しているファイル数を返す"""
+    with _cache_lock:
+        return {**_stats, "entries": len(_cache)}
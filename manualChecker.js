@@ -3,7 +3,7 @@
  */
 import * as dom from './dom.js';
 import { areas } from './config.js';
-import { saveManualHistoryAPI } from './api.js';
+import { saveManualHistoryAPI, enqueueJobAPI, streamJobEventsAPI } from './api.js';
 import { setMeasuringState } from './ui.js';
 import { fetchAndDisplayAutoHistory } from './history.js';
 
@@ -115,17 +115,12 @@ export async function checkRank(state) {
         overallStatusContainer.textContent = `${index + 1} / ${serviceKeywords.length} 件目: 「${fullKeyword}」を計測中... `;
         keywordResultContainer.innerHTML = `<h4 style="margin-top:0; margin-bottom: 10px;">「${fullKeyword}」</h4><p>計測しています...</p>`;
 
-        await new Promise((resolve, reject) => {
-            const eventSource = new EventSource(eventSourceUrl, { withCredentials: true });
-
-            eventSource.onmessage = (event) => {
-                const data = JSON.parse(event.data);
-
+        try {
+            // 計測はサーバーのジョブとして実行し、進捗を受け取る (接続が切れても続きから受け取れる)
+            const jobId = await enqueueJobAPI(eventSourceUrl);
+            await streamJobEventsAPI(jobId, (data) => {
                 if (data.error) {
-                    keywordResultContainer.innerHTML = `<h4 style="margin-top:0; margin-bottom: 10px;">「${escapeHtml(fullKeyword)}」</h4><p style="color: red;">エラー: ${escapeHtml(data.error)}</p>`;
-                    eventSource.close();
-                    reject(new Error(data.error));
-                    return;
+                    throw new Error(data.error);
                 }
 
                 if (data.status) {
@@ -191,20 +186,12 @@ export async function checkRank(state) {
                     keywordResultContainer.style.cursor = 'pointer';
                     keywordResultContainer.title = 'クリックして詳細（スクショとデバッグ情報）を表示';
                     keywordResultContainer.onclick = () => openResultInNewTab(result);
-                    
-                    eventSource.close();
-                    resolve();
                 }
-            };
-
-            eventSource.onerror = (err) => {
-                keywordResultContainer.innerHTML = `<h4 style="margin-top:0; margin-bottom: 10px;">「${escapeHtml(fullKeyword)}」</h4><p style="color: red;">エラー: サーバーとの接続に失敗しました。</p>`;
-                eventSource.close();
-                reject(err);
-            };
-        }).catch(error => {
+            });
+        } catch (error) {
+            keywordResultContainer.innerHTML = `<h4 style="margin-top:0; margin-bottom: 10px;">「${escapeHtml(fullKeyword)}」</h4><p style="color: red;">エラー: ${escapeHtml(error.message)}</p>`;
             console.error(`「${fullKeyword}」の計測中にエラーが発生しました:`, error);
-        });
+        }
     }
 
     clearInterval(timerInterval);
@@ -243,8 +230,11 @@ function openResultInNewTab(resultData) {
         return;
     }
     const screenshotHtml = resultData.screenshot_path ? `<h2>スクリーンショット</h2><a href="${resultData.screenshot_path}" target="_blank"><img src="${resultData.screenshot_path}" style="max-width: 100%; border: 1px solid #ddd;" alt="Screenshot"></a>` : '<h2>スクリーンショットはありません</h2>';
-    const debugHtmlContent = resultData.html ? escapeHtml(resultData.html) : 'HTMLコンテンツはありませんでした。';
-    const debugInfoHtml = `<h2>デバッグ情報</h2><p><strong>最終アクセスURL:</strong> <a href="${resultData.url || '#'}" target="_blank">${resultData.url || 'N/A'}</a></p><p><strong>取得したページのHTMLソース:</strong></p><textarea style="width: 98%; height: 400px; font-family: monospace; border: 1px solid #ccc; padding: 5px;" readonly>${debugHtmlContent}</textarea>`;
+    // ページのHTMLは結果に含めず、デバッグ用ファイルとして保存された場合のみリンクを表示する
+    const debugHtmlLink = resultData.html_path
+        ? `<a href="/debug-artifacts/${encodeURIComponent(resultData.html_path.split(/[\\/]/).pop())}" target="_blank">HTMLソースを開く</a>`
+        : 'HTMLは保存されていません。（エラー発生時、またはデバッグ設定が有効な場合のみ保存されます）';
+    const debugInfoHtml = `<h2>デバッグ情報</h2><p><strong>最終アクセスURL:</strong> <a href="${resultData.url || '#'}" target="_blank">${resultData.url || 'N/A'}</a></p><p><strong>取得したページのHTMLソース:</strong> ${debugHtmlLink}</p>`;
     newTab.document.write(`<!DOCTYPE html><html lang="ja"><head><meta charset="UTF-8"><title>計測詳細 - ${resultData.keyword || ''}</title><style>body { font-family: -apple-system, BlinkMacSystemFont, sans-serif; padding: 20px; line-height: 1.6; } h1, h2 { border-bottom: 1px solid #eee; padding-bottom: 10px; margin-bottom: 15px; }</style></head><body><h1>計測詳細</h1>${screenshotHtml}<hr style="margin: 20px 0;">${debugInfoHtml}</body></html>`);
     newTab.document.close();
 }
\ No newline at end of file
@@ -1,39 +1,126 @@
 import time
-import datetime
-import os
-import re
 import urllib.parse
 import requests
-from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
-from PIL import Image
 from flask import current_app
 
 import config
-from utils import sse_format, get_lat_lng_from_address
+from utils import get_lat_lng_from_address
+import debug_artifacts
+from events import Status, FinalResult, Error
+from rate_limiter import throttle
+import screenshot_writer
+import serp_cache
 
-def check_meo_ranking(driver, keyword, location_name, target_salon_name=None, save_screenshot=True):
-    """Googleマップでの掲載順位をスクレイピングし、見つかった店舗をすべてリストアップするジェネレータ関数"""
+# Googleマップの検索結果フィードから、arguments[0] 番目以降の店舗ブロックだけを取り出すスクリプト。
+# ページ全体のHTMLを毎回取得・解析し直さないよう、ブラウザ内で (店舗名, 広告か) だけを返す。
+_EXTRACT_FEED_ITEMS_SCRIPT = """
+const feed = document.querySelector('div[role="feed"]');
+if (!feed) return null;
+const blocks = feed.querySelectorAll(':scope > div > div[jsaction]');
+const start = Math.min(arguments[0], blocks.length);
+const items = [];
+for (let i = start; i < blocks.length; i++) {
+    const block = blocks[i];
+    const isAd = Array.from(block.querySelectorAll('span')).some(
+        span => span.childElementCount === 0 && span.textContent.includes('広告'));
+    const link = block.querySelector('a[aria-label]');
+    items.push([link ? link.getAttribute('aria-label') : null, isAd]);
+}
+const end = document.evaluate("//span[contains(text(), 'リストの最後に到達しました')]", feed, null,
+    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null;
+return {start: start, count: blocks.length, items: items, end: end};
+"""
+
+# フィードの店舗ブロック数と、リストの終端 (「リストの最後に到達しました」) が表示されているかを返すスクリプト
+_FEED_STATE_SCRIPT = """
+const feed = document.querySelector('div[role="feed"]');
+if (!feed) return null;
+const end = document.evaluate("//span[contains(text(), 'リストの最後に到達しました')]", feed, null,
+    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null;
+return {count: feed.querySelectorAll(':scope > div > div[jsaction]').length, end: end};
+"""
+
+# 描画が2フレーム進む (リサイズやスクロール後のレイアウトが反映される) まで待つスクリプト
+_WAIT_FOR_PAINT_SCRIPT = """
+const done = arguments[arguments.length - 1];
+requestAnimationFrame(() => requestAnimationFrame(() => done(true)));
+"""
+
+def _wait_for_feed_growth(driver, previous_count, timeout):
+    """フィードの店舗ブロックが previous_count より増えるか、リストの終端が表示されるまで待つ (最大 timeout 秒)"""
+    def feed_grew_or_ended(d):
+        state = d.execute_script(_FEED_STATE_SCRIPT)
+        return state is None or state['end'] or state['count'] > previous_count
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.2).until(feed_grew_or_ended)
+    except TimeoutException:
+        pass
+
+def _wait_for_stable_height(driver, element, timeout):
+    """要素の scrollHeight が変わらなくなる (遅延読み込みが落ち着く) まで待つ (最大 timeout 秒)"""
+    last_height = [None]
+    def height_is_stable(d):
+        height = d.execute_script("return arguments[0].scrollHeight", element)
+        stable = height == last_height[0]
+        last_height[0] = height
+        return stable
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.25).until(height_is_stable)
+    except TimeoutException:
+        pass
+
+def check_meo_ranking(driver, keyword, location_name, target_salon_name=None, save_screenshot=True, force_refresh=False):
+    """
+    Googleマップでの掲載順位をスクレイピングし、見つかった店舗をすべてリストアップするジェネレータ関数
+    :param force_refresh: Trueの場合、検索結果キャッシュ (serp_cache) を使わずに必ず取得し直す
+    """
     try:
         if not config.GOOGLE_API_KEY:
-            yield sse_format({"error": "Google APIキーが設定されていません。"})
+            yield Error("Google APIキーが設定されていません。")
+            return
+
+        # 同じ地点・キーワードの結果が直前に取得されていれば、アクセスせずにそれを使う
+        # (自店を見つけた時点で打ち切った結果は、自店を探す場合にのみ使える)
+        cache_key = serp_cache.make_key('meo', keyword=keyword, location=location_name)
+        cached = None if force_refresh else serp_cache.get(cache_key, require_screenshot=save_screenshot)
+        if cached and (cached['complete'] or (target_salon_name and serp_cache.match(cached, [target_salon_name], ignore_case=True))):
+            yield Status(f"{serp_cache.age_minutes(cached)}分前に取得した検索結果を使用します。")
+            final_result = {
+                "total_count": cached['total_count'],
+                "screenshot_path": cached['screenshot_path'],
+                "url": cached['url'],
+                "results": [{"rank": item['rank'], "foundSalonName": item['name']} for item in cached['ranking']],
+                "cached": True
+            }
+            if cached.get('rank'):
+                final_result['rank'] = cached['rank']
+            yield FinalResult(final_result)
             return
         
         # エラー発生時に備え、デバッグ用変数を初期化
         last_url_checked = ""
         screenshot_path = None
+        screenshot_future = None # スクリーンショットの保存の完了待ち
+
+        # 工程ごとの所要時間（秒）。待機にどれだけ時間を使っているかを最終結果で確認できるようにする
+        timings = {}
+        def record_timing(step, started):
+            timings[step] = round(timings.get(step, 0) + time.perf_counter() - started, 3)
+        job_started = time.perf_counter()
         
         # 1. 検索地点の座標を取得
-        yield sse_format({"status": f"「{location_name}」の座標を取得しています..."})
+        yield Status(f"「{location_name}」の座標を取得しています...")
+        step_started = time.perf_counter()
         latitude, longitude = get_lat_lng_from_address(location_name)
-        yield sse_format({"status": f"座標 ({latitude:.4f}, {longitude:.4f}) を取得しました。"})
-        time.sleep(0.5)
+        record_timing('geocode', step_started)
+        yield Status(f"座標 ({latitude:.4f}, {longitude:.4f}) を取得しました。")
 
         # ブラウザの位置情報をエミュレート
-        yield sse_format({"status": "ブラウザの位置情報を設定しています..."})
+        yield Status("ブラウザの位置情報を設定しています...")
         driver.execute_cdp_cmd(
             "Emulation.setGeolocationOverride",
             {
@@ -46,7 +133,11 @@ def check_meo_ranking(driver, keyword, location_name, target_salon_name=None, sa
         # 検索URLの生成
         search_params = f"{urllib.parse.quote(keyword)}/@{latitude},{longitude},15z"
         search_url = f"https://www.google.com/maps/search/{search_params}?hl=ja&gl=JP"
-        yield sse_format({"status": f"Googleマップで「{keyword}」を検索しています..."})
+        yield Status(f"Googleマップで「{keyword}」を検索しています...")
+        step_started = time.perf_counter()
+        throttle(search_url) # Googleへのアクセス頻度を制御
+        record_timing('throttle', step_started)
+        step_started = time.perf_counter()
         driver.get(search_url)
 
         scrollable_element_selector = 'div[role="feed"]' 
@@ -60,102 +151,117 @@ def check_meo_ranking(driver, keyword, location_name, target_salon_name=None, sa
         except TimeoutException:
             # マップ枠が表示されなかった場合
             current_app.logger.info(f"MEO計測でマップ枠が表示されませんでした。キーワード: {keyword}")
-            final_result = {"rank": "枠無", "results": [], "total_count": 0, "screenshot_path": None, "url": driver.current_url, "html": driver.page_source}
-            yield sse_format({"final_result": final_result, "status": "完了"})
+            record_timing('page_load', step_started)
+            record_timing('total', job_started)
+            final_result = {"rank": "枠無", "results": [], "total_count": 0, "screenshot_path": None, "url": driver.current_url, "timings": timings}
+            if config.SCRAPER_DEBUG_SAVE_HTML:
+                final_result["html_path"] = debug_artifacts.save_html(driver.page_source, f"meo_{keyword}")
+            serp_cache.put(cache_key, [], 0, url=final_result['url'], rank="枠無")
+            yield FinalResult(final_result)
             return
 
+        record_timing('page_load', step_started)
         last_url_checked = driver.current_url
 
         if save_screenshot:
-            yield sse_format({"status": "スクリーンショットを撮影しています..."})
+            yield Status("スクリーンショットを撮影しています...")
+            step_started = time.perf_counter()
             try:
-                # 一旦下にスクロールして高さを確定させ、窓サイズを調整して撮影
+                # 一旦下にスクロールして高さを確定させ、表示領域をリストの高さまで広げて撮影する
+                # (ウィンドウサイズは変えず、撮影後は元の表示領域に戻る)
                 driver.execute_script("arguments[0].scrollTop = arguments[0].scrollHeight", scrollable_element)
-                time.sleep(1)
+                _wait_for_stable_height(driver, scrollable_element, config.MEO_SETTLE_TIMEOUT)
                 panel_height = driver.execute_script("return arguments[0].scrollHeight", scrollable_element)
-                window_height = max(800, min(panel_height, 8000))
-                driver.set_window_size(1200, window_height)
-                time.sleep(0.5)
-                driver.execute_script("arguments[0].scrollTop = 0", scrollable_element)
-                time.sleep(0.5)
+                viewport_height = max(800, min(panel_height, 8000))
+                with screenshot_writer.expanded_viewport(driver, viewport_height):
+                    driver.execute_async_script(_WAIT_FOR_PAINT_SCRIPT) # 表示領域の変更後のレイアウトの反映を待つ
+                    driver.execute_script("arguments[0].scrollTop = 0", scrollable_element)
+                    driver.execute_async_script(_WAIT_FOR_PAINT_SCRIPT)
+                    # 撮影のみ行い、JPEGへの変換・保存はバックグラウンドで行う (その間に検索結果の解析を進める)
+                    screenshot_future = screenshot_writer.capture(driver, timings=timings)
             except Exception as e:
-                current_app.logger.warning(f"スクリーンショットのためのリサイズ中にエラーが発生: {e}")
-
-            timestamp = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
-            safe_keyword = re.sub(r'[\\/:*?"<>|]', '_', keyword)
-            safe_location = re.sub(r'[\\/:*?"<>|]', '_', location_name)
-            base_filename = f"{timestamp}_{safe_location}_{safe_keyword}"
+                current_app.logger.warning(f"表示領域を広げての撮影中にエラーが発生しました: {e}")
+                if screenshot_future is None: # 撮影前に失敗した場合は、表示中の範囲を撮影する
+                    screenshot_future = screenshot_writer.capture(driver, timings=timings)
+            record_timing('screenshot', step_started)
 
-            temp_png_path = os.path.join(config.SCREENSHOT_DIR, f"temp_meo_{timestamp}.png")
-            driver.save_screenshot(temp_png_path)
-
-            jpeg_filename = f"{base_filename}.jpg"
-            jpeg_filepath = os.path.join(config.SCREENSHOT_DIR, jpeg_filename)
-            
-            try:
-                with Image.open(temp_png_path) as img:
-                    if img.mode == 'RGBA':
-                        img = img.convert('RGB')
-                    img.save(jpeg_filepath, 'jpeg', quality=config.SCREENSHOT_JPEG_QUALITY)
-                screenshot_path = jpeg_filepath
-            finally:
-                if os.path.exists(temp_png_path):
-                    os.remove(temp_png_path)
-
-        yield sse_format({"status": "検索結果を解析しています..."})
+        yield Status("検索結果を解析しています...")
         found_salons = []
         processed_aria_labels = set()
+        complete = True # 自店が見つかった時点で解析を打ち切った場合は False
+        next_index = 0 # フィードの中でまだ解析していない最初の店舗ブロックの位置
         
         # 最大5回（約100位）までスクロールを試みる
         max_scrolls = 5
         for i in range(max_scrolls):
-            yield sse_format({"status": f"検索結果を解析中... ({i+1}/{config.MEO_SCROLL_COUNT})"})
-            html = driver.page_source
-            soup = BeautifulSoup(html, 'lxml')
-            
-            # 店舗ブロックを抽出
-            result_blocks = soup.select('div[role="feed"] > div > div[jsaction]')
-            for item_block in result_blocks:
-                found_target_this_cycle = False
-                if item_block.find('span', string=re.compile(r'広告')):
+            yield Status(f"検索結果を解析中... ({i+1}/{config.MEO_SCROLL_COUNT})")
+            # 前回の続きから、新しく読み込まれた店舗ブロックだけを (店舗名, 広告か) の形で受け取る
+            step_started = time.perf_counter()
+            feed = driver.execute_script(_EXTRACT_FEED_ITEMS_SCRIPT, next_index)
+            record_timing('extract', step_started)
+            if not feed:
+                break
+            block_count, items = feed['count'], feed['items']
+            if i > 0 and block_count <= next_index:
+                # スクロールしても新しい店舗が読み込まれなかった場合は、リストの終端とみなす
+                current_app.logger.info(f"MEO計測でフィードの件数が増えなくなったため、解析を終了します。（{len(found_salons)}件）")
+                break
+
+            next_index = block_count
+            for offset, (aria_label, is_ad) in enumerate(items):
+                if is_ad:
                     continue
-                
-                name_element = item_block.find('a', {'aria-label': True})
-                if name_element and name_element['aria-label'] not in processed_aria_labels:
-                    salon_name = name_element['aria-label'].strip()
+                if aria_label is None:
+                    # 読み込み中の店舗ブロックは、次回もう一度確認する
+                    next_index = min(next_index, feed['start'] + offset)
+                    continue
+                salon_name = aria_label.strip()
+                if salon_name not in processed_aria_labels:
                     found_salons.append({"rank": len(found_salons) + 1, "foundSalonName": salon_name})
                     processed_aria_labels.add(salon_name)
-                    
-                    # 自店が見つかった場合はフラグを立てる
-                    if target_salon_name and target_salon_name.lower() in salon_name.lower():
-                        found_target_this_cycle = True
             
             if target_salon_name and any(target_salon_name.lower() in s['foundSalonName'].lower() for s in found_salons):
-                yield sse_format({"status": f"自店「{target_salon_name}」が見つかったため、解析を終了します。"})
+                yield Status(f"自店「{target_salon_name}」が見つかったため、解析を終了します。")
+                complete = False
+                break
+            if feed['end']:
+                current_app.logger.info(f"MEO計測でリストの終端に到達しました。（{len(found_salons)}件）")
                 break
                 
             # 次の読み込みのためにスクロール
             try:
                 scroll_target = driver.find_element(By.CSS_SELECTOR, scrollable_element_selector)
                 driver.execute_script("arguments[0].scrollTop = arguments[0].scrollHeight", scroll_target)
-                time.sleep(2.5) # ロード待ち
+                # 新しい店舗が読み込まれるか、リストの終端が表示されるまで待つ (最大 MEO_SCROLL_WAIT_TIMEOUT 秒)
+                step_started = time.perf_counter()
+                _wait_for_feed_growth(driver, block_count, config.MEO_SCROLL_WAIT_TIMEOUT)
+                record_timing('scroll_wait', step_started)
             except Exception:
                 break
 
+        screenshot_path = screenshot_writer.wait(screenshot_future)
+        record_timing('total', job_started)
+        current_app.logger.info(f"MEO計測 '{keyword}' ({location_name}) の工程別所要時間: {timings}")
+        serp_cache.put(cache_key, [{"rank": s['rank'], "name": s['foundSalonName']} for s in found_salons], len(found_salons),
+                       complete=complete, url=last_url_checked, screenshot_path=screenshot_path)
         final_result = {
             "total_count": len(found_salons),
             "screenshot_path": screenshot_path,
             "url": last_url_checked,
-            "html": driver.page_source,
-            "results": found_salons
+            "results": found_salons,
+            "timings": timings
         }
-        yield sse_format({"final_result": final_result, "status": "完了"})
+        if config.SCRAPER_DEBUG_SAVE_HTML:
+            # ページ全体のHTMLの取得は重いため、デバッグ時のみ行う
+            final_result["html_path"] = debug_artifacts.save_html(driver.page_source, f"meo_{keyword}")
+        yield FinalResult(final_result)
 
     except Exception as e:
         current_app.logger.error(f"MEO計測処理中にエラーが発生しました: {e}")
-        yield sse_format({
-            "error": f"ブラウザの操作中にエラーが発生しました: {e}",
-            "url": driver.current_url if 'driver' in locals() and driver else "",
-            "html": driver.page_source if 'driver' in locals() and driver else "HTML取得失敗",
-            "screenshot_path": None
-        })
\ No newline at end of file
+        url, html_path = "", None
+        try:
+            url = driver.current_url
+            html_path = debug_artifacts.save_html(driver.page_source, f"meo_{keyword}", force=True)
+        except Exception:
+            pass
+        yield Error(f"ブラウザの操作中にエラーが発生しました: {e}", url=url, html_path=html_path)
\ No newline at end of file
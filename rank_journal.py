@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+import config
+from history_index import HistoryIndex
+from json_cache import load_json_file, save_json_file
+
+"""
+計測結果を履歴タイプごとのジャーナル (JSON Lines) に1行ずつ追記するモジュール。
+1件の結果を保存するたびに数MBの history_*.json を書き直す代わりに、
+ジャーナルへ追記して fsync するだけで永続化できます。
+
+読み込み時は history_*.json (スナップショット) にジャーナルの内容を重ねて返し、
+compact() でジャーナルの内容をスナップショットに反映してジャーナルを空にします。
+"""
+
+_journal_lock = threading.Lock()
+
+
+def journal_path(history_type):
+    return f"{config.HISTORY_FILES[history_type]}{config.HISTORY_JOURNAL_SUFFIX}"
+
+
+def append_result(history_type, task, date_str, rank, screenshot_path):
+    """1件の計測結果をジャーナルに追記し、ディスクに書き込まれるまで待つ"""
+    record = {"task": task, "date": date_str, "rank": rank, "screenshot": screenshot_path}
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+    with _journal_lock:
+        with open(journal_path(history_type), 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def has_entries(history_type):
+    try:
+        return os.path.getsize(journal_path(history_type)) > 0
+    except OSError:
+        return False
+
+
+def read_journal(history_type):
+    """ジャーナルの記録を古い順に返す。書き込み途中で中断された行は読み飛ばす"""
+    path = journal_path(history_type)
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def apply_journal(history, records):
+    """ジャーナルの記録を履歴 (HistoryIndex) に反映する。同じ日付の結果は後の記録で上書きされる"""
+    for record in records:
+        history.update(record['task'], record['date'], record['rank'], record.get('screenshot'))
+
+
+def merge_journal(snapshot, records):
+    """
+    スナップショット (history_*.json の中身) にジャーナルの記録を重ねた、新しい履歴のリストを返す。
+    記録のあるエントリのみコピーして変更し、それ以外はスナップショットのエントリをそのまま使うため、
+    snapshot にはキャッシュ上の共有オブジェクト (load_json_file(copy=False)) を渡せる。戻り値も読み取り専用として扱うこと
+    """
+    touched_ids = {record['task']['id'] for record in records}
+    copies = {}
+    items = []
+    for entry in snapshot:
+        task_id = entry.get('id')
+        if task_id in touched_ids and task_id not in copies:
+            entry = {**entry, 'log': [dict(row) for row in entry.get('log', [])]}
+            copies[task_id] = entry
+        items.append(entry)
+    history = HistoryIndex(list(copies.values()))
+    apply_journal(history, records)
+    # ジャーナルで初めて記録されたタスクは末尾に追加する
+    items.extend(history.items[len(copies):])
+    return items
+
+
+def compact(history_type, order=None):
+    """
+    ジャーナルの内容をスナップショット (history_*.json) に反映し、ジャーナルを空にする。反映した件数を返す
+    :param order: {タスクID: 順番} を渡すと、反映と同時にエントリをこの順に並べ替えて保存する (順番のないものは末尾)
+    """
+    with _journal_lock:
+        records = read_journal(history_type)
+        if not records and order is None:
+            return 0
+        history_filename = config.HISTORY_FILES[history_type]
+        snapshot = load_json_file(history_filename, copy=False)
+        items = merge_journal(snapshot, records)
+        if order is not None:
+            items.sort(key=lambda entry: order.get(entry['id'], float('inf')))
+        # ジャーナルがなく並び順も変わらない場合は書き込まない
+        if records or any(a is not b for a, b in zip(items, snapshot)) or len(items) != len(snapshot):
+            save_json_file(history_filename, items)
+        if records:
+            os.remove(journal_path(history_type))
+        return len(records)
+
+
+def compact_all(orders=None):
+    """
+    すべての履歴タイプのジャーナルをスナップショットに反映する。{タイプ: 件数} を返す
+    :param orders: {タイプ: {タスクID: 順番}}。指定したタイプは反映と同時に並べ替える
+    """
+    orders = orders or {}
+    return {history_type: compact(history_type, orders.get(history_type)) for history_type in config.HISTORY_FILES}
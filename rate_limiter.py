@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+import urllib.parse
+
+import config
+
+"""
+アクセス先ホストごとのリクエスト頻度を制御するモジュール（トークンバケット方式）。
+スクレイパーはページを取得する直前に throttle(url) を呼び出します。
+固定の sleep と違い、前回のリクエストから既に十分な時間が経っていれば待たずに進むため、
+待機時間はアクセス先への配慮として本当に必要な分だけになります。
+
+ホストごとのレート・バースト・ゆらぎは config.RATE_LIMITS で調整できます。
+制限は全スレッド（並列実行中のすべてのワーカー）で共有されます。
+"""
+
+class TokenBucket:
+    """
+    rate (回/秒) でトークンが補充され、最大 burst 個まで貯まるバケット。
+    1回のリクエストごとにトークンを1つ消費し、足りなければ補充されるまで待機する。
+    """
+
+    def __init__(self, rate, burst=1, jitter=0):
+        """
+        :param rate: 1秒あたりに許可するリクエスト数
+        :param burst: 連続して待たずに送れるリクエストの最大数
+        :param jitter: 待機時間に加えるランダムなゆらぎの最大秒数（機械的な等間隔アクセスを避けるため）
+        """
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得できるまで待機する。待機した秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # 不足分は先に予約しておき（マイナスを許容）、他のスレッドが同じトークンを使わないようにする
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0 and self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_bucket(host):
+    """ホストに対応するトークンバケットを返す（設定がないホストは 'default' の設定を使う）"""
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            settings = config.RATE_LIMITS.get(host, config.RATE_LIMITS['default'])
+            bucket = TokenBucket(settings['rate'], settings.get('burst', 1), settings.get('jitter', 0))
+            _buckets[host] = bucket
+        return bucket
+
+def throttle(url_or_host):
+    """URL (またはホスト名) のホストへのリクエストを送ってよくなるまで待機する。待機した秒数を返す"""
+    host = urllib.parse.urlsplit(url_or_host).hostname if '://' in url_or_host else url_or_host
+    return get_bucket(host or 'default').acquire()
@@ -0,0 +1,252 @@
+import datetime
+import os
+import threading
+import uuid
+
+import config
+from json_cache import load_json_file, save_json_file
+
+"""
+自動計測の実行記録 (マニフェスト) を管理するモジュール。
+1回の run_scheduled_check ごとに、実行ID・対象ジョブの一覧・ジョブごとの状態をファイルに保存します。
+計測の途中でChromeが落ちたり、restart.sh でプロセスが強制終了されたりしても、
+同じ日のうちであれば終わっていないジョブだけを実行し直せます (resume)。
+
+ジョブの状態:
+    pending  未実行
+    running  実行中 (プロセスが強制終了された場合はこのまま残る)
+    done     結果を履歴に記録済み
+    failed   スクレイピングに失敗した (config.RUN_MAX_JOB_ATTEMPTS 回実行しても終わらなかったジョブも含む)
+    skipped  ブラウザを起動できずに実行されなかった
+    removed  実行し直す時点でタスクが削除・変更されていたため、実行しなかった
+
+実行全体の状態 (status):
+    running      実行中
+    completed    すべてのジョブが done (または removed)
+    incomplete   done でないジョブを残して終了した
+    interrupted  running のままプロセスが終了していた (起動時に mark_interrupted() で判定)
+"""
+
+_lock = threading.Lock()
+
+RESUMABLE_STATUSES = ('incomplete', 'interrupted')
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _path(run_id):
+    return os.path.join(config.RUN_MANIFEST_DIR, f"{run_id}.json")
+
+
+def job_key(job):
+    """ジョブを識別するキー (種類と、含まれるタスクIDの組み合わせ)。実行し直した時に同じジョブを見つけるために使う"""
+    return f"{job['kind']}:" + "|".join(sorted(str(task['id']) for task in job['tasks']))
+
+
+def _job_entry(job):
+    return {
+        "key": job_key(job),
+        "kind": job['kind'],
+        "name": job['name'],
+        "task_ids": [task['id'] for task in job['tasks']],
+        "state": "pending",
+        "attempts": 0,
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+def save(manifest):
+    manifest['updated_at'] = _now()
+    with _lock:
+        os.makedirs(config.RUN_MANIFEST_DIR, exist_ok=True)
+        save_json_file(_path(manifest['run_id']), manifest, indent=2)
+
+
+def load(run_id):
+    """実行IDのマニフェストを返す。存在しない場合は None"""
+    if not run_id or os.path.basename(run_id) != run_id:
+        return None
+    manifest = load_json_file(_path(run_id))
+    return manifest or None
+
+
+def create(jobs, date_str, trigger, options):
+    """
+    新しい実行のマニフェストを作成して保存する。
+    :param trigger: 'scheduled' (スケジューラ) または 'manual' (画面からの実行)
+    :param options: 実行し直す時に同じ条件で実行するための引数 (task_ids, save_screenshot, force_refresh)
+    """
+    run_id = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    manifest = {
+        "run_id": run_id,
+        "date": date_str,
+        "trigger": trigger,
+        "status": "running",
+        "options": options,
+        "created_at": _now(),
+        "updated_at": None,
+        "resumed_at": [],
+        "jobs": [_job_entry(job) for job in jobs],
+    }
+    save(manifest)
+    _cleanup()
+    return manifest
+
+
+def _exhausted(entry):
+    """config.RUN_MAX_JOB_ATTEMPTS 回実行しても終わらず、これ以上実行し直さないジョブか"""
+    return entry['state'] != 'done' and entry['attempts'] >= config.RUN_MAX_JOB_ATTEMPTS
+
+
+def sync_jobs(manifest, jobs):
+    """
+    実行し直す時に、今回実行するジョブとマニフェストを対応させる。
+    マニフェストにないジョブ (タスクの変更でまとめ方が変わったもの) は追加し、
+    終わっていないのに今回実行しないジョブ (タスクが削除されたもの) は removed にする
+    """
+    keys = {job_key(job) for job in jobs}
+    for entry in manifest['jobs']:
+        if entry['state'] != 'done' and not _exhausted(entry) and entry['key'] not in keys:
+            entry['state'] = 'removed'
+    known = {entry['key'] for entry in manifest['jobs']}
+    for job in jobs:
+        if job_key(job) not in known:
+            manifest['jobs'].append(_job_entry(job))
+    save(manifest)
+
+
+def _find(manifest, job):
+    key = job_key(job)
+    return next((entry for entry in manifest['jobs'] if entry['key'] == key), None)
+
+
+def update_job(manifest, job, state):
+    """ジョブの状態を更新して保存する"""
+    entry = _find(manifest, job)
+    if entry is None:
+        entry = _job_entry(job)
+        manifest['jobs'].append(entry)
+    entry['state'] = state
+    if state == 'running':
+        entry['attempts'] += 1
+        entry['started_at'] = _now()
+        entry['finished_at'] = None
+    else:
+        entry['finished_at'] = _now()
+    save(manifest)
+
+
+def finish(manifest):
+    """実行の終了時に、ジョブの状態から実行全体の状態を決めて保存する"""
+    all_done = all(entry['state'] in ('done', 'removed') for entry in manifest['jobs'])
+    manifest['status'] = 'completed' if all_done else 'incomplete'
+    save(manifest)
+
+
+def start_resume(manifest):
+    """
+    実行し直しを始める。実行中のまま残っていたジョブは未実行に戻す。
+    ただし実行回数が上限に達したジョブ (毎回プロセスを終了させてしまうジョブなど) は failed にして、これ以上実行しない
+    """
+    for entry in manifest['jobs']:
+        if entry['state'] == 'running':
+            entry['state'] = 'failed' if _exhausted(entry) else 'pending'
+    manifest['status'] = 'running'
+    manifest['resumed_at'].append(_now())
+    save(manifest)
+
+
+def unfinished_task_ids(manifest, histories):
+    """
+    実行し直す必要のあるタスクIDのリストを返す。
+    done でないジョブのタスクに加え、done でも当日の結果が履歴にないタスク
+    (履歴の書き込みをまとめている間にプロセスが終了した場合) も含める。
+    :param histories: {履歴タイプ: HistoryIndex}
+    """
+    task_ids = []
+    for entry in manifest['jobs']:
+        if entry['state'] == 'removed' or _exhausted(entry):
+            continue
+        history = histories.get(entry['kind'])
+        for task_id in entry['task_ids']:
+            if task_id in task_ids:
+                continue
+            if entry['state'] != 'done' or (history is not None and not history.has_result(task_id, manifest['date'])):
+                task_ids.append(task_id)
+    return task_ids
+
+
+def summarize(manifest):
+    """一覧表示用に、ジョブの状態ごとの件数を加えたマニフェストの概要を返す"""
+    counts = {}
+    for entry in manifest['jobs']:
+        counts[entry['state']] = counts.get(entry['state'], 0) + 1
+    return {
+        "run_id": manifest['run_id'],
+        "date": manifest['date'],
+        "trigger": manifest['trigger'],
+        "status": manifest['status'],
+        "created_at": manifest['created_at'],
+        "updated_at": manifest['updated_at'],
+        "resumed_at": manifest['resumed_at'],
+        "job_count": len(manifest['jobs']),
+        "job_states": counts,
+    }
+
+
+def _run_ids():
+    try:
+        names = os.listdir(config.RUN_MANIFEST_DIR)
+    except OSError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith('.json')), reverse=True)
+
+
+def list_runs(limit=20):
+    """新しい順にマニフェストを返す"""
+    manifests = []
+    for run_id in _run_ids()[:limit]:
+        manifest = load(run_id)
+        if manifest:
+            manifests.append(manifest)
+    return manifests
+
+
+def mark_interrupted():
+    """
+    プロセスの起動時に呼び出し、実行中のまま残っているマニフェスト (前回のプロセスが途中で終了したもの) を
+    interrupted にする。interrupted にしたマニフェストのリストを返す
+    """
+    interrupted = []
+    for manifest in list_runs(limit=config.RUN_MANIFEST_MAX_FILES):
+        if manifest['status'] == 'running':
+            manifest['status'] = 'interrupted'
+            save(manifest)
+            interrupted.append(manifest)
+    return interrupted
+
+
+def find_resumable(date_str, trigger=None):
+    """
+    指定日の最新の実行が途中で終わっている場合、そのマニフェストを返す。
+    最新の実行が完了している・実行がない場合は None
+    """
+    for manifest in list_runs(limit=config.RUN_MANIFEST_MAX_FILES):
+        if manifest['date'] != date_str:
+            continue
+        if trigger and manifest['trigger'] != trigger:
+            continue
+        return manifest if manifest['status'] in RESUMABLE_STATUSES else None
+    return None
+
+
+def _cleanup():
+    """保存件数が config.RUN_MANIFEST_MAX_FILES を超えた分を、古いものから削除する"""
+    for run_id in _run_ids()[config.RUN_MANIFEST_MAX_FILES:]:
+        try:
+            os.remove(_path(run_id))
+        except OSError:
+            pass
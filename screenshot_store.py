@@ -0,0 +1,306 @@
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import time
+from collections import Counter
+
+from PIL import Image
+
+import config
+
+"""
+スクリーンショットを内容のハッシュ値 (SHA-256) をファイル名にして保存するストア。
+同じ画像は1つのファイルにまとめ、履歴のログ行からそのパスを参照します。
+保存時に履歴画面用の縮小画像 (サムネイル) も作成します。
+
+保存先 (config.SCREENSHOT_DIR 以下):
+    store/ab/abcdef....jpg    スクリーンショット本体
+    thumbs/ab/abcdef....jpg   サムネイル (本体と同じ名前)
+
+古い履歴のスクリーンショットは保持期間の設定に従って参照を外し (apply_retention)、
+どの履歴からも参照されなくなったファイルは collect_garbage() で削除します。
+
+使い方:
+    python screenshot_store.py stats                 # ファイル数・参照数を表示
+    python screenshot_store.py gc --dry-run          # 削除対象を表示するのみ
+    python screenshot_store.py gc [--include-legacy] # 保持期間の適用と未参照ファイルの削除
+"""
+
+_STORE_SUBDIR = 'store'
+_THUMBNAIL_SUBDIR = 'thumbs'
+
+
+def _store_dir():
+    return os.path.join(config.SCREENSHOT_DIR, _STORE_SUBDIR)
+
+
+def _thumbnail_dir():
+    return os.path.join(config.SCREENSHOT_DIR, _THUMBNAIL_SUBDIR)
+
+
+def object_path(digest):
+    return os.path.join(_store_dir(), digest[:2], f"{digest}.jpg")
+
+
+def _digest_of(path):
+    """ストア内のファイルのパスからハッシュ値を取り出す。ストアのファイルでなければ None"""
+    if not path:
+        return None
+    directory, filename = os.path.split(os.path.normpath(path))
+    if os.path.dirname(directory) != os.path.normpath(_store_dir()):
+        return None
+    digest, ext = os.path.splitext(filename)
+    return digest if ext == '.jpg' and digest.startswith(os.path.basename(directory)) else None
+
+
+def thumbnail_path(path):
+    """スクリーンショットのパスに対応するサムネイルのパスを返す。ストアのファイルでない場合は None"""
+    digest = _digest_of(path)
+    if digest is None:
+        return None
+    return os.path.join(_thumbnail_dir(), digest[:2], f"{digest}.jpg")
+
+
+def _write_once(path, data):
+    """pathが存在しない場合のみ書き込む。書き込みに失敗した場合は途中まで書いたファイルを残さない"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(path, 'xb') as f:
+            f.write(data)
+    except FileExistsError:
+        return False
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return True
+
+
+def _make_thumbnail(jpeg_bytes):
+    """ページ上部 (最初に表示される範囲) を切り出し、config.SCREENSHOT_THUMBNAIL_WIDTH の幅に縮小したJPEGを返す"""
+    with Image.open(io.BytesIO(jpeg_bytes)) as img:
+        width, height = img.size
+        top = img.crop((0, 0, width, min(height, width * 3 // 4)))
+        top.thumbnail((config.SCREENSHOT_THUMBNAIL_WIDTH, config.SCREENSHOT_THUMBNAIL_WIDTH))
+        if top.mode != 'RGB':
+            top = top.convert('RGB')
+        buffer = io.BytesIO()
+        top.save(buffer, 'jpeg', quality=config.SCREENSHOT_THUMBNAIL_QUALITY)
+        return buffer.getvalue()
+
+
+def put(jpeg_bytes):
+    """
+    JPEG画像をストアに保存し、そのパスを返す。
+    同じ内容の画像が保存済みの場合は書き込まずに既存のパスを返す。サムネイルがなければ作成する。
+    """
+    digest = hashlib.sha256(jpeg_bytes).hexdigest()
+    path = object_path(digest)
+    if not _write_once(path, jpeg_bytes):
+        # 保存済みの画像を再び参照するため、削除の猶予期間を計測し直す
+        os.utime(path)
+    thumbnail = thumbnail_path(path)
+    if not os.path.exists(thumbnail):
+        _write_once(thumbnail, _make_thumbnail(jpeg_bytes))
+    return path
+
+
+# --- 保持期間の適用・未参照ファイルの削除 ---
+
+def _keep_screenshot(date, today):
+    """
+    ログ行の日付 (date) のスクリーンショットを残すかどうか。
+    SCREENSHOT_RETENTION_DAILY_DAYS 日以内はすべて残し、SCREENSHOT_RETENTION_WEEKLY_DAYS 日以内は週に1件だけ残す
+    (週1件の選別は apply_retention で行う)。それより古いものは残さない
+    """
+    age_days = (today - date).days
+    if age_days <= config.SCREENSHOT_RETENTION_DAILY_DAYS:
+        return 'daily'
+    if age_days <= config.SCREENSHOT_RETENTION_WEEKLY_DAYS:
+        return 'weekly'
+    return None
+
+
+def _is_collectable(path, include_legacy):
+    """
+    collect_garbage() が削除の対象にするファイルか。
+    ストアのファイルと、include_legacy の場合は SCREENSHOT_DIR の直下にある従来のファイルのみ
+    """
+    normalized = _normalize_reference(path)
+    if _digest_of(normalized) is not None:
+        return True
+    return include_legacy and os.path.dirname(normalized) == os.path.normpath(config.SCREENSHOT_DIR)
+
+
+def apply_retention(history, today=None, include_legacy=False):
+    """
+    履歴 (history_*.json の中身) のログ行から、保持期間を過ぎたスクリーンショットの参照を外す。
+    週ごとに残す期間では、タスクごと・週ごとに最も新しい日付の1件だけを残す。参照を外した件数を返す。
+    参照を外してもファイルが削除されない行 (ストア外のファイル。include_legacy の場合は SCREENSHOT_DIR 直下を除く) は対象にしない
+    """
+    today = today or datetime.date.today()
+    removed = 0
+    for entry in history:
+        weekly_kept = {}  # (ISO年, 週番号) -> その週で残すログ行
+        for row in entry.get('log', []):
+            if not row.get('screenshot') or not _is_collectable(row['screenshot'], include_legacy):
+                continue
+            try:
+                date = datetime.datetime.strptime(row['date'], '%Y/%m/%d').date()
+            except (KeyError, ValueError):
+                continue
+            policy = _keep_screenshot(date, today)
+            if policy == 'daily':
+                continue
+            if policy == 'weekly':
+                week = date.isocalendar()[:2]
+                previous = weekly_kept.get(week)
+                if previous is None or previous['date'] < row['date']:
+                    if previous is not None:
+                        previous['screenshot'] = None
+                        removed += 1
+                    weekly_kept[week] = row
+                    continue
+            row['screenshot'] = None
+            removed += 1
+    return removed
+
+
+def _normalize_reference(path):
+    """ログ行のパスを比較用の絶対パスにする。古い履歴の 'screenshots/...' は /screenshots/ の配信元 (SCREENSHOT_DIR) を指す"""
+    if not os.path.isabs(path):
+        relative = path.replace('\\', '/')
+        if relative.startswith('screenshots/'):
+            return os.path.normpath(os.path.join(config.SCREENSHOT_DIR, relative[len('screenshots/'):]))
+    return os.path.normpath(path)
+
+
+def count_references(histories):
+    """履歴のログ行から参照されているスクリーンショットのパスごとの参照数を返す"""
+    references = Counter()
+    for history in histories:
+        for entry in history:
+            for row in entry.get('log', []):
+                if row.get('screenshot'):
+                    references[_normalize_reference(row['screenshot'])] += 1
+    return references
+
+
+def _iter_files(directory, recursive=True):
+    if not os.path.isdir(directory):
+        return
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith('.jpg'):
+                yield os.path.join(dirpath, filename)
+        if not recursive:
+            break
+
+
+def _remove(path, dry_run):
+    """ファイルを削除し、削除した (する予定の) バイト数を返す"""
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+    except OSError:
+        return 0
+    return size
+
+
+def collect_garbage(references, dry_run=False, include_legacy=False):
+    """
+    どの履歴からも参照されていないスクリーンショットとそのサムネイルを削除する。
+    撮影直後でまだ履歴に記録されていないファイルを消さないよう、
+    更新から config.SCREENSHOT_GC_GRACE_HOURS 時間以内のファイルは残す。
+    :param include_legacy: Trueの場合、ストア導入前に SCREENSHOT_DIR の直下に保存されたファイルも対象にする
+    :return: {"objects", "referenced", "deleted", "bytes_freed"}
+    """
+    grace_started = time.time() - config.SCREENSHOT_GC_GRACE_HOURS * 3600
+    stats = {"objects": 0, "referenced": 0, "deleted": 0, "bytes_freed": 0}
+
+    candidates = list(_iter_files(_store_dir()))
+    if include_legacy:
+        candidates += list(_iter_files(config.SCREENSHOT_DIR, recursive=False))
+    for path in candidates:
+        stats["objects"] += 1
+        if references.get(os.path.normpath(path)):
+            stats["referenced"] += 1
+            continue
+        try:
+            if os.path.getmtime(path) > grace_started:
+                continue
+        except OSError:
+            continue
+        stats["bytes_freed"] += _remove(path, dry_run)
+        stats["deleted"] += 1
+        thumbnail = thumbnail_path(path)
+        if thumbnail:
+            stats["bytes_freed"] += _remove(thumbnail, dry_run)
+
+    # 本体が削除済みのサムネイルを片付ける
+    for thumbnail in _iter_files(_thumbnail_dir()):
+        digest = os.path.splitext(os.path.basename(thumbnail))[0]
+        if not os.path.exists(object_path(digest)):
+            stats["bytes_freed"] += _remove(thumbnail, dry_run)
+    return stats
+
+
+def run_gc(dry_run=False, include_legacy=False, today=None):
+    """
+    すべての履歴タイプに保持期間を適用して保存し、未参照のスクリーンショットを削除する。
+    :return: collect_garbage() の結果に、参照を外したログ行の件数 (rows_pruned) を加えた dict
+    """
+    # 履歴の読み書きは計測処理と同じ経路で行う (JSON/SQLite・ジャーナルの切り替えに従う)。
+    # task_runner はスクレイパー経由でこのモジュールを読み込むため、循環importを避けて関数内で読み込む
+    import rank_journal
+    from task_runner import load_history, save_history
+
+    if config.HISTORY_BACKEND != 'sqlite' and config.HISTORY_JOURNAL_ENABLED and not dry_run:
+        # ジャーナルに残った参照が、保持期間を適用した後の履歴に重ねて復活しないよう先に反映しておく
+        rank_journal.compact_all()
+
+    histories = []
+    rows_pruned = 0
+    for history_type in config.HISTORY_FILES:
+        history = load_history(history_type)
+        pruned = apply_retention(history, today, include_legacy=include_legacy)
+        if pruned and not dry_run:
+            save_history(history_type, history)
+        rows_pruned += pruned
+        histories.append(history)
+
+    stats = collect_garbage(count_references(histories), dry_run=dry_run, include_legacy=include_legacy)
+    stats["rows_pruned"] = rows_pruned
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スクリーンショットのストアを管理します。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="保存されているファイル数・容量と、履歴からの参照数を表示する")
+    gc_parser = subparsers.add_parser('gc', help="保持期間を適用し、履歴から参照されていないファイルを削除する")
+    gc_parser.add_argument('--dry-run', action='store_true', help="削除・履歴の変更を行わず、対象の件数のみ表示する")
+    gc_parser.add_argument('--include-legacy', action='store_true', help=f"{config.SCREENSHOT_DIR} の直下にある従来のファイルも対象にする")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        from task_runner import load_history
+        references = count_references(load_history(history_type) for history_type in config.HISTORY_FILES)
+        paths = list(_iter_files(_store_dir()))
+        total_size = sum(os.path.getsize(path) for path in paths)
+        referenced = sum(1 for path in paths if references.get(os.path.normpath(path)))
+        print(f"ストア: {len(paths)}ファイル / {total_size / 1024 / 1024:.1f}MB (参照あり {referenced}ファイル)")
+        print(f"履歴からの参照: {sum(references.values())}件 / {len(references)}ファイル")
+    elif args.command == 'gc':
+        stats = run_gc(dry_run=args.dry_run, include_legacy=args.include_legacy)
+        prefix = "[dry-run] " if args.dry_run else ""
+        print(f"{prefix}保持期間を過ぎたスクリーンショットの参照を {stats['rows_pruned']}件 外しました。")
+        print(f"{prefix}{stats['objects']}ファイル中 {stats['referenced']}ファイルが参照されており、"
+              f"{stats['deleted']}ファイル ({stats['bytes_freed'] / 1024 / 1024:.1f}MB) を削除しました。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import base64
+import contextlib
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image
+
+import config
+import screenshot_store
+
+"""
+スクリーンショットの撮影・保存を行うモジュール。
+ブラウザからは画像をメモリ上に取得するだけにして、JPEGへの変換とファイルへの書き込みは
+バックグラウンドのスレッドで行います。その間にブラウザは次のページの処理に進めます。
+一時ファイルのPNGは作らず、スクリーンショットのストア (screenshot_store) に1回だけ書き込みます
+(同期フォルダに余計なファイルを作らないため)。
+
+ページ全体の撮影は DevTools Protocol の captureBeyondViewport で行い、ウィンドウサイズは変更しません。
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.SCREENSHOT_ENCODE_WORKERS, thread_name_prefix='screenshot')
+        return _executor
+
+def _full_page_clip(driver, max_height):
+    """ページ全体 (高さは max_height まで) を撮影するための Page.captureScreenshot の clip を返す"""
+    metrics = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+    content = metrics.get('cssContentSize') or metrics['contentSize']
+    viewport = metrics.get('cssLayoutViewport') or metrics['layoutViewport']
+    return {
+        'x': 0,
+        'y': 0,
+        'width': viewport['clientWidth'],
+        'height': min(content['height'], max_height),
+        'scale': 1,
+    }
+
+def _grab(driver, full_page, max_height):
+    """
+    画面を撮影し、(画像のバイト列, JPEGに変換済みか) を返す。
+    ChromeのDevTools Protocolで直接JPEGとして取得し、使えない場合は表示中の範囲をPNGで取得する。
+    """
+    params = {
+        'format': 'jpeg',
+        'quality': config.SCREENSHOT_JPEG_QUALITY,
+        'fromSurface': True,
+    }
+    try:
+        if full_page:
+            params['clip'] = _full_page_clip(driver, max_height)
+            params['captureBeyondViewport'] = True
+        data = driver.execute_cdp_cmd('Page.captureScreenshot', params)
+        return base64.b64decode(data['data']), True
+    except Exception as e:
+        current_app.logger.info(f"DevTools Protocolでの撮影に失敗したため、表示中の範囲をPNGで撮影します: {e}")
+        return driver.get_screenshot_as_png(), False
+
+@contextlib.contextmanager
+def expanded_viewport(driver, height):
+    """
+    ウィンドウサイズを変えずに、表示領域の高さだけを一時的に height に広げる (DevTools Protocol のエミュレーション)。
+    ページ内のスクロール領域 (Googleマップの検索結果など) を一度に撮影する場合に使う。
+    """
+    width = driver.execute_script("return window.innerWidth")
+    driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', {
+        'width': width,
+        'height': height,
+        'deviceScaleFactor': 0,
+        'mobile': False,
+    })
+    try:
+        yield
+    finally:
+        driver.execute_cdp_cmd('Emulation.clearDeviceMetricsOverride', {})
+
+def _write(image_bytes, is_jpeg):
+    """画像をJPEGにしてスクリーンショットのストアに保存し、パスを返す (バックグラウンドのスレッドで実行)"""
+    if not is_jpeg:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            if img.mode != 'RGB': # JPEGは透明度をサポートしないためRGBに変換
+                img = img.convert('RGB')
+            buffer = io.BytesIO()
+            img.save(buffer, 'jpeg', quality=config.SCREENSHOT_JPEG_QUALITY)
+            image_bytes = buffer.getvalue()
+    return screenshot_store.put(image_bytes)
+
+def capture(driver, full_page=False, max_height=None, timings=None):
+    """
+    スクリーンショットを撮影し、JPEGへの変換・保存をバックグラウンドで開始する。
+    撮影が終わった時点で戻るので、呼び出し側はすぐにブラウザを次の操作に使える。
+    :param full_page: Trueの場合、表示中の範囲だけでなくページ全体を撮影する
+    :param max_height: full_page で撮影する高さの上限 (px)。省略時は config.SCREENSHOT_MAX_HEIGHT
+    :param timings: dictを渡すと、撮影 (screenshot_capture) と変換・保存 (screenshot_encode) にかかった秒数を記録する
+    :return: 保存の完了を待つための Future。wait() に渡して保存先のパスを受け取る
+    """
+    started = time.perf_counter()
+    image_bytes, is_jpeg = _grab(driver, full_page, max_height or config.SCREENSHOT_MAX_HEIGHT)
+    if timings is not None:
+        timings['screenshot_capture'] = round(time.perf_counter() - started, 3)
+    app = current_app._get_current_object()
+
+    def write():
+        with app.app_context():
+            write_started = time.perf_counter()
+            try:
+                path = _write(image_bytes, is_jpeg)
+            except Exception as e:
+                current_app.logger.warning(f"スクリーンショットを保存できませんでした: {e}")
+                return None
+            finally:
+                if timings is not None:
+                    timings['screenshot_encode'] = round(time.perf_counter() - write_started, 3)
+            current_app.logger.info(f"画質を調整したスクリーンショットを {path} に保存しました。")
+            return path
+
+    return _get_executor().submit(write)
+
+def wait(future):
+    """capture() の保存が終わるのを待ち、保存したパスを返す。撮影していない・保存に失敗した場合は None"""
+    if future is None:
+        return None
+    return future.result()
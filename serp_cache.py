@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import config
+
+"""
+検索結果 (SERP) の解析済みスナップショットをプロセス内にキャッシュするモジュール。
+夜間の自動計測の直後に同じキーワード・エリアを手動で計測し直した場合などに、
+HPBやGoogleマップへアクセスせずに直前の結果を返します。
+
+キャッシュのキーは正規化した検索条件のハッシュで、値は順位順のサロン名・総件数・取得時刻です。
+有効期限 (config.SERP_CACHE_TTL) を過ぎたものは使わず、件数が config.SERP_CACHE_MAX_ENTRIES を
+超えた場合は最も長く使われていないものから削除します。
+"""
+
+_entries = OrderedDict()  # key -> entry (dict)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0}
+
+
+def _normalize(value):
+    """全角・半角や大文字・小文字、余分な空白の違いで別の検索とみなさないように正規化する"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v not in (None, '')}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return ' '.join(unicodedata.normalize('NFKC', value).lower().split())
+    return value
+
+
+def make_key(source, **query):
+    """検索の種類 (source) と検索条件から、キャッシュのキーを作る"""
+    normalized = json.dumps([source, _normalize(query)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def get(key, require_screenshot=False):
+    """
+    有効期限内のスナップショットを返す。ない場合は None を返す。
+    :param require_screenshot: Trueの場合、スクリーンショットを含まないスナップショットは使わない
+    """
+    if config.SERP_CACHE_TTL <= 0:
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and time.time() - entry["fetched_at"] > config.SERP_CACHE_TTL:
+            del _entries[key]
+            entry = None
+        if entry is None or (require_screenshot and not entry.get("screenshot_path")):
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry
+
+
+def put(key, ranking, total_count, complete=True, url="", screenshot_path=None, **extra):
+    """
+    スナップショットを保存する。
+    :param ranking: 順位順の [{"rank": 順位, "name": サロン名}, ...]
+    :param complete: 最後のページまで取得したか (Falseの場合、途中で検索を打ち切った結果)
+    :param extra: スクレイパー固有の追加情報 (特集ページのタイトルなど)
+    """
+    if config.SERP_CACHE_TTL <= 0:
+        return
+    entry = {
+        "ranking": ranking,
+        "total_count": total_count,
+        "complete": complete,
+        "url": url,
+        "screenshot_path": screenshot_path,
+        "fetched_at": time.time(),
+        **extra,
+    }
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > config.SERP_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+        _stats["stores"] += 1
+
+
+def match(entry, salon_names, ignore_case=False, allow_incomplete=True):
+    """
+    スナップショットの順位からサロン名ごとの結果を作る。
+    途中で検索を打ち切ったスナップショットで見つからないサロンがある場合は、正しい順位がわからないため None を返す。
+    :param allow_incomplete: Falseの場合、途中で検索を打ち切ったスナップショットは使わない
+        (すべての掲載を集める計測で、打ち切った以降のページの順位が欠けないようにする)
+    """
+    if not entry["complete"] and not allow_incomplete:
+        return None
+    found_salons_map = {name: [] for name in salon_names}
+    for item in entry["ranking"]:
+        current_salon_name = item["name"]
+        for name in salon_names:
+            if (name.lower() in current_salon_name.lower()) if ignore_case else (name in current_salon_name):
+                found_salons_map[name].append({"rank": item["rank"], "foundSalonName": current_salon_name})
+    if not entry["complete"] and not all(found_salons_map.values()):
+        return None
+    return found_salons_map
+
+
+def age_minutes(entry):
+    """スナップショットを取得してからの経過時間（分）"""
+    return int((time.time() - entry["fetched_at"]) // 60)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def get_cache_stats():
+    """キャッシュのヒット/ミス回数と保持件数を返す（監視用）"""
+    with _lock:
+        return {**_stats, "entries": len(_entries)}
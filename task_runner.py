@@ -1,217 +1,304 @@
-import time
 import datetime
+import contextlib
 import os
-import json
-import random
+import threading
 from flask import current_app, jsonify
 
 import config
-from utils import sse_format
+from utils import prefill_geocode_cache
+from events import Status, Progress, TaskResult, FinalResult, Completed, Error
 from driver_manager import get_webdriver
 from hpb_scraper import check_hotpepper_ranking
 from feature_page_scraper import check_feature_page_ranking
 from meo_scraper import check_meo_ranking
-def load_json_file(filename):
-    if not os.path.exists(filename):
-        return []
+from history_store import get_history_store
+from history_index import HistoryIndex
+from json_cache import load_json_file, save_json_file, CoalescingWriter
+import rank_journal
+import run_manifest
+import worker_pool
+
+# ジャーナルを重ねた履歴のキャッシュ {履歴タイプ: ((スナップショットとジャーナルの更新時刻・サイズ), 履歴のリスト)}
+_merged_history_cache = {}
+_merged_history_lock = threading.Lock()
+
+def _file_signature(path):
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return []
-
-def save_json_file(filename, data):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def update_history(history, task, date_str, rank, screenshot_path):
-    """履歴リストを更新するヘルパー関数"""
-    task_id = task['id']
-    task_history = next((item for item in history if item["id"] == task_id), None)
-    log_entry = {'date': date_str, 'rank': rank, 'screenshot': screenshot_path}
-
-    if task_history:
-        date_entry = next((d for d in task_history['log'] if d['date'] == date_str), None)
-        if date_entry:
-            date_entry.update(log_entry)
-        else:
-            task_history['log'].append(log_entry)
-            task_history['log'].sort(key=lambda x: datetime.datetime.strptime(x['date'], '%Y/%m/%d'))
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _load_history_with_journal(history_type, copy):
+    """スナップショットに未反映のジャーナルを重ねた履歴を返す。copy=False の場合は、ファイルが変わるまで同じ結果を使い回す"""
+    filename = config.HISTORY_FILES[history_type]
+    signature = (_file_signature(filename), _file_signature(rank_journal.journal_path(history_type)))
+    if not copy:
+        with _merged_history_lock:
+            cached = _merged_history_cache.get(history_type)
+        if cached and cached[0] == signature:
+            return cached[1]
+    records = rank_journal.read_journal(history_type)
+    if copy:
+        history = HistoryIndex(load_json_file(filename))
+        rank_journal.apply_journal(history, records)
+        return history.items
+    # 読み取り専用の場合は、スナップショットを解析し直さずにジャーナルのあるエントリだけをコピーして重ねる
+    items = rank_journal.merge_journal(load_json_file(filename, copy=False), records)
+    with _merged_history_lock:
+        _merged_history_cache[history_type] = (signature, items)
+    return items
+
+def load_history(history_type, copy=True):
+    """
+    指定タイプの計測履歴を読み込む (config.HISTORY_BACKEND に応じてJSON/SQLiteを切り替える)
+    :param copy: Falseの場合はキャッシュ上の共有オブジェクトを返すことがあるため、読み取り専用として扱うこと
+    """
+    if config.HISTORY_BACKEND == 'sqlite':
+        return get_history_store().load(history_type)
+    if config.HISTORY_JOURNAL_ENABLED and rank_journal.has_entries(history_type):
+        # 未反映のジャーナルがある場合は、スナップショットに重ねて返す
+        return _load_history_with_journal(history_type, copy)
+    return load_json_file(config.HISTORY_FILES[history_type], copy=copy)
+
+def get_history_version():
+    """
+    履歴の変更を検出するための (バージョン文字列, 最終更新時刻のUNIX時間) を返す。
+    JSONの場合は各ファイルの更新時刻とサイズ、SQLiteの場合はストアの書き込み番号から求める。
+    """
+    if config.HISTORY_BACKEND == 'sqlite':
+        store = get_history_store()
+        paths = [config.HISTORY_DB_FILE, f"{config.HISTORY_DB_FILE}-wal"]
+        last_modified = max((os.path.getmtime(p) for p in paths if os.path.exists(p)), default=0)
+        return f"sqlite:{store.version()}", last_modified
+
+    parts = []
+    last_modified = 0
+    filenames = list(config.HISTORY_FILES.values())
+    if config.HISTORY_JOURNAL_ENABLED:
+        filenames += [rank_journal.journal_path(history_type) for history_type in config.HISTORY_FILES]
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            parts.append(f"{filename}:-")
+            continue
+        parts.append(f"{filename}:{stat.st_mtime_ns}:{stat.st_size}")
+        last_modified = max(last_modified, stat.st_mtime)
+    return "|".join(parts), last_modified
+
+def save_history(history_type, history, writer=None):
+    """
+    指定タイプの計測履歴を丸ごと保存する
+    :param writer: CoalescingWriterを渡すと、JSONの書き込みを writer.flush() までまとめる
+    """
+    if config.HISTORY_BACKEND == 'sqlite':
+        get_history_store().replace(history_type, history)
+    elif writer:
+        writer.schedule(config.HISTORY_FILES[history_type], history)
     else:
-        history.append({
-            "id": task_id,
-            "task": task,
-            "log": [log_entry]
-        })
-
-def _run_normal_tasks(driver, tasks, history, history_filename, today, stream_progress, job_counter, total_job_count, save_screenshot=True):
-    """HPB通常検索タスクを実行する"""
-    for task in tasks:
-        job_counter += 1
-        task_id = task['id']
-        area_name_for_task = task.get('areaName', '')
-        task_name = f"[{area_name_for_task}] {task.get('serviceKeyword', '')}"
-        task['areaName'] = area_name_for_task
-
-        if stream_progress:
-            yield sse_format({"progress": {"current": job_counter, "total": total_job_count, "task": task}})
-        else:
-            current_app.logger.info(f"タスク '{task_id}' の計測を開始...")
+        save_json_file(config.HISTORY_FILES[history_type], history)
 
-        result = {}
-        try:
-            try:
-                generator = check_hotpepper_ranking(driver, task.get('serviceKeyword', ''), task['salonName'], task['areaCodes'], save_screenshot=save_screenshot)
-            except TypeError:
-                # save_screenshot引数に対応していない場合のフォールバック
-                generator = check_hotpepper_ranking(driver, task.get('serviceKeyword', ''), task['salonName'], task['areaCodes'])
-
-            for sse_message in generator:
-                data = json.loads(sse_message.split('data: ')[1])
-                if stream_progress and 'status' in data:
-                    yield sse_format({"status": data['status'], "task_name": task_name})
-                if 'final_result' in data:
-                    result = data['final_result']
-        except Exception as e:
-            current_app.logger.exception(f"HPB通常タスク '{task_id}' の実行中にエラーが発生しました。")
-            result = {"rank": "エラー"}
+def save_history_order(history_type, history, writer=None):
+    """
+    計測の終了時に、並び替えた履歴を保存する。
+    SQLiteの場合は並び順のみを更新し、計測中に他から保存された結果 (手動計測など) を上書きしない
+    """
+    if config.HISTORY_BACKEND == 'sqlite':
+        get_history_store().update_positions(history_type, [item['id'] for item in history])
+    else:
+        save_history(history_type, history, writer=writer)
 
-        rank_to_save = result.get('results', [{}])[0].get('rank', result.get('rank', '圏外'))
-        update_history(history, task, today, rank_to_save, result.get('screenshot_path'))
-        save_json_file(history_filename, history) # 1件ごとに保存
-        current_app.logger.info(f"タスク '{task_id}' の結果: {rank_to_save}位")
+def record_history(history_type, history, task, date_str, rank, screenshot_path, writer=None):
+    """
+    1件の計測結果を履歴 (HistoryIndex) に反映して保存する。
+    SQLiteの場合は該当行のみ、ジャーナル有効時はジャーナルへの1行追記のみを書き込む
+    """
+    update_history(history, task, date_str, rank, screenshot_path)
+    if config.HISTORY_BACKEND == 'sqlite':
+        get_history_store().upsert_result(history_type, task, date_str, rank, screenshot_path)
+    elif config.HISTORY_JOURNAL_ENABLED:
+        rank_journal.append_result(history_type, task, date_str, rank, screenshot_path)
+    elif writer:
+        writer.schedule(config.HISTORY_FILES[history_type], history.items)
+    else:
+        save_json_file(config.HISTORY_FILES[history_type], history.items)
 
-        if stream_progress:
-            yield sse_format({"result": {"rank": rank_to_save, "total_count": result.get('total_count'), "task_name": task_name, "task_id": task_id}})
-            time.sleep(1)
-        else:
-            time.sleep(random.uniform(config.TASK_WAIT_TIME_MIN, config.TASK_WAIT_TIME_MAX))
-    return job_counter
-
-def _run_special_tasks(driver, tasks_grouped, history, history_filename, all_tasks, today, stream_progress, job_counter, total_job_count, save_screenshot=True):
-    """HPB特集ページタスクを実行する"""
-    for url, tasks_in_group in tasks_grouped.items():
-        job_counter += 1
-        salon_names_in_group = [t['salonName'] for t in tasks_in_group]
+def update_history(history, task, date_str, rank, screenshot_path):
+    """履歴 (HistoryIndex) を更新するヘルパー関数"""
+    history.update(task, date_str, rank, screenshot_path)
+
+def _normal_search_key(task):
+    """HPB通常検索で同じ検索結果になるタスクをまとめるためのキー (キーワード, 空でないエリアコード)"""
+    area_codes = {k: v for k, v in task.get('areaCodes', {}).items() if v}
+    return (task.get('serviceKeyword', ''), tuple(sorted(area_codes.items())))
+
+def _build_jobs(normal_tasks_grouped, special_tasks_grouped, meo_tasks_grouped):
+    """タスクを計測ジョブ (1回のスクレイピング単位) に変換する"""
+    jobs = []
+    for tasks_in_group in normal_tasks_grouped.values():
+        for task in tasks_in_group:
+            task['areaName'] = task.get('areaName', '')
+        representative_task = tasks_in_group[0]
+        jobs.append({
+            "kind": "normal", "tasks": tasks_in_group, "display_task": representative_task,
+            "name": f"[{representative_task['areaName']}] {representative_task.get('serviceKeyword', '')}",
+        })
+    for url, tasks_in_group in special_tasks_grouped.items():
         # フロントエンド表示用にフィールドを補完
         representative_task = tasks_in_group[0].copy()
         representative_task['areaName'] = '特集'
         representative_task['serviceKeyword'] = representative_task.get('featurePageName', url)
-        task_name = representative_task.get('featurePageName', url)
-
-        if stream_progress:
-            yield sse_format({"progress": {"current": job_counter, "total": total_job_count, "task": representative_task}})
-        else:
-            current_app.logger.info(f"特集ページ '{url}' の一括計測を開始... 対象サロン: {salon_names_in_group}")
-
-        result = {}
-        try:
-            try:
-                generator = check_feature_page_ranking(driver, url, salon_names_in_group, save_screenshot=save_screenshot)
-            except TypeError:
-                # save_screenshot引数に対応していない場合のフォールバック
-                generator = check_feature_page_ranking(driver, url, salon_names_in_group)
-
-            for sse_message in generator:
-                data = json.loads(sse_message.split('data: ')[1])
-                if stream_progress and 'status' in data:
-                    yield sse_format({"status": data['status'], "task_name": task_name})
-                if 'final_result' in data:
-                    result = data['final_result']
-        except Exception as e:
-            current_app.logger.exception(f"HPB特集タスク '{url}' の実行中にエラーが発生しました。")
-            result = {}
-
-        for task in tasks_in_group:
-            task_id = task['id']
-            salon_name = task['salonName']
-            page_title = result.get('page_title')
-            if page_title and not task.get('featurePageName'):
-                task['featurePageName'] = page_title
-                original_task = next((t for t in all_tasks if t.get('id') == task_id), None)
-                if original_task: original_task['featurePageName'] = page_title
-
-            salon_results = result.get('results_map', {}).get(salon_name, [])
-            rank_to_save = salon_results[0]['rank'] if salon_results else '圏外'
-            update_history(history, task, today, rank_to_save, result.get('screenshot_path'))
-            save_json_file(history_filename, history) # 1件ごとに保存
-            current_app.logger.info(f"タスク '{task_id}' ({salon_name}) の結果: {rank_to_save}位")
-
-            if stream_progress:
-                individual_task_name = f"[{task['salonName']}] {task.get('featurePageName', task.get('featurePageUrl'))}"
-                yield sse_format({"result": {"rank": rank_to_save, "total_count": result.get('total_count'), "task_name": individual_task_name, "task_id": task_id}})
-                time.sleep(1)
-        
-        if not stream_progress:
-            time.sleep(random.uniform(config.TASK_WAIT_TIME_MIN, config.TASK_WAIT_TIME_MAX))
-    return job_counter
-
-def _run_meo_tasks(driver, tasks_grouped, history, history_filename, today, stream_progress, job_counter, total_job_count, save_screenshot=True):
-    """MEOタスクを実行する"""
-    for (location, keyword), tasks_in_group in tasks_grouped.items():
-        job_counter += 1
+        jobs.append({
+            "kind": "special", "tasks": tasks_in_group, "display_task": representative_task,
+            "name": representative_task.get('featurePageName', url), "url": url,
+        })
+    for (location, keyword), tasks_in_group in meo_tasks_grouped.items():
         # フロントエンド表示用にフィールドを補完 ([undefined] undefined 回避)
         representative_task = tasks_in_group[0].copy()
         representative_task['areaName'] = location
         representative_task['serviceKeyword'] = keyword
-        task_name = f"[{location}] {keyword}"
-
-        if stream_progress:
-            yield sse_format({"progress": {"current": job_counter, "total": total_job_count, "task": representative_task}})
-        else:
-            current_app.logger.info(f"MEO一括計測 '{task_name}' を開始...")
+        jobs.append({
+            "kind": "google", "tasks": tasks_in_group, "display_task": representative_task,
+            "name": f"[{location}] {keyword}", "location": location, "keyword": keyword,
+        })
+    return jobs
 
-        result = {}
+def _create_scraper(driver, job, save_screenshot, force_refresh=False):
+    """ジョブの種類に応じたスクレイパーのジェネレータを返す"""
+    if job['kind'] == 'normal':
+        task = job['tasks'][0]
+        salon_names_in_group = [t['salonName'] for t in job['tasks']]
         try:
-            try:
-                scraper_generator = check_meo_ranking(driver, keyword, location, target_salon_name=tasks_in_group[0]['salonName'], save_screenshot=save_screenshot)
-            except TypeError:
-                # save_screenshot引数に対応していない場合のフォールバック
-                scraper_generator = check_meo_ranking(driver, keyword, location)
-
-            for sse_message in scraper_generator:
-                data = json.loads(sse_message.split('data: ')[1])
-                if stream_progress and 'status' in data:
-                    yield sse_format({"status": data['status'], "task_name": task_name})
-                if 'final_result' in data:
-                    result = data['final_result']
-        except Exception as e:
-            current_app.logger.exception(f"MEOタスク '{task_name}' の実行中にエラーが発生しました。")
-            result = {}
+            return check_hotpepper_ranking(driver, task.get('serviceKeyword', ''), salon_names_in_group, task['areaCodes'], save_screenshot=save_screenshot,
+                                           stop_on_first_match=config.SCHEDULED_STOP_ON_FIRST_MATCH, force_refresh=force_refresh)
+        except TypeError:
+            # save_screenshot引数に対応していない場合のフォールバック
+            return check_hotpepper_ranking(driver, task.get('serviceKeyword', ''), salon_names_in_group, task['areaCodes'])
+    if job['kind'] == 'special':
+        salon_names_in_group = [t['salonName'] for t in job['tasks']]
+        try:
+            return check_feature_page_ranking(driver, job['url'], salon_names_in_group, save_screenshot=save_screenshot,
+                                              stop_on_first_match=config.SCHEDULED_STOP_ON_FIRST_MATCH, force_refresh=force_refresh)
+        except TypeError:
+            return check_feature_page_ranking(driver, job['url'], salon_names_in_group)
+    try:
+        return check_meo_ranking(driver, job['keyword'], job['location'], target_salon_name=job['tasks'][0]['salonName'], save_screenshot=save_screenshot,
+                                 force_refresh=force_refresh)
+    except TypeError:
+        return check_meo_ranking(driver, job['keyword'], job['location'])
+
+def _scrape_job(job, emit, save_screenshot=True, force_refresh=False):
+    """ワーカースレッドで1件のジョブをスクレイピングし、final_result を返す"""
+    if job['kind'] == 'special':
+        current_app.logger.info(f"特集ページ '{job['url']}' の一括計測を開始... 対象サロン: {[t['salonName'] for t in job['tasks']]}")
+    elif job['kind'] == 'google':
+        current_app.logger.info(f"MEO一括計測 '{job['name']}' を開始...")
+    else:
+        current_app.logger.info(f"HPB検索 '{job['name']}' の計測を開始... 対象タスク: {[t['id'] for t in job['tasks']]}")
 
-        for task in tasks_in_group:
-            try:
-                task_id = task['id']
+    result = {}
+    try:
+        # ブラウザはジョブごとにプールから借りる。HPB通常検索はスクレイパーが必要な場合のみ自分で借りる
+        browser = contextlib.nullcontext() if job['kind'] == 'normal' else get_webdriver(is_seo=False)
+        with browser as driver:
+            # スクレイパーは進捗・結果をイベントオブジェクトで返す (SSE形式への変換はブラウザに送る時だけ app.py で行う)
+            for event in _create_scraper(driver, job, save_screenshot, force_refresh):
+                if isinstance(event, Status):
+                    emit(event.message)
+                elif isinstance(event, FinalResult):
+                    result = event.result
+    except Exception as e:
+        current_app.logger.exception(f"ジョブ '{job['name']}' の実行中にエラーが発生しました。")
+        result = {"rank": "エラー"} if job['kind'] == 'normal' else {}
+    return result
+
+def _record_job_result(job, result, histories, all_tasks, today, stream_progress, history_writer=None):
+    """ジョブの結果を各タスクの履歴に保存する（呼び出し元のスレッドのみで実行される）"""
+    kind = job['kind']
+    history = histories[kind]
+
+    for task in job['tasks']:
+        task_id = task['id']
+        try:
+            if kind == 'normal':
+                # 同じキーワード・エリアのタスクは1回の検索結果をサロンごとに振り分ける
+                salon_results = result.get('results_map', {}).get(task['salonName'], [])
+                rank_to_save = salon_results[0]['rank'] if salon_results else result.get('rank', '圏外')
+                individual_task_name = job['name'] if len(job['tasks']) == 1 else f"[{task['salonName']}] {job['name']}"
+            elif kind == 'special':
+                page_title = result.get('page_title')
+                if page_title and not task.get('featurePageName'):
+                    task['featurePageName'] = page_title
+                    original_task = next((t for t in all_tasks if t.get('id') == task_id), None)
+                    if original_task: original_task['featurePageName'] = page_title
+
+                salon_results = result.get('results_map', {}).get(task['salonName'], [])
+                rank_to_save = salon_results[0]['rank'] if salon_results else '圏外'
+                individual_task_name = f"[{task['salonName']}] {task.get('featurePageName', task.get('featurePageUrl'))}"
+            else:
                 if result.get("rank") == "枠無":
                     rank_to_save = "枠無"
                 else:
                     my_salon_result = next((r for r in result.get('results', []) if task['salonName'].lower() in r.get('foundSalonName', '').lower()), None)
                     rank_to_save = my_salon_result['rank'] if my_salon_result else '圏外'
-                
-                screenshot_path_to_save = result.get('screenshot_path')
-                update_history(history, task, today, rank_to_save, screenshot_path_to_save)
-                save_json_file(history_filename, history) # 1件ごとに保存
-                current_app.logger.info(f"MEOタスク '{task_id}' の結果: {rank_to_save}")
+                individual_task_name = f"[{task['salonName']}] {job['name']}"
 
-                if stream_progress:
-                    individual_task_name = f"[{task['salonName']}] {task_name}"
-                    yield sse_format({"result": {"rank": rank_to_save, "total_count": result.get('total_count'), "task_name": individual_task_name, "task_id": task_id}})
-                    time.sleep(1)
-            except Exception as e:
-                current_app.logger.exception(f"MEOタスク '{task.get('id', '不明')}' の結果処理中にエラーが発生しました。")
-                update_history(history, task, today, "エラー", None)
-                save_json_file(history_filename, history) # エラー時も保存
-
-        if not stream_progress:
-            time.sleep(random.uniform(config.TASK_WAIT_TIME_MIN, config.TASK_WAIT_TIME_MAX))
-    return job_counter
-
-def run_scheduled_check(task_ids_to_run=None, stream_progress=False, save_screenshot=True):
+            record_history(kind, history, task, today, rank_to_save, result.get('screenshot_path'), writer=history_writer) # 1件ごとに保存 (書き込みはまとめて行う)
+            current_app.logger.info(f"タスク '{task_id}' ({task['salonName']}) の結果: {rank_to_save}")
+
+            if stream_progress:
+                yield TaskResult(rank_to_save, result.get('total_count'), individual_task_name, task_id)
+        except Exception as e:
+            current_app.logger.exception(f"タスク '{task.get('id', '不明')}' の結果処理中にエラーが発生しました。")
+            record_history(kind, history, task, today, "エラー", None, writer=history_writer) # エラー時も保存
+
+def _job_failed(result):
+    """_scrape_job の結果が、スクレイピングに失敗したものか"""
+    return not result or result.get('rank') == 'エラー'
+
+def run_scheduled_check(task_ids_to_run=None, stream_progress=False, save_screenshot=True, force_refresh=False, trigger='scheduled', resume_run_id=None):
     """
-    指定されたタスク、またはすべてのタスクを実行し、結果を履歴ファイルに保存する
+    指定されたタスク、またはすべてのタスクを実行し、結果を履歴ファイルに保存する。
+    実行の記録 (ジョブごとの状態) は run_manifest に保存し、途中で終わった場合は resume_run_id で再開できる。
     :param task_ids_to_run: 実行するタスクIDのリスト。Noneの場合は全タスクを実行。
+    :param force_refresh: Trueの場合、検索結果キャッシュを使わずにすべて取得し直す
+    :param trigger: 実行のきっかけ ('scheduled' または 'manual')。マニフェストに記録する
+    :param resume_run_id: 指定した場合、その実行のうち終わっていないジョブだけを、同じ条件で実行し直す
     """
-    current_app.logger.info("--- 自動計測ジョブを開始します ---")
+    today = datetime.date.today().strftime('%Y/%m/%d')
+    history_normal = HistoryIndex(load_history('normal'))
+    history_special = HistoryIndex(load_history('special'))
+    history_meo = HistoryIndex(load_history('google'))
+    histories = {'normal': history_normal, 'special': history_special, 'google': history_meo}
+
+    manifest = None
+    if resume_run_id:
+        manifest = run_manifest.load(resume_run_id)
+        if manifest is None or manifest['date'] != today:
+            message = f"実行 {resume_run_id} は見つからないか、当日の実行ではないため再開できません。"
+            current_app.logger.warning(message)
+            yield Error(message)
+            return
+        if manifest['status'] == 'running':
+            message = f"実行 {resume_run_id} は実行中です。"
+            current_app.logger.warning(message)
+            yield Error(message)
+            return
+        task_ids_to_run = run_manifest.unfinished_task_ids(manifest, histories)
+        if not task_ids_to_run:
+            # 実行回数が上限に達したジョブを failed にしてから終了する
+            run_manifest.start_resume(manifest)
+            run_manifest.finish(manifest)
+            yield Completed(f"実行 {resume_run_id} に再実行が必要なジョブはありません。")
+            return
+        save_screenshot = manifest['options'].get('save_screenshot', True)
+        force_refresh = manifest['options'].get('force_refresh', False)
+        current_app.logger.info(f"--- 実行 {resume_run_id} の終わっていないタスク {len(task_ids_to_run)} 件を再開します ---")
+        if stream_progress:
+            yield Status(f"実行 {resume_run_id} の終わっていないタスク {len(task_ids_to_run)} 件を再開します。")
+    else:
+        current_app.logger.info("--- 自動計測ジョブを開始します ---")
     all_tasks = load_json_file(config.TASKS_FILE)
 
     tasks_to_run = []
@@ -229,12 +316,7 @@ def run_scheduled_check(task_ids_to_run=None, stream_progress=False, save_screen
         current_app.logger.info("スケジュールされた全タスクを実行します。")
         tasks_to_run = all_tasks
 
-    history_normal = load_json_file(config.HISTORY_FILES['normal'])
-    history_special = load_json_file(config.HISTORY_FILES['special'])
-    history_meo = load_json_file(config.HISTORY_FILES['google'])
-    today = datetime.date.today().strftime('%Y/%m/%d')
-
-    normal_tasks = []
+    normal_tasks_grouped = {} # 同じキーワード・エリアの通常タスクは1回の検索にまとめる
     special_tasks_grouped_by_url = {}
     meo_tasks_grouped = {} # MEOタスクをグループ化するための辞書
     for task in tasks_to_run:
@@ -250,47 +332,95 @@ def run_scheduled_check(task_ids_to_run=None, stream_progress=False, save_screen
                 meo_tasks_grouped[group_key] = []
             meo_tasks_grouped[group_key].append(task)
         else:
-            normal_tasks.append(task)
-
-    total_job_count = len(normal_tasks) + len(special_tasks_grouped_by_url) + len(meo_tasks_grouped)
+            group_key = _normal_search_key(task)
+            if group_key not in normal_tasks_grouped:
+                normal_tasks_grouped[group_key] = []
+            normal_tasks_grouped[group_key].append(task)
+
+    # MEO計測で使う地点の座標は、計測を始める前にまとめて取得しておく (取得済みの地点はキャッシュを使う)
+    if meo_tasks_grouped and config.GOOGLE_API_KEY:
+        prefill_geocode_cache([location for location, _ in meo_tasks_grouped])
+
+    normal_task_count = sum(len(tasks_in_group) for tasks_in_group in normal_tasks_grouped.values())
+    if normal_task_count:
+        current_app.logger.info(f"HPB通常タスク {normal_task_count} 件を {len(normal_tasks_grouped)} 件の検索にまとめて実行します。")
+    jobs = _build_jobs(normal_tasks_grouped, special_tasks_grouped_by_url, meo_tasks_grouped)
+    if manifest is None:
+        manifest = run_manifest.create(jobs, today, trigger, {
+            "task_ids": task_ids_to_run, "save_screenshot": save_screenshot, "force_refresh": force_refresh,
+        })
+    else:
+        run_manifest.start_resume(manifest)
+        run_manifest.sync_jobs(manifest, jobs)
+    current_app.logger.info(f"実行ID: {manifest['run_id']} ({len(jobs)}件のジョブ)")
+    total_job_count = len(jobs)
     job_counter = 0
+    pages_skipped = 0 # 対象サロンが見つかったため検索を省略したページ数の合計（監視用）
+    # 1件ごとの履歴保存をまとめ、HISTORY_FLUSH_INTERVAL 秒に1回だけファイルに書き込む
+    history_writer = CoalescingWriter(config.HISTORY_FLUSH_INTERVAL)
 
-    try:
-        # --- HPB通常, 特集, MEOタスクの処理 ---
-        if normal_tasks or special_tasks_grouped_by_url or meo_tasks_grouped:
-            with get_webdriver(is_seo=False) as driver:
-                # HPB通常タスク
-                yield from _run_normal_tasks(driver, normal_tasks, history_normal, config.HISTORY_FILES['normal'], today, stream_progress, job_counter, total_job_count, save_screenshot=save_screenshot)
-                job_counter = len(normal_tasks)
+    def run_job(_resource, job, emit):
+        return _scrape_job(job, emit, save_screenshot=save_screenshot, force_refresh=force_refresh)
 
-                # HPB特集タスク
-                yield from _run_special_tasks(driver, special_tasks_grouped_by_url, history_special, config.HISTORY_FILES['special'], all_tasks, today, stream_progress, job_counter, total_job_count, save_screenshot=save_screenshot)
-                job_counter += len(special_tasks_grouped_by_url)
-
-                # MEOタスク
-                yield from _run_meo_tasks(driver, meo_tasks_grouped, history_meo, config.HISTORY_FILES['google'], today, stream_progress, job_counter, total_job_count, save_screenshot=save_screenshot)
-                job_counter += len(meo_tasks_grouped)
+    try:
+        # --- HPB通常, 特集, MEOタスクを複数のワーカーで並列に処理 (ブラウザはジョブごとにプールから借りる) ---
+        # 各ワーカーの進捗はこのスレッドで受け取り、履歴の書き込みもこのスレッドだけで行う
+        # 同じサイトへのアクセス頻度は、各スクレイパー内で rate_limiter により全ワーカー共通で制御される
+        events = worker_pool.run_jobs(jobs, config.MEASUREMENT_WORKER_COUNT, run_job)
+        for event_type, job, payload in events:
+            if event_type == "start":
+                job_counter += 1
+                run_manifest.update_job(manifest, job, 'running')
+                if stream_progress:
+                    yield Progress(job_counter, total_job_count, job['display_task'])
+            elif event_type == "status":
+                if stream_progress:
+                    yield Status(payload, task_name=job['name'])
+            elif event_type == "done":
+                pages_skipped += payload.get('pages_skipped', 0)
+                yield from _record_job_result(job, payload, histories, all_tasks, today, stream_progress, history_writer=history_writer)
+                run_manifest.update_job(manifest, job, 'failed' if _job_failed(payload) else 'done')
+            elif event_type == "worker_error":
+                if stream_progress:
+                    yield Status(f"ブラウザの起動に失敗しました: {payload}")
+            elif event_type == "skipped":
+                current_app.logger.error(f"ブラウザを起動できなかったため、ジョブ '{job['name']}' は実行されませんでした。")
+                run_manifest.update_job(manifest, job, 'skipped')
+                if stream_progress:
+                    yield Error(f"ブラウザを起動できなかったため、'{job['name']}' は計測されませんでした。")
 
     except Exception as e:
         current_app.logger.exception("自動計測ジョブ全体で予期せぬエラーが発生しました。")
         if stream_progress:
-            yield sse_format({"error": f"計測ジョブ全体で予期せぬエラーが発生しました: {e}"})
+            yield Error(f"計測ジョブ全体で予期せぬエラーが発生しました: {e}")
     finally:
         # 履歴を保存する前に、tasks.jsonの順序にソートする
         task_id_order = {task['id']: i for i, task in enumerate(all_tasks)}
-        
-        history_normal.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
-        history_special.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
-        history_meo.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
-        
-        current_app.logger.info("履歴データをタスク定義ファイルの順序に並び替えて保存します。")
-
-        save_json_file(config.HISTORY_FILES['normal'], history_normal)
-        save_json_file(config.HISTORY_FILES['special'], history_special)
-        save_json_file(config.HISTORY_FILES['google'], history_meo)
-        save_json_file(config.TASKS_FILE, all_tasks)
+        use_journal = config.HISTORY_BACKEND != 'sqlite' and config.HISTORY_JOURNAL_ENABLED
+        try:
+            current_app.logger.info("履歴データをタスク定義ファイルの順序に並び替えて保存します。")
+            current_app.logger.info(f"対象サロンが見つかったため省略した検索ページ数: {pages_skipped}")
+
+            if not use_journal:
+                # ジャーナル有効時は、下のジャーナルの反映で並べ替えと保存をまとめて1回で行う
+                history_normal.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
+                history_special.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
+                history_meo.sort(key=lambda x: task_id_order.get(x['id'], float('inf')))
+
+                save_history_order('normal', history_normal.items, writer=history_writer)
+                save_history_order('special', history_special.items, writer=history_writer)
+                save_history_order('google', history_meo.items, writer=history_writer)
+            save_json_file(config.TASKS_FILE, all_tasks, indent=2)
+        finally:
+            # 保留中の履歴は必ず書き込む
+            history_writer.close()
+            if use_journal:
+                # 計測中に追記したジャーナルをスナップショットに反映して空にし、タスク定義ファイルの順序に並べ替える
+                rank_journal.compact_all(orders={history_type: task_id_order for history_type in ('normal', 'special', 'google')})
+            # 履歴をすべて書き込んでから、実行の記録を終了状態にする
+            run_manifest.finish(manifest)
         
         if stream_progress:
-            yield sse_format({"final_status": f"すべての計測が完了しました。（{total_job_count}件）"})
+            yield Completed(f"すべての計測が完了しました。（{total_job_count}件）")
         else:
             current_app.logger.info("--- 自動計測ジョブが完了しました ---")
\ No newline at end of file
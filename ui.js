@@ -3,7 +3,7 @@
  */
 import { areas } from './config.js';
 import * as dom from './dom.js';
-import { saveAutoTasksAPI, saveScheduleAPI, fetchScheduleAPI } from './api.js';
+import { saveAutoTasksAPI, saveScheduleAPI, fetchScheduleAPI, enqueueJobAPI, streamJobEventsAPI } from './api.js';
 import { checkRank } from './manualChecker.js'; // この行を追加
 import { fetchAndDisplayAutoHistory } from './history.js';
 
@@ -220,34 +220,8 @@ function getDurationString(startTime) {
 async function processStream(taskIds, saveScreenshot = true) {
     if (taskIds.length === 0) return;
 
-    const response = await fetch('/api/run-tasks-manually', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ task_ids: taskIds, save_screenshot: saveScreenshot })
-    });
-
-    if (!response.body) throw new Error('Response body is missing');
-
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-
-    while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value, { stream: true });
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-            if (line.startsWith('data: ')) {
-                const jsonData = line.substring(6);
-                if (!jsonData) continue;
-
-                const data = JSON.parse(jsonData);
-                handleStreamData(data);
-            }
-        }
-    }
+    const jobId = await enqueueJobAPI('/api/run-tasks-manually', { task_ids: taskIds, save_screenshot: saveScreenshot });
+    await streamJobEventsAPI(jobId, handleStreamData);
 }
 
 function handleStreamData(data) {
@@ -1,19 +1,73 @@
 import json
+import threading
+import time
 import requests
 import urllib.parse
+from requests.adapters import HTTPAdapter
+from flask import current_app
 import config
+from json_cache import load_json_file, save_json_file
 
-def sse_format(data: dict) -> str:
-    """Server-Sent Eventsのフォーマットで文字列を返す"""
-    return f"data: {json.dumps(data)}\n\n"
+def sse_format(data: dict, event_id=None) -> str:
+    """
+    Server-Sent Eventsのフォーマットで文字列を返す
+    :param event_id: 指定した場合は id: 行を付ける (再接続時にブラウザが Last-Event-ID として送り返す)
+    """
+    if event_id is None:
+        return f"data: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\ndata: {json.dumps(data)}\n\n"
 
-def get_lat_lng_from_address(address):
-    """地名から緯度・経度を取得する"""
+# ジオコーディング結果のキャッシュ (地名 -> {"lat", "lng", "cached_at"})。config.GEOCODE_CACHE_FILE にも保存する
+_geocode_cache = None
+_geocode_lock = threading.Lock()
+_geocode_session = None
+
+def _get_geocode_session():
+    """Geocoding API用に使い回す requests.Session を返す (Keep-Alive)"""
+    global _geocode_session
+    with _geocode_lock:
+        if _geocode_session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_maxsize=4))
+            _geocode_session = session
+        return _geocode_session
+
+def _load_geocode_cache():
+    """ディスク上のジオコーディングキャッシュを読み込む（呼び出し元で _geocode_lock を取得していること）"""
+    global _geocode_cache
+    if _geocode_cache is None:
+        data = load_json_file(config.GEOCODE_CACHE_FILE)
+        _geocode_cache = data if isinstance(data, dict) else {}
+    return _geocode_cache
+
+def _get_cached_lat_lng(address):
+    """キャッシュ済みの座標を返す。ない場合や古くなった場合は None を返す"""
+    with _geocode_lock:
+        entry = _load_geocode_cache().get(address)
+    if not entry:
+        return None
+    if config.GEOCODE_CACHE_MAX_AGE_DAYS and time.time() - entry.get('cached_at', 0) > config.GEOCODE_CACHE_MAX_AGE_DAYS * 86400:
+        return None
+    return entry['lat'], entry['lng']
+
+def _store_lat_lng(results):
+    """{地名: (緯度, 経度)} をキャッシュに追加し、ファイルに保存する"""
+    if not results:
+        return
+    now = time.time()
+    with _geocode_lock:
+        cache = _load_geocode_cache()
+        for address, (lat, lng) in results.items():
+            cache[address] = {"lat": lat, "lng": lng, "cached_at": now}
+        save_json_file(config.GEOCODE_CACHE_FILE, cache, indent=2)
+
+def _geocode(address):
+    """Geocoding APIで地名から緯度・経度を取得する"""
     if not config.GOOGLE_API_KEY:
         raise ValueError("Google APIキーが設定されていません。")
 
     geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={urllib.parse.quote(address)}&key={config.GOOGLE_API_KEY}&language=ja"
-    response = requests.get(geocode_url)
+    response = _get_geocode_session().get(geocode_url, timeout=10)
     response.raise_for_status()
     data = response.json()
 
@@ -21,4 +75,30 @@ def get_lat_lng_from_address(address):
         location = data['results'][0]['geometry']['location']
         return location['lat'], location['lng']
     else:
-        raise ValueError(f"ジオコーディングに失敗しました: {data.get('error_message', data['status'])}")
\ No newline at end of file
+        raise ValueError(f"ジオコーディングに失敗しました: {data.get('error_message', data['status'])}")
+
+def get_lat_lng_from_address(address):
+    """地名から緯度・経度を取得する（一度取得した地名はキャッシュから返す）"""
+    cached = _get_cached_lat_lng(address)
+    if cached:
+        return cached
+    lat_lng = _geocode(address)
+    _store_lat_lng({address: lat_lng})
+    return lat_lng
+
+def prefill_geocode_cache(addresses):
+    """
+    計測開始前に、まだキャッシュにない地名の座標をまとめて取得しておく。
+    取得に失敗した地名はスキップする（計測時に改めて取得を試みる）。
+    """
+    missing = [address for address in dict.fromkeys(addresses) if address and not _get_cached_lat_lng(address)]
+    if not missing:
+        return
+    current_app.logger.info(f"{len(missing)} 件の地点の座標を事前に取得します。")
+    results = {}
+    for address in missing:
+        try:
+            results[address] = _geocode(address)
+        except (requests.RequestException, ValueError) as e:
+            current_app.logger.warning(f"地点「{address}」の座標の事前取得に失敗しました: {e}")
+    _store_lat_lng(results)
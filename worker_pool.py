@@ -0,0 +1,81 @@
+import contextlib
+import queue
+import threading
+from flask import current_app
+
+"""
+計測ジョブを複数のワーカースレッドで並列に処理するモジュール。
+ワーカーはジョブの実行だけを行い、進捗や結果はイベントとして呼び出し元のスレッドに返します。
+履歴の書き込みなどは呼び出し元の1スレッドで行うため、ワーカー間での競合はありません。
+"""
+
+def run_jobs(jobs, worker_count, run_job, open_resource=None):
+    """
+    jobs を worker_count 個のワーカーで処理し、イベントを発生順に返すジェネレータ。
+    イベントは (種類, ジョブ, 内容) のタプルで、種類は次のいずれか。
+    - "start": ジョブの実行を開始した
+    - "status": run_job から進捗メッセージが届いた (内容はメッセージ)
+    - "done": ジョブが完了した (内容は run_job の戻り値。例外時は {})
+    - "worker_error": ワーカーの起動に失敗した (内容は例外、ジョブは None)
+    - "skipped": すべてのワーカーが停止したため実行されなかった
+
+    :param run_job: run_job(resource, job, emit) の形で呼ばれる関数。emit(message) で進捗を通知できる
+    :param open_resource: ワーカーごとに1回呼ばれ、ジョブの実行に使うリソース (WebDriverなど) を返すコンテキストマネージャを返す関数。
+                          省略した場合、resource は None になる
+    """
+    if not jobs:
+        return
+    app = current_app._get_current_object()
+    job_queue = queue.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    event_queue = queue.Queue()
+    stop_event = threading.Event()
+
+    def worker():
+        with app.app_context():
+            try:
+                with (open_resource() if open_resource else contextlib.nullcontext()) as resource:
+                    while not stop_event.is_set():
+                        try:
+                            job = job_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        event_queue.put(("start", job, None))
+                        try:
+                            result = run_job(resource, job, lambda message, job=job: event_queue.put(("status", job, message)))
+                        except Exception:
+                            current_app.logger.exception(f"ジョブ '{job.get('name')}' の実行中にエラーが発生しました。")
+                            result = {}
+                        event_queue.put(("done", job, result))
+            except Exception as e:
+                current_app.logger.exception("計測ワーカーの起動中にエラーが発生しました。")
+                event_queue.put(("worker_error", None, e))
+            finally:
+                event_queue.put(("exit", None, None))
+
+    worker_count = max(1, min(worker_count, len(jobs)))
+    threads = [threading.Thread(target=worker, name=f"measure-worker-{i + 1}", daemon=True) for i in range(worker_count)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        exited = 0
+        while exited < len(threads):
+            event = event_queue.get()
+            if event[0] == "exit":
+                exited += 1
+                continue
+            yield event
+
+        # すべてのワーカーが異常終了した場合、残ったジョブを通知する
+        while True:
+            try:
+                yield ("skipped", job_queue.get_nowait(), None)
+            except queue.Empty:
+                break
+    finally:
+        # 呼び出し元が途中で終了した場合も、新しいジョブを取らせずにワーカーの終了を待つ
+        stop_event.set()
+        for thread in threads:
+            thread.join()